@@ -4,9 +4,40 @@ import sys
 import time
 import threading
 import os
+import re
+import struct
+import bisect
+import selectors
+import ipaddress
+import functools
+import tempfile
+import zipfile
+import shutil
+import sqlite3
+import tracemalloc
+import errno
+import heapq
+import hmac
+import secrets
+import json
+import socketserver
+import random
+import ssl
+import html
+import http.client
+from array import array
 from queue import Queue
-from typing import List, Tuple, Dict
+from collections import deque
+from typing import List, Tuple, Dict, Iterator, Optional
 from colorama import Fore, init, Style
+try:
+    import resource
+except ImportError:  # Windows下没有resource模块
+    resource = None
+try:
+    import curses
+except ImportError:  # Windows下需要额外安装 windows-curses
+    curses = None
 import openpyxl
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
@@ -31,14 +62,629 @@ def get_unique_filename(base_name: str, extension: str) -> str:
     return filename
 
 
-def export_to_excel(results: List[Dict]) -> None:
-    """将扫描结果导出到Excel文件并进行美化处理"""
-    if not results:
+def ipv4_to_int(ip: str) -> Optional[int]:
+    """点分十进制IPv4地址转为整数，非IPv4字面量（如域名）返回None"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, ValueError):
+        return None
+
+
+def int_to_ipv4(value: int) -> str:
+    """整数转为点分十进制IPv4地址"""
+    return socket.inet_ntop(socket.AF_INET, value.to_bytes(4, "big"))
+
+
+def ipv6_to_bytes(ip: str) -> Optional[bytes]:
+    """IPv6地址转为16字节，非IPv6字面量返回None"""
+    if ":" not in ip:
+        return None
+    try:
+        return socket.inet_pton(socket.AF_INET6, ip)
+    except (OSError, ValueError):
+        return None
+
+
+def format_target(ip: str, port: int) -> str:
+    """格式化 地址:端口，IPv6地址加方括号"""
+    return f"[{ip}]:{port}" if ":" in ip else f"{ip}:{port}"
+
+
+def address_sort_key(ip: str) -> bytes:
+    """地址的字节序排序键，与ResultStore的排序一致：IPv4按数值在前，其次域名，最后IPv6"""
+    value = ipv4_to_int(ip)
+    if value is not None:
+        return b"\x00" + value.to_bytes(4, "big")
+    packed = ipv6_to_bytes(ip)
+    if packed is not None:
+        return b"\x02" + packed
+    return b"\x01" + ip.encode("utf-8")
+
+
+# 合法的主机名：每段1-63个字母、数字或连字符，不以连字符开头或结尾，总长不超过253
+HOSTNAME_RE = re.compile(r"^(?=.{1,253}\.?$)(?!-)[A-Za-z0-9-]{1,63}(?<!-)(\.(?!-)[A-Za-z0-9-]{1,63}(?<!-))*\.?$")
+
+
+def is_hostname(name: str) -> bool:
+    """判断是否为合法的域名（最后一段不能全是数字，避免把写错的IP当作域名）"""
+    return bool(HOSTNAME_RE.match(name)) and not name.rstrip(".").rsplit(".", 1)[-1].isdigit()
+
+
+class ExclusionIndex:
+    """排除列表：CIDR网段、地址范围和单个地址合并为按起始地址排序的不重叠区间
+
+    成员判断为 O(log n) 的二分查找；subtract 从一个地址区间中整段扣除被排除的部分，
+    TargetList 建立索引时就去掉这些地址，任务生成器不需要逐个地址判断。
+    既不是地址也不是合法域名的行直接报错，避免写错的条目悄悄失效
+    """
+
+    def __init__(self, specs: List[str]):
+        self.specs = list(dict.fromkeys(spec.strip() for spec in specs if spec.strip()))
+        intervals = {4: [], 6: []}
+        self.names = set()  # 按名称排除的域名
+        for spec in self.specs:
+            parsed = TargetList.parse_spec(spec)
+            if parsed is None:
+                if not is_hostname(spec):
+                    raise ValueError(f"无效的排除项: {spec}")
+                self.names.add(spec.lower().rstrip("."))
+            else:
+                version, start, end = parsed
+                intervals[version].append((start, end))
+
+        # 合并重叠和相邻的区间，起止地址分别保存以便二分
+        self.starts = {4: [], 6: []}
+        self.ends = {4: [], 6: []}
+        for version in (4, 6):
+            starts, ends = self.starts[version], self.ends[version]
+            for start, end in sorted(intervals[version]):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.starts[4]) + len(self.starts[6]) + len(self.names)
+
+    def contains_value(self, version: int, value: int) -> bool:
+        position = bisect.bisect_right(self.starts[version], value) - 1
+        return position >= 0 and value <= self.ends[version][position]
+
+    def __contains__(self, ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip.strip("[]"))
+        except ValueError:
+            return ip.lower().rstrip(".") in self.names
+        return self.contains_value(address.version, int(address))
+
+    def subtract(self, version: int, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """从 [start, end] 中扣除被排除的区间，生成剩余的子区间"""
+        starts, ends = self.starts[version], self.ends[version]
+        position = max(0, bisect.bisect_right(starts, start) - 1)
+        while start <= end and position < len(starts) and starts[position] <= end:
+            if ends[position] >= start:
+                if starts[position] > start:
+                    yield start, starts[position] - 1
+                start = ends[position] + 1
+            position += 1
+        if start <= end:
+            yield start, end
+
+
+class TargetList:
+    """扫描目标列表：支持IPv4/IPv6地址、CIDR网段、地址范围和域名
+
+    网段和范围以合并后的区间保存，不展开为逐个地址；支持len()、下标访问和成员判断，
+    可以直接替代原来的IP列表交给任务生成器使用。
+    给出 exclude 时整段扣除被排除的区间，并去掉被排除或解析到排除区间内的域名
+    （resolve_names 为False时不解析，分布式工作节点使用协调端已过滤的目标）
+    """
+
+    def __init__(self, specs: List[str], exclude: ExclusionIndex = None, resolve_names: bool = True):
+        self.specs = list(dict.fromkeys(spec.strip() for spec in specs if spec.strip()))
+        self.exclude = exclude
+        intervals = {4: [], 6: []}
+        names = {}
+        for spec in self.specs:
+            parsed = self.parse_spec(spec)
+            if parsed is None:
+                names[spec] = None
+            else:
+                version, start, end = parsed
+                intervals[version].append((start, end))
+
+        # 合并重叠和相邻的区间，实现去重
+        self.segments = []  # [(版本, 起始整数, 结束整数)]
+        for version in (4, 6):
+            for start, end in sorted(intervals[version]):
+                if self.segments and self.segments[-1][0] == version and start <= self.segments[-1][2] + 1:
+                    last = self.segments[-1]
+                    self.segments[-1] = (version, last[1], max(last[2], end))
+                else:
+                    self.segments.append((version, start, end))
+        self.names = list(names)
+
+        # 排除列表：区间整段扣除，域名按名称或解析结果去掉
+        self.excluded = 0
+        if exclude:
+            before = sum(end - start + 1 for _, start, end in self.segments)
+            self.segments = [(version, low, high) for version, start, end in self.segments
+                             for low, high in exclude.subtract(version, start, end)]
+            self.excluded = before - sum(end - start + 1 for _, start, end in self.segments)
+            kept = [name for name in self.names
+                    if name.lower() not in exclude.names
+                    and not (resolve_names and self._resolves_into(name, exclude))]
+            dropped = set(self.names) - set(kept)
+            self.excluded += len(dropped)
+            self.names = kept
+            self.specs = [spec for spec in self.specs if spec not in dropped]
+        self.name_set = set(self.names)
+
+        # 每个区间的起始序号，用于二分定位
+        self.offsets = []
+        total = 0
+        for _, start, end in self.segments:
+            self.offsets.append(total)
+            total += end - start + 1
+        self.address_count = total
+        # len() 和下标只支持 sys.maxsize 以内的数量（约 IPv6 /65），更大的网段提前给出明确错误
+        if total + len(self.names) > sys.maxsize:
+            raise ValueError(f"目标地址数量过多（{total} 个），超出可扫描的范围，请拆分为更小的网段"
+                             f"（IPv6 前缀长度至少 /66）")
+        self.starts = {4: [], 6: []}
+        self.segment_index = {4: [], 6: []}
+        for index, (version, start, _) in enumerate(self.segments):
+            self.starts[version].append(start)
+            self.segment_index[version].append(index)
+
+    @staticmethod
+    def _resolves_into(name: str, exclude: ExclusionIndex) -> bool:
+        """域名是否解析到排除区间内
+
+        解析失败的域名保留：探测时 resolve_host 会再次按排除列表过滤解析结果
+        """
+        try:
+            addresses = _resolve_host_cached(name)
+        except (socket.gaierror, UnicodeError):
+            return False
+        return any(address[0].partition("%")[0] in exclude for _, address in addresses)
+
+    @staticmethod
+    def parse_spec(spec: str) -> Optional[Tuple[int, int, int]]:
+        """解析一个目标，返回 (IP版本, 起始整数, 结束整数)；域名返回None"""
+        if "/" in spec:
+            try:
+                network = ipaddress.ip_network(spec, strict=False)
+            except ValueError:
+                raise ValueError(f"无效的网段格式: {spec}")
+            return network.version, int(network.network_address), int(network.broadcast_address)
+
+        if "-" in spec:
+            left, right = (part.strip() for part in spec.split("-", 1))
+            try:
+                start = ipaddress.ip_address(left)
+            except ValueError:
+                start = None
+            if start is not None:
+                try:
+                    if right.isdigit() and start.version == 4:
+                        # 简写形式：192.168.1.1-100 表示最后一段的范围
+                        end = ipaddress.ip_address(left.rsplit(".", 1)[0] + "." + right)
+                    else:
+                        end = ipaddress.ip_address(right)
+                except ValueError:
+                    raise ValueError(f"无效的地址范围: {spec}")
+                if end.version != start.version:
+                    raise ValueError(f"地址范围两端的IP版本不一致: {spec}")
+                low, high = sorted((int(start), int(end)))
+                return start.version, low, high
+
+        try:
+            address = ipaddress.ip_address(spec.strip("[]"))
+        except ValueError:
+            return None
+        return address.version, int(address), int(address)
+
+    def __len__(self) -> int:
+        return self.address_count + len(self.names)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index >= self.address_count:
+            return self.names[index - self.address_count]
+        position = bisect.bisect_right(self.offsets, index) - 1
+        version, start, _ = self.segments[position]
+        value = start + index - self.offsets[position]
+        if version == 4:
+            return int_to_ipv4(value)
+        return str(ipaddress.IPv6Address(value))
+
+    def __iter__(self) -> Iterator[str]:
+        for version, start, end in self.segments:
+            for value in range(start, end + 1):
+                yield int_to_ipv4(value) if version == 4 else str(ipaddress.IPv6Address(value))
+        yield from self.names
+
+    def __contains__(self, ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip.strip("[]"))
+        except ValueError:
+            return ip in self.name_set
+        value = int(address)
+        position = bisect.bisect_right(self.starts[address.version], value) - 1
+        if position < 0:
+            return False
+        _, _, end = self.segments[self.segment_index[address.version][position]]
+        return value <= end
+
+
+class ResultStore:
+    """列式扫描结果存储
+
+    每条结果只占约10字节：IPv4地址存为 array('I') 整数，端口存为 array('H')，
+    状态每条一个字节，端口描述去重后只保存索引。IPv6地址去重后以16字节紧凑保存在
+    bytearray 中，地址列保存其索引；域名等目标单独去重保存。
+    HTTP探测等附加信息按行号稀疏保存。
+    """
+
+    STATE_OPEN, STATE_CLOSED, STATE_TIMEOUT, STATE_ERROR, STATE_OPEN_FILTERED = range(5)
+    STATE_NAMES = ["开放", "关闭", "超时", "错误", "开放|过滤"]
+
+    # 地址类型：IPv4整数 / 名称表索引 / IPv6表索引（数值与排序键前缀一致）
+    KIND_IPV4, KIND_NAME, KIND_IPV6 = 0, 1, 2
+    # 与状态名不同的原始状态文本（超时时间、错误原因等）导出时所在的列
+    DETAIL_COLUMN = "StatusDetail"
+
+    def __init__(self, keep_all: bool = False):
+        self.keep_all = keep_all
+        self.kinds = bytearray()
+        self.addrs = array('I')
+        self.ports = array('H')
+        self.states = bytearray()
+        self.desc_ids = array('H')
+        self.descriptions = []  # 去重后的端口描述
+        self.desc_index = {}  # {描述: 索引}
+        self.detail_ids = array('H')  # 原始状态文本的索引，0 表示与状态名相同
+        self.details = [""]  # 去重后的原始状态文本
+        self.detail_index = {"": 0}  # {原始状态文本: 索引}
+        self.names = []  # 去重后的域名等目标
+        self.name_index = {}  # {目标: 索引}
+        self.ipv6 = bytearray()  # 去重后的IPv6地址，每个16字节
+        self.ipv6_index = {}  # {16字节地址: 索引}
+        self.extras = {}  # {行号: {列名: 值}}
+        self.extra_columns = []  # 附加列名，按首次出现的顺序
+        self.probed = {}  # {端口: 实际完成的探测次数}，包括未保存的结果
+        self.coverage = None  # 扫描结束后记录未实际探测的目标（ScanCoverage），为None表示全部探测过
+        self.lock = threading.Lock()
+
+    @classmethod
+    def state_of(cls, is_open: bool, status: str) -> int:
+        """将check_port返回的结果映射为状态编号"""
+        if is_open:
+            return cls.STATE_OPEN
+        if status == "关闭":
+            return cls.STATE_CLOSED
+        if status == STATUS_OPEN_FILTERED:
+            return cls.STATE_OPEN_FILTERED
+        if is_timeout_status(status):
+            return cls.STATE_TIMEOUT
+        return cls.STATE_ERROR
+
+    def _intern(self, table: List[str], index: Dict[str, int], value: str) -> int:
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(table)
+            table.append(value)
+        return position
+
+    def add(self, ip: str, port: int, state: int, description: str,
+            detail: str = None) -> Optional[int]:
+        """追加一条结果，返回行号；未开启完整保留时只保存开放端口
+
+        detail 为探测返回的原始状态文本，与状态名不同时（如超时时间、错误原因）单独保存
+        """
+        if state != self.STATE_OPEN and not self.keep_all:
+            return None
+        value = ipv4_to_int(ip)
+        packed = ipv6_to_bytes(ip) if value is None else None
+        with self.lock:
+            if value is not None:
+                self.kinds.append(self.KIND_IPV4)
+                self.addrs.append(value)
+            elif packed is not None:
+                position = self.ipv6_index.get(packed)
+                if position is None:
+                    position = self.ipv6_index[packed] = len(self.ipv6) // 16
+                    self.ipv6.extend(packed)
+                self.kinds.append(self.KIND_IPV6)
+                self.addrs.append(position)
+            else:
+                self.kinds.append(self.KIND_NAME)
+                self.addrs.append(self._intern(self.names, self.name_index, ip))
+            self.ports.append(port)
+            self.states.append(state)
+            self.desc_ids.append(self._intern(self.descriptions, self.desc_index, description))
+            if detail and detail != self.STATE_NAMES[state]:
+                self.detail_ids.append(self._intern(self.details, self.detail_index, detail))
+                if self.DETAIL_COLUMN not in self.extra_columns:
+                    self.extra_columns.append(self.DETAIL_COLUMN)
+            else:
+                self.detail_ids.append(0)
+            return len(self.ports) - 1
+
+    def add_record(self, record: Dict) -> Optional[int]:
+        """追加一条字典形式的结果（分布式模式下工作节点回传的数据）"""
+        status = record["status"]
+        state = self.STATE_NAMES.index(status) if status in self.STATE_NAMES else self.STATE_ERROR
+        row = self.add(record["ip"], record["port"], state, record["PortIntroduction"],
+                       record.get(self.DETAIL_COLUMN))
+        extra = {key: value for key, value in record.items()
+                 if key not in ("target", "ip", "port", "PortIntroduction", "status", self.DETAIL_COLUMN)}
+        if row is not None and extra:
+            self.set_extra(row, extra)
+        return row
+
+    def set_extra(self, row: int, extra: Dict) -> None:
+        """为某行附加额外的列"""
+        with self.lock:
+            self.extras.setdefault(row, {}).update(extra)
+            for key in extra:
+                if key not in self.extra_columns:
+                    self.extra_columns.append(key)
+
+    def __len__(self) -> int:
+        return len(self.ports)
+
+    def count(self, state: int = None) -> int:
+        """统计指定状态的结果数，不指定时返回总数"""
+        if state is None:
+            return len(self.states)
+        return self.states.count(state)
+
+    def _ipv6_bytes(self, position: int) -> bytes:
+        return bytes(self.ipv6[position * 16:position * 16 + 16])
+
+    def ip_of(self, row: int) -> str:
+        kind = self.kinds[row]
+        if kind == self.KIND_IPV4:
+            return int_to_ipv4(self.addrs[row])
+        if kind == self.KIND_IPV6:
+            return socket.inet_ntop(socket.AF_INET6, self._ipv6_bytes(self.addrs[row]))
+        return self.names[self.addrs[row]]
+
+    def record(self, row: int) -> Dict:
+        """按行号生成导出用的字典"""
+        ip = self.ip_of(row)
+        port = self.ports[row]
+        result = {
+            "target": format_target(ip, port),
+            "ip": ip,
+            "port": port,
+            "PortIntroduction": self.descriptions[self.desc_ids[row]],
+            "status": self.STATE_NAMES[self.states[row]],
+        }
+        if self.detail_ids[row]:
+            result[self.DETAIL_COLUMN] = self.details[self.detail_ids[row]]
+        extra = self.extras.get(row)
+        if extra:
+            result.update(extra)
+        return result
+
+    def _sort_key(self, row: int) -> Tuple:
+        kind = self.kinds[row]
+        if kind == self.KIND_IPV4:
+            return kind, self.addrs[row], "", self.ports[row]
+        if kind == self.KIND_IPV6:
+            return kind, int.from_bytes(self._ipv6_bytes(self.addrs[row]), "big"), "", self.ports[row]
+        return kind, 0, self.names[self.addrs[row]], self.ports[row]
+
+    def sorted_rows(self, state: int = None) -> array:
+        """按 (IP, 端口) 排序后的行号；IPv4、IPv6按数值排序，顺序与 address_sort_key 一致"""
+        rows = array('I', (row for row in range(len(self.states))
+                           if state is None or self.states[row] == state))
+        return array('I', sorted(rows, key=self._sort_key))
+
+    def iter_rows(self, state: int = None, sort: bool = False) -> Iterator[int]:
+        """遍历行号，可按状态过滤，可按 (IP, 端口) 排序"""
+        if sort:
+            yield from self.sorted_rows(state)
+            return
+        for row in range(len(self.states)):
+            if state is None or self.states[row] == state:
+                yield row
+
+    def iter_records(self, state: int = None, sort: bool = False) -> Iterator[Dict]:
+        """逐条生成导出用的字典，不会一次性展开全部结果"""
+        for row in self.iter_rows(state, sort):
+            yield self.record(row)
+
+    def host_counts(self, state: int = None) -> Dict[Tuple[int, int], int]:
+        """统计每个地址的结果数，键为 (地址类型, 地址列的值)；只顺序遍历一次列数据，不排序"""
+        counts = {}
+        for kind, addr, row_state in zip(self.kinds, self.addrs, self.states):
+            if state is None or row_state == state:
+                key = (kind, addr)
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def group_by_host(self, state: int = None, hosts: set = None,
+                      with_key: bool = False) -> Iterator[Tuple]:
+        """按IP分组遍历，生成 (ip, [行号...])，IP与端口均已排序
+
+        hosts 为 host_counts 键的集合时只遍历这些地址（只对这些行排序）；
+        with_key 为True时生成 (键, ip, [行号...])
+        """
+        if hosts is None:
+            rows = self.sorted_rows(state)
+        else:
+            rows = sorted((row for row in range(len(self.states))
+                           if (state is None or self.states[row] == state)
+                           and (self.kinds[row], self.addrs[row]) in hosts), key=self._sort_key)
+        current_key = None
+        group = []
+        for row in rows:
+            key = (self.kinds[row], self.addrs[row])
+            if key != current_key and group:
+                yield (current_key, self.ip_of(group[0]), group) if with_key else (self.ip_of(group[0]), group)
+                group = []
+            current_key = key
+            group.append(row)
+        if group:
+            yield (current_key, self.ip_of(group[0]), group) if with_key else (self.ip_of(group[0]), group)
+
+
+class ScanHistory:
+    """本地SQLite扫描历史：WAL模式，结果流批量写入，按 (ip, port, scan_id) 建索引"""
+
+    DEFAULT_PATH = "scan_history.db"
+    BATCH_SIZE = 1000
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS scans (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               started REAL NOT NULL,
+               finished REAL,
+               targets INTEGER,
+               ports INTEGER,
+               args TEXT,
+               protocol TEXT NOT NULL DEFAULT 'tcp')""",
+        """CREATE TABLE IF NOT EXISTS results (
+               scan_id INTEGER NOT NULL,
+               ip TEXT NOT NULL,
+               ip_key BLOB NOT NULL,
+               port INTEGER NOT NULL,
+               state INTEGER NOT NULL,
+               description TEXT,
+               rtt REAL,
+               ts REAL NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS idx_results_ip_port_scan ON results (ip, port, scan_id)",
+        "CREATE INDEX IF NOT EXISTS idx_results_port_state_ts ON results (port, state, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_results_scan_key ON results (scan_id, ip_key, port)",
+        # 每次扫描中各端口探测的主机数，作为估计端口开放概率的分母
+        """CREATE TABLE IF NOT EXISTS port_totals (
+               scan_id INTEGER NOT NULL,
+               port INTEGER NOT NULL,
+               probed INTEGER NOT NULL)""",
+    ]
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        # 结果由多个扫描线程写入，统一用锁串行化
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(scans)")}
+        if "protocol" not in columns:
+            # 旧版本的历史库没有协议列，UDP扫描根据命令行参数识别
+            self.conn.execute("ALTER TABLE scans ADD COLUMN protocol TEXT NOT NULL DEFAULT 'tcp'")
+            self.conn.execute("UPDATE scans SET protocol = 'udp' WHERE ' ' || args || ' ' LIKE '% --udp %'")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.scan_id = None
+
+    def begin_scan(self, targets: int, ports: int, args: str = "", protocol: str = "tcp") -> int:
+        """登记一次新的扫描，返回扫描编号；protocol 为 tcp 或 udp，查询和比对只在同一协议的扫描间进行"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO scans (started, targets, ports, args, protocol) VALUES (?, ?, ?, ?, ?)",
+                (time.time(), targets, ports, args, protocol))
+            self.scan_id = cursor.lastrowid
+            self.conn.commit()
+        return self.scan_id
+
+    def write(self, ip: str, port: int, state: int, description: str, rtt: float = None) -> None:
+        """写入一条结果，攒够一批后再批量插入"""
+        with self.lock:
+            self.buffer.append((self.scan_id, ip, address_sort_key(ip), port, state,
+                                description, rtt, time.time()))
+            if len(self.buffer) >= self.BATCH_SIZE:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self.buffer:
+            self.conn.executemany(
+                "INSERT INTO results (scan_id, ip, ip_key, port, state, description, rtt, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.buffer)
+            self.conn.commit()
+            self.buffer = []
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def finish_scan(self, probed: Dict[int, int] = None) -> None:
+        """写入剩余结果并记录扫描结束时间；给出 probed 时记录每个端口实际完成的探测数"""
+        with self.lock:
+            self._flush()
+            if self.scan_id is not None:
+                self.conn.execute("UPDATE scans SET finished = ? WHERE id = ?",
+                                  (time.time(), self.scan_id))
+                if probed:
+                    self.conn.executemany(
+                        "INSERT INTO port_totals (scan_id, port, probed) VALUES (?, ?, ?)",
+                        ((self.scan_id, port, count) for port, count in sorted(probed.items())))
+                self.conn.commit()
+
+    def close(self) -> None:
+        self.finish_scan()
+        self.conn.close()
+
+    def first_open(self, ip: str, port: int, protocol: str = "tcp") -> Optional[Tuple[int, float]]:
+        """查询某个 ip:port 第一次被发现开放的扫描编号和时间"""
+        return self.conn.execute(
+            "SELECT scan_id, ts FROM results WHERE ip = ? AND port = ? AND state = ? "
+            "AND scan_id IN (SELECT id FROM scans WHERE protocol = ?) "
+            "ORDER BY scan_id LIMIT 1", (ip, port, ResultStore.STATE_OPEN, protocol)).fetchone()
+
+    def hosts_with_open(self, port: int, since: float, protocol: str = "tcp") -> List[Tuple[str, float]]:
+        """查询指定时间之后该端口开放过的主机及最近一次开放时间"""
+        return self.conn.execute(
+            "SELECT ip, MAX(ts) FROM results WHERE port = ? AND state = ? AND ts >= ? "
+            "AND scan_id IN (SELECT id FROM scans WHERE protocol = ?) "
+            "GROUP BY ip ORDER BY MIN(ip_key)",
+            (port, ResultStore.STATE_OPEN, since, protocol)).fetchall()
+
+    def probe_stats(self) -> Tuple[Optional[float], Dict[int, int]]:
+        """历史TCP探测的平均往返时间（秒）和各状态的结果数"""
+        avg_rtt = self.conn.execute(
+            "SELECT AVG(rtt) FROM results WHERE rtt IS NOT NULL AND state != ? "
+            "AND scan_id IN (SELECT id FROM scans WHERE protocol = 'tcp')",
+            (ResultStore.STATE_TIMEOUT,)).fetchone()[0]
+        states = dict(self.conn.execute(
+            "SELECT state, COUNT(*) FROM results "
+            "WHERE scan_id IN (SELECT id FROM scans WHERE protocol = 'tcp') GROUP BY state"))
+        return avg_rtt, states
+
+    def port_open_stats(self) -> Dict[int, Tuple[int, int]]:
+        """统计各端口在历史扫描中的 (开放次数, 探测次数)，只计入记录了探测总数的扫描"""
+        opened = dict(self.conn.execute(
+            "SELECT port, COUNT(*) FROM results WHERE state = ? "
+            "AND scan_id IN (SELECT DISTINCT scan_id FROM port_totals) GROUP BY port",
+            (ResultStore.STATE_OPEN,)))
+        return {port: (opened.get(port, 0), probed) for port, probed in self.conn.execute(
+            "SELECT port, SUM(probed) FROM port_totals GROUP BY port")}
+
+
+def format_timestamp(timestamp: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def export_to_excel(results: ResultStore, filename: str = None,
+                    verbose: bool = True) -> Optional[str]:
+    """将扫描结果导出到Excel文件并进行美化处理，返回文件名"""
+    if not len(results):
         print(f"{Fore.YELLOW}没有开放的端口，不生成Excel文件")
-        return
+        return None
 
     # 获取不重复的文件名
-    filename = get_unique_filename("result", "xlsx")
+    filename = filename or get_unique_filename("result", "xlsx")
 
     # 创建工作簿和工作表
     wb = openpyxl.Workbook()
@@ -57,8 +703,10 @@ def export_to_excel(results: List[Dict]) -> None:
     even_row_fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
     open_status_font = Font(color="008000", bold=True)  # 开放状态绿色加粗
 
-    # 设置表头
+    # 设置表头（HTTP探测、地址族等附加信息追加在后面）
     headers = ["target", "ip", "port", "PortIntroduction", "status"]
+    extra_headers = list(results.extra_columns)
+    headers.extend(extra_headers)
     for col, header in enumerate(headers, 1):
         cell = ws.cell(row=1, column=col)
         cell.value = header
@@ -68,7 +716,7 @@ def export_to_excel(results: List[Dict]) -> None:
         cell.alignment = Alignment(horizontal="center", vertical="center")
 
     # 填充数据
-    for row, result in enumerate(results, 2):
+    for row, result in enumerate(results.iter_records(sort=True), 2):
         # 偶数行添加灰色背景，提高可读性
         row_fill = even_row_fill if row % 2 == 0 else None
 
@@ -108,10 +756,21 @@ def export_to_excel(results: List[Dict]) -> None:
         cell.value = result["status"]
         cell.border = thin_border
         cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.font = open_status_font
+        if result["status"] == "开放":
+            cell.font = open_status_font
         if row_fill:
             cell.fill = row_fill
 
+        # 附加信息列
+        if extra_headers:
+            for offset, key in enumerate(extra_headers):
+                cell = ws.cell(row=row, column=6 + offset)
+                cell.value = result.get(key, "")
+                cell.border = thin_border
+                cell.alignment = Alignment(vertical="center")
+                if row_fill:
+                    cell.fill = row_fill
+
     # 自动调整列宽
     for col in range(1, len(headers) + 1):
         max_length = 0
@@ -132,7 +791,496 @@ def export_to_excel(results: List[Dict]) -> None:
 
     # 保存文件
     wb.save(filename)
-    print(f"\n{Fore.GREEN}扫描结果已导出到Excel文件: {filename}")
+    if verbose:
+        print(f"\n{Fore.GREEN}扫描结果已导出到Excel文件: {filename}")
+    return filename
+
+
+# 流式XLSX导出：直接把工作表XML写入zip，不为每个单元格创建对象
+XLSX_STREAM_CHUNK = 4096  # 每批拼接的行数
+
+# XML 1.0 不允许的控制字符（HTTP标题等附加信息中可能出现）
+XML_ILLEGAL_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '</Types>')
+
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>')
+
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="开放端口扫描结果" sheetId="1" r:id="rId1"/></sheets></workbook>')
+
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '<Relationship Id="rId2" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '<Relationship Id="rId3" Target="sharedStrings.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'
+    '</Relationships>')
+
+# 与 export_to_excel 相同的样式，预先编号：
+# 字体 0默认 1表头 2未知端口灰色 3开放状态绿色加粗；填充 2表头蓝色 3偶数行灰色；边框 1细线
+XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="4">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="12"/><color rgb="FFFFFFFF"/><name val="Calibri"/></font>'
+    '<font><sz val="11"/><color rgb="FF808080"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FF008000"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="4">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF4F81BD"/><bgColor rgb="FF4F81BD"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFF2F2F2"/><bgColor rgb="FFF2F2F2"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="10">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" '
+    'applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1" '
+    'applyAlignment="1"><alignment vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="3" borderId="1" xfId="0" applyFill="1" applyBorder="1" '
+    'applyAlignment="1"><alignment vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1" '
+    'applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="3" borderId="1" xfId="0" applyFill="1" applyBorder="1" '
+    'applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="2" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" '
+    'applyAlignment="1"><alignment vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="2" fillId="3" borderId="1" xfId="0" applyFont="1" applyFill="1" '
+    'applyBorder="1" applyAlignment="1"><alignment vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="3" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" '
+    'applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="3" fillId="3" borderId="1" xfId="0" applyFont="1" applyFill="1" '
+    'applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>')
+
+# cellXfs 编号：(奇数行, 偶数行)
+XLSX_STYLE_HEADER = 1
+XLSX_STYLE_TEXT = (2, 3)
+XLSX_STYLE_CENTER = (4, 5)
+XLSX_STYLE_UNKNOWN = (6, 7)
+XLSX_STYLE_OPEN = (8, 9)
+
+
+def xml_text(value) -> str:
+    """转义为XML文本，并去掉XML不允许的控制字符"""
+    return XML_ILLEGAL_CHARS.sub("", html.escape(str(value), quote=False))
+
+
+def export_to_excel_stream(results: ResultStore, filename: str = None,
+                           verbose: bool = True) -> Optional[str]:
+    """流式导出Excel，样式与 export_to_excel 相同，返回文件名
+
+    直接从列式存储逐行拼接工作表XML写入zip：端口描述和状态放入共享字符串表，
+    每个描述的单元格片段只生成一次；样式编号预先确定，不创建任何单元格对象。
+    列宽需要在数据之前写出，因此数据行先写入临时文件，统计完列宽后再拷入zip。
+    """
+    if not len(results):
+        print(f"{Fore.YELLOW}没有开放的端口，不生成Excel文件")
+        return None
+
+    filename = filename or get_unique_filename("result", "xlsx")
+    headers = ["target", "ip", "port", "PortIntroduction", "status"]
+    extra_headers = list(results.extra_columns)
+    headers.extend(extra_headers)
+    letters = [get_column_letter(col) for col in range(1, len(headers) + 1)]
+
+    # 共享字符串表：表头、状态名、端口描述
+    shared = headers + ResultStore.STATE_NAMES + results.descriptions
+    state_base = len(headers)
+    desc_base = state_base + len(ResultStore.STATE_NAMES)
+
+    # 每个描述、状态按行的奇偶预先生成单元格片段（不含行号部分）
+    desc_cells = [[f' s="{XLSX_STYLE_UNKNOWN[even] if desc == "Unknown" else XLSX_STYLE_TEXT[even]}" '
+                   f't="s"><v>{desc_base + index}</v></c>' for index, desc in enumerate(results.descriptions)]
+                  for even in (0, 1)]
+    state_cells = [[f' s="{XLSX_STYLE_OPEN[even] if state == ResultStore.STATE_OPEN else XLSX_STYLE_CENTER[even]}" '
+                    f't="s"><v>{state_base + state}</v></c>' for state in range(len(ResultStore.STATE_NAMES))]
+                   for even in (0, 1)]
+
+    widths = [len(header) for header in headers]
+    widths[4] = max([widths[4]] + [len(name) for name in ResultStore.STATE_NAMES])
+    if results.descriptions:
+        widths[3] = max(widths[3], max(len(desc) for desc in results.descriptions))
+
+    ports, states, desc_ids = results.ports, results.states, results.desc_ids
+    kinds, addrs, extras = results.kinds, results.addrs, results.extras
+    detail_ids, details = results.detail_ids, results.details
+    with tempfile.TemporaryFile() as body:
+        chunk = []
+        current_key = None
+        ip = ip_text = None
+        for row, index in enumerate(results.sorted_rows(), 2):
+            # 结果按IP排序，同一IP的连续行复用转换结果
+            key = (kinds[index], addrs[index])
+            if key != current_key:
+                current_key = key
+                ip = results.ip_of(index)
+                ip_text = xml_text(ip)
+                widths[1] = max(widths[1], len(ip))
+            even = 1 - row % 2
+            port = ports[index]
+            target = format_target(ip, port)
+            if len(target) > widths[0]:
+                widths[0] = len(target)
+            line = (f'<row r="{row}"><c r="A{row}" s="{XLSX_STYLE_TEXT[even]}" t="inlineStr"><is><t>'
+                    f'{format_target(ip_text, port)}</t></is></c><c r="B{row}" s="{XLSX_STYLE_TEXT[even]}" '
+                    f't="inlineStr"><is><t>{ip_text}</t></is></c><c r="C{row}" s="{XLSX_STYLE_CENTER[even]}">'
+                    f'<v>{port}</v></c><c r="D{row}"{desc_cells[even][desc_ids[index]]}'
+                    f'<c r="E{row}"{state_cells[even][states[index]]}')
+            extra = extras.get(index) if extras else None
+            if detail_ids[index]:
+                extra = dict(extra or {}, **{ResultStore.DETAIL_COLUMN: details[detail_ids[index]]})
+            if extra:
+                cells = []
+                for offset, column in enumerate(extra_headers, 5):
+                    value = extra.get(column)
+                    if value is None:
+                        continue
+                    text = str(value)
+                    widths[offset] = max(widths[offset], len(text))
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        cells.append(f'<c r="{letters[offset]}{row}" s="{XLSX_STYLE_TEXT[even]}">'
+                                     f'<v>{text}</v></c>')
+                    else:
+                        cells.append(f'<c r="{letters[offset]}{row}" s="{XLSX_STYLE_TEXT[even]}" '
+                                     f't="inlineStr"><is><t xml:space="preserve">{xml_text(text)}</t></is></c>')
+                line += "".join(cells)
+            chunk.append(line + "</row>")
+            if len(chunk) >= XLSX_STREAM_CHUNK:
+                body.write("".join(chunk).encode("utf-8"))
+                chunk = []
+        body.write("".join(chunk).encode("utf-8"))
+        body.seek(0)
+
+        header_cells = "".join(f'<c r="{letters[col]}1" s="{XLSX_STYLE_HEADER}" t="s"><v>{col}</v></c>'
+                               for col in range(len(headers)))
+        # 列宽计算方式与 export_to_excel 相同（留一些余量）
+        cols = "".join(f'<col min="{col}" max="{col}" width="{(width + 2) * 1.2:.2f}" customWidth="1"/>'
+                       for col, width in enumerate(widths, 1))
+        sheet_head = (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            # 冻结表头，方便滚动查看
+            '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+            'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+            f'<cols>{cols}</cols><sheetData><row r="1">{header_cells}</row>')
+        strings = "".join(f'<si><t xml:space="preserve">{xml_text(text)}</t></si>' for text in shared)
+
+        with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+            archive.writestr("_rels/.rels", XLSX_ROOT_RELS)
+            archive.writestr("xl/workbook.xml", XLSX_WORKBOOK)
+            archive.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+            archive.writestr("xl/styles.xml", XLSX_STYLES)
+            archive.writestr("xl/sharedStrings.xml",
+                             '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                             '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                             f'count="{len(shared)}" uniqueCount="{len(shared)}">{strings}</sst>')
+            with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+                sheet.write(sheet_head.encode("utf-8"))
+                shutil.copyfileobj(body, sheet, 1 << 20)
+                sheet.write(b"</sheetData></worksheet>")
+
+    if verbose:
+        print(f"\n{Fore.GREEN}扫描结果已导出到Excel文件: {filename}")
+    return filename
+
+
+def export_to_jsonl(results: ResultStore, filename: str = None) -> Optional[str]:
+    """将扫描结果按 (IP, 端口) 排序后逐行导出为JSONL，便于流式读取和比对"""
+    if not len(results):
+        print(f"{Fore.YELLOW}没有开放的端口，不生成JSONL文件")
+        return None
+    filename = filename or get_unique_filename("result", "jsonl")
+    with open(filename, "w", encoding="utf-8") as f:
+        for record in results.iter_records(sort=True):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(f"{Fore.GREEN}扫描结果已导出到JSONL文件: {filename}")
+    return filename
+
+
+def iter_jsonl_records(filename: str) -> Iterator[Dict]:
+    """逐行读取JSONL结果文件"""
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_xlsx_records(filename: str) -> Iterator[Dict]:
+    """以只读模式流式读取Excel结果文件，第一行为表头"""
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        headers = next(rows, None)
+        if not headers:
+            return
+        for values in rows:
+            record = dict(zip(headers, values))
+            if record.get("ip") is None or record.get("port") is None:
+                continue
+            record["port"] = int(record["port"])
+            yield record
+    finally:
+        wb.close()
+
+
+def iter_history_records(spec: str, exclude_scan: int = None, protocol: str = "tcp") -> Iterator[Dict]:
+    """按 (IP, 端口) 顺序读取历史库中某次扫描的结果
+
+    spec 为 数据库路径 或 数据库路径#扫描编号；未指定编号时取最近一次已完成的同协议扫描
+    """
+    path, _, scan_id = spec.partition("#")
+    # 先初始化表结构，旧版本的历史库会补上协议列
+    ScanHistory(path).conn.close()
+    conn = sqlite3.connect(path)
+    try:
+        if scan_id:
+            scan_id = int(scan_id)
+            row = conn.execute("SELECT protocol FROM scans WHERE id = ?", (scan_id,)).fetchone()
+            if row and row[0] != protocol:
+                raise ValueError(f"扫描编号 {scan_id} 是 {row[0].upper()} 扫描，不能与 {protocol.upper()} 结果比对")
+        else:
+            row = conn.execute("SELECT MAX(id) FROM scans WHERE finished IS NOT NULL AND id != ? "
+                               "AND protocol = ?", (exclude_scan or -1, protocol)).fetchone()
+            if not row or row[0] is None:
+                raise ValueError(f"历史库中没有可用于比对的 {protocol.upper()} 扫描: {path}")
+            scan_id = row[0]
+        cursor = conn.execute(
+            "SELECT ip, port, state, description FROM results WHERE scan_id = ? "
+            "ORDER BY ip_key, port", (scan_id,))
+        for ip, port, state, description in cursor:
+            yield {
+                "target": format_target(ip, port),
+                "ip": ip,
+                "port": port,
+                "PortIntroduction": description,
+                "status": ResultStore.STATE_NAMES[state],
+            }
+    finally:
+        conn.close()
+
+
+def iter_result_file(spec: str, exclude_scan: int = None, protocol: str = "tcp") -> Iterator[Dict]:
+    """根据扩展名读取 JSONL / Excel / SQLite历史库 形式的结果，历史库只读取 protocol 协议的扫描"""
+    path = spec.partition("#")[0]
+    extension = os.path.splitext(path)[1].lower()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"结果文件不存在: {path}")
+    if extension in (".jsonl", ".json"):
+        return iter_jsonl_records(path)
+    if extension in (".xlsx", ".xlsm"):
+        return iter_xlsx_records(path)
+    if extension in (".db", ".sqlite", ".sqlite3"):
+        return iter_history_records(spec, exclude_scan, protocol)
+    raise ValueError(f"不支持的结果文件格式: {path}")
+
+
+class ResultTargets:
+    """复查扫描的任务来源：从上次导出的结果中流式读取 (IP, 端口) 对
+
+    支持 JSONL / Excel（只读模式）/ 历史库，以及限时扫描写出的 unscanned.jsonl。
+    只取上次开放的记录，没有状态列的记录（如 unscanned.jsonl）全部保留；
+    记录按 (IP, 端口) 排序后（无序的文件分块外部排序）去重，排除列表中的目标不再探测。
+    每次遍历都重新读取文件，不在内存中展开任务
+    """
+
+    def __init__(self, spec: str, exclude: ExclusionIndex = None):
+        self.spec = spec
+        self.exclude = exclude
+        self.count = 0
+        ports = set()
+        for record in self.records():
+            self.count += 1
+            ports.add(record["port"])
+        self.ports = sorted(ports)
+
+    def records(self) -> Iterator[Dict]:
+        previous = None
+        for record in sorted_records(lambda: iter_result_file(self.spec)):
+            if record.get("status", "开放") != "开放":
+                continue
+            key = (record["ip"], int(record["port"]))
+            if key == previous or (self.exclude and key[0] in self.exclude):
+                continue
+            previous = key
+            record["port"] = key[1]
+            yield record
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        for record in self.records():
+            yield record["ip"], record["port"]
+
+
+def record_key(record: Dict) -> Tuple[bytes, int]:
+    """结果记录的排序键"""
+    return address_sort_key(record["ip"]), int(record["port"])
+
+
+def sorted_records(open_source, chunk_size: int = 100000) -> Iterator[Dict]:
+    """保证记录按 (IP, 端口) 有序输出
+
+    open_source 每次调用返回一个新的记录迭代器。先流式检查是否已有序（本工具的导出均已排序）；
+    若无序（如旧版本导出的文件），分块排序写入临时文件后多路归并，内存占用只与块大小有关
+    """
+    previous = None
+    is_sorted = True
+    for record in open_source():
+        key = record_key(record)
+        if previous is not None and key < previous:
+            is_sorted = False
+            break
+        previous = key
+    if is_sorted:
+        yield from open_source()
+        return
+
+    chunk_files = []
+    try:
+        chunk = []
+        for record in open_source():
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                chunk_files.append(_write_sorted_chunk(chunk))
+                chunk = []
+        if chunk:
+            chunk_files.append(_write_sorted_chunk(chunk))
+        streams = [iter_jsonl_records(name) for name in chunk_files]
+        yield from heapq.merge(*streams, key=record_key)
+    finally:
+        for name in chunk_files:
+            os.remove(name)
+
+
+def _write_sorted_chunk(chunk: List[Dict]) -> str:
+    chunk.sort(key=record_key)
+    fd, name = tempfile.mkstemp(suffix=".jsonl", prefix="portscanner_")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for record in chunk:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    return name
+
+
+def merge_diff(previous: Iterator[Dict], current: Iterator[Dict],
+               scanned=None) -> Iterator[Tuple[str, Optional[Dict], Optional[Dict]]]:
+    """对两个按 (IP, 端口) 排序的结果流做一次归并，生成变化记录
+
+    生成 (类型, 上次记录, 本次记录)，类型为 new-open / newly-closed / changed-service。
+    scanned(ip, port) 判断本次是否扫描过该目标，未扫描的目标不会被判定为关闭
+    """
+    def is_open(record):
+        return record is not None and record.get("status") == "开放"
+
+    previous = iter(previous)
+    current = iter(current)
+    prev_record = next(previous, None)
+    cur_record = next(current, None)
+    while prev_record is not None or cur_record is not None:
+        if cur_record is None:
+            order = -1
+        elif prev_record is None:
+            order = 1
+        else:
+            prev_key, cur_key = record_key(prev_record), record_key(cur_record)
+            order = -1 if prev_key < cur_key else (1 if prev_key > cur_key else 0)
+
+        if order < 0:
+            # 只在上次结果中出现
+            if is_open(prev_record) and (scanned is None or
+                                         scanned(prev_record["ip"], prev_record["port"])):
+                yield "newly-closed", prev_record, None
+            prev_record = next(previous, None)
+        elif order > 0:
+            # 只在本次结果中出现
+            if is_open(cur_record):
+                yield "new-open", None, cur_record
+            cur_record = next(current, None)
+        else:
+            if is_open(cur_record) and not is_open(prev_record):
+                yield "new-open", prev_record, cur_record
+            elif is_open(prev_record) and not is_open(cur_record):
+                yield "newly-closed", prev_record, cur_record
+            elif is_open(prev_record) and any(
+                    (prev_record.get(key) or "") != (cur_record.get(key) or "")
+                    for key in ("PortIntroduction", "Server", "Title")
+                    if key in prev_record and key in cur_record):
+                yield "changed-service", prev_record, cur_record
+            prev_record = next(previous, None)
+            cur_record = next(current, None)
+
+
+def report_diff(changes: Iterator[Tuple[str, Optional[Dict], Optional[Dict]]],
+                title: str = "扫描结果变化") -> Dict[str, int]:
+    """输出变化记录并写入 diff_N.jsonl，返回各类型数量"""
+    labels = {
+        "new-open": (Fore.GREEN, "新开放"),
+        "newly-closed": (Fore.RED, "新关闭"),
+        "changed-service": (Fore.YELLOW, "服务变化"),
+    }
+    counts = {kind: 0 for kind in labels}
+    filename = get_unique_filename("diff", "jsonl")
+    print(f"\n{Fore.BLUE}{title}:")
+    with open(filename, "w", encoding="utf-8") as f:
+        for kind, prev_record, cur_record in changes:
+            counts[kind] += 1
+            record = cur_record or prev_record
+            color, label = labels[kind]
+            detail = record.get("PortIntroduction") or ""
+            if kind == "changed-service":
+                changed = [f"{key}: {prev_record.get(key)} -> {cur_record.get(key)}"
+                           for key in ("PortIntroduction", "Server", "Title")
+                           if key in prev_record and key in cur_record
+                           and (prev_record.get(key) or "") != (cur_record.get(key) or "")]
+                detail = "; ".join(changed)
+            print(f"{color}  [{label}] {record['ip']}:{record['port']:<10} {Fore.WHITE}{detail}")
+            f.write(json.dumps({"change": kind, "ip": record["ip"], "port": record["port"],
+                                "previous": prev_record, "current": cur_record},
+                               ensure_ascii=False, default=str) + "\n")
+    print(f"{Fore.YELLOW}新开放: {counts['new-open']}, 新关闭: {counts['newly-closed']}, "
+          f"服务变化: {counts['changed-service']}")
+    if any(counts.values()):
+        print(f"{Fore.GREEN}变化记录已导出到: {filename}")
+    else:
+        os.remove(filename)
+    return counts
 
 
 def print_aligned_banner():
@@ -241,7 +1389,10 @@ def read_ports_from_file(filename: str) -> List[int]:
 
 
 def read_ips_from_file(filename: str) -> List[str]:
-    """从文件中读取IP地址列表，支持带#注释的行和多种编码"""
+    """从文件中读取IP地址列表，支持带#注释的行和多种编码
+
+    每行可以是IPv4/IPv6地址、CIDR网段、地址范围或域名，由 TargetList 解析
+    """
     ips = []
     # 尝试多种常见编码格式
     encodings = ['utf-8', 'gbk', 'gb2312', 'utf-16', 'utf-8-sig']
@@ -254,8 +1405,8 @@ def read_ips_from_file(filename: str) -> List[str]:
                     ip_part = line.split('#', 1)[0].strip()
                     if ip_part:  # 忽略空行和纯注释行
                         ips.append(ip_part)
-            # 如果成功读取，去重后返回
-            return list(set(ips))
+            # 如果成功读取，按文件顺序去重后返回（保证随机扫描顺序可由种子复现）
+            return list(dict.fromkeys(ips))
         except UnicodeDecodeError:
             continue  # 尝试下一种编码
         except FileNotFoundError:
@@ -307,147 +1458,2223 @@ def load_port_descriptions(filename: str) -> Dict[int, str]:
     return {}
 
 
-def check_port(ip: str, port: int, timeout: float = 3.0) -> Tuple[bool, str]:
-    """检查指定IP的端口是否开放"""
+# 内置端口开放频率表：按互联网扫描中TCP端口开放的常见程度从高到低排列
+# （参考nmap服务频率统计，并补充了常见的数据库、中间件和Web管理端口）
+PORT_FREQUENCY_RANKING = (
+    80, 443, 22, 21, 23, 25, 3389, 8080, 110, 445, 139, 143, 53, 135, 3306, 8443,
+    993, 995, 1723, 111, 5900, 587, 8888, 465, 6379, 5432, 1433, 8000, 8081, 1521,
+    27017, 9200, 7001, 11211, 5985, 8008, 8088, 9000, 8090, 81, 10000, 554, 2049, 179,
+    5060, 1080, 873, 389, 636, 548, 631, 113, 199, 1025, 1720, 6001, 2000, 8001,
+    8009, 8082, 9090, 9100, 9443, 5000, 5001, 3000, 7547, 2082, 2083, 2086, 2087, 2095,
+    2096, 8880, 8010, 8089, 8181, 6443, 10250, 2375, 2376, 2379, 5601, 5672, 15672, 9092,
+    2181, 50070, 8086, 8161, 61616, 1883, 5984, 9300, 4848, 7002, 8983, 6000, 514, 515,
+    88, 3268, 5357, 5666, 49152, 49153, 49154, 1026, 1027, 32768, 79, 106, 2121, 5800,
+    3128, 8118, 1194, 4443, 4430, 4433, 3443, 5443, 10443, 4899, 888, 82, 83, 85,
+    8002, 8003, 9043, 9999, 8083, 8085, 8091, 8200, 8500, 8800, 9001, 9080, 9091, 9201,
+)
+
+
+class PortRanking:
+    """端口开放概率估计：以内置频率表为先验，用历史库中各端口的开放比例修正
+
+    估计值为 (开放次数 + 先验 × 先验权重) / (探测次数 + 先验权重)，
+    历史样本少时接近内置频率表，样本多时以实际观测为准
+    """
+
+    # 先验相当于多少次观测
+    PRIOR_WEIGHT = 20
+    # 频率表中第 k 名的先验概率为 PRIOR_SCALE / (k + 2)
+    PRIOR_SCALE = 0.3
+    # 频率表之外端口的先验概率
+    UNKNOWN_PRIOR = 0.0005
+
+    def __init__(self, stats: Dict[int, Tuple[int, int]] = None):
+        self.stats = stats or {}
+        self.priors = {port: self.PRIOR_SCALE / (rank + 2)
+                       for rank, port in enumerate(PORT_FREQUENCY_RANKING)}
+
+    @classmethod
+    def from_history(cls, path: str) -> "PortRanking":
+        """从历史库学习各端口的开放比例，历史库不存在时只使用内置频率表"""
+        if not path or not os.path.exists(path):
+            return cls()
+        history = ScanHistory(path)
+        try:
+            return cls(history.port_open_stats())
+        finally:
+            history.conn.close()
+
+    def probability(self, port: int) -> float:
+        prior = self.priors.get(port, self.UNKNOWN_PRIOR)
+        opened, probed = self.stats.get(port, (0, 0))
+        return (opened + prior * self.PRIOR_WEIGHT) / (probed + self.PRIOR_WEIGHT)
+
+    def order(self, ports: List[int]) -> List[int]:
+        """按开放概率从高到低排列端口，概率相同时按端口号排列"""
+        return sorted(ports, key=lambda port: (-self.probability(port), port))
+
+    def top(self, count: int) -> List[int]:
+        """开放概率最高的 count 个端口"""
+        return self.order(range(1, 65536))[:count]
+
+
+def write_top_ports(ranking: PortRanking, count: int) -> str:
+    """按开放概率生成 port-N.txt 格式的端口列表文件（逗号分隔，按概率从高到低）"""
+    filename = get_unique_filename(f"port-{count}", "txt")
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(",".join(str(port) for port in ranking.top(count)))
+    return filename
+
+
+# connect_ex 返回的错误码分类（含Windows下的WSA错误码）
+REFUSED_ERRNOS = {errno.ECONNREFUSED, 10061}
+TIMEOUT_ERRNOS = {errno.EAGAIN, errno.EWOULDBLOCK, errno.ETIMEDOUT, errno.EINPROGRESS, 10035, 10060}
+# 本机资源耗尽（文件描述符、本地端口、缓冲区），与目标状态无关，应稍后重试
+RESOURCE_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.EADDRNOTAVAIL, errno.ENOBUFS, 10024, 10049, 10055}
+STATUS_RESOURCE = "资源不足"
+# 路由层面的硬错误：目标主机或所在网络不可达，同一主机的其它端口会以同样方式失败
+HOST_UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.EHOSTDOWN, 10064, 10065}
+NET_UNREACHABLE_ERRNOS = {errno.ENETUNREACH, errno.ENETDOWN, 10050, 10051}
+STATUS_HOST_UNREACHABLE = "主机不可达"
+STATUS_NET_UNREACHABLE = "网络不可达"
+# UDP探测重传后仍无响应：端口可能开放（服务不回应该载荷），也可能被防火墙丢弃
+STATUS_OPEN_FILTERED = "开放|过滤"
+# 目标的地址在排除列表中，未发起探测
+STATUS_EXCLUDED = "已排除"
+# SO_LINGER {l_onoff=1, l_linger=0}：关闭时直接发送RST，不进入TIME_WAIT
+# Windows的linger结构为两个u_short，其他平台为两个int
+LINGER_ZERO = struct.pack("HH" if os.name == "nt" else "ii", 1, 0)
+
+
+def is_timeout_status(status: str) -> bool:
+    """判断探测状态是否为超时（可能是丢包，也可能是被过滤）"""
+    return status.startswith("超时")
+
+
+def unreachable_status(code: int) -> Optional[str]:
+    """将不可达类错误码映射为探测状态，其它错误码返回None"""
+    if code in HOST_UNREACHABLE_ERRNOS:
+        return STATUS_HOST_UNREACHABLE
+    if code in NET_UNREACHABLE_ERRNOS:
+        return STATUS_NET_UNREACHABLE
+    return None
+
+
+# 当前生效的排除列表（set_exclusions 设置），所有探测在连接前都经 resolve_host 检查
+active_exclusions = None
+
+
+class ExcludedAddressError(socket.gaierror):
+    """目标的地址全部在排除列表中；继承 gaierror，未单独处理的调用方也不会发起连接"""
+
+
+def set_exclusions(exclude: Optional[ExclusionIndex]) -> None:
+    global active_exclusions
+    active_exclusions = exclude
+
+
+def resolve_host(host: str) -> Tuple[Tuple[int, Tuple], ...]:
+    """解析目标地址并去掉排除列表中的地址，全部被排除时抛出 ExcludedAddressError
+
+    建立目标列表之后才解析出的地址（如当时解析失败、或DNS变化的域名）也在这里拦截
+    """
+    if active_exclusions and host.lower().rstrip(".") in active_exclusions.names:
+        raise ExcludedAddressError(f"{host} 在排除列表中")
+    addresses = _resolve_host_cached(host)
+    if active_exclusions:
+        addresses = tuple(entry for entry in addresses
+                          if entry[1][0].partition("%")[0] not in active_exclusions)
+        if not addresses:
+            raise ExcludedAddressError(f"{host} 的地址在排除列表中")
+    return addresses
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_host_cached(host: str) -> Tuple[Tuple[int, Tuple], ...]:
+    """解析目标地址，返回 ((地址族, sockaddr不含端口), ...)；IP字面量不查询DNS，域名结果缓存"""
+    if ipv4_to_int(host) is not None:
+        return ((socket.AF_INET, (host,)),)
+    if ipv6_to_bytes(host.strip("[]")) is not None:
+        return ((socket.AF_INET6, (host.strip("[]"), 0, 0)),)
+    infos = socket.getaddrinfo(host, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    addresses = []
+    for family, _, _, _, sockaddr in infos:
+        entry = (family, (sockaddr[0],) + tuple(sockaddr[2:]))
+        if entry not in addresses:
+            addresses.append(entry)
+    return tuple(addresses)
+
+
+def check_port(ip: str, port: int, timeout: float = 3.0, linger0: bool = False) -> Tuple[bool, str]:
+    """检查指定IP的端口是否开放，支持IPv4、IPv6和域名（使用系统优先的地址）
+
+    linger0 为True时以RST关闭连接，避免大量TIME_WAIT占用本地端口
+    """
     try:
+        family, address = resolve_host(ip)[0]
         # 创建socket对象
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            if linger0:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_ZERO)
             # 设置超时时间
             sock.settimeout(timeout)
 
             # 尝试连接
-            result = sock.connect_ex((ip, port))
+            result = sock.connect_ex((address[0], port) + address[1:])
 
             if result == 0:
                 return (True, "开放")
-            else:
+            elif result in TIMEOUT_ERRNOS:
+                # 设置了超时的connect_ex在超时时返回EWOULDBLOCK而不是抛出异常
+                return (False, f"超时({timeout}秒)")
+            elif result in REFUSED_ERRNOS:
                 return (False, "关闭")
+            elif result in RESOURCE_ERRNOS:
+                return (False, STATUS_RESOURCE)
+            elif unreachable_status(result):
+                return (False, unreachable_status(result))
+            else:
+                return (False, f"错误: {os.strerror(result)}")
 
     except socket.timeout:
         return (False, f"超时({timeout}秒)")
-    except socket.gaierror:
+    except ExcludedAddressError:
+        return (False, STATUS_EXCLUDED)
+    except (socket.gaierror, IndexError):
         return (False, "无效IP地址")
     except socket.error as e:
+        if e.errno in RESOURCE_ERRNOS:
+            return (False, STATUS_RESOURCE)
+        if unreachable_status(e.errno):
+            return (False, unreachable_status(e.errno))
         return (False, f"错误: {str(e)}")
 
 
-def scan_ips_ports(ips: List[str], ports: List[int], port_descriptions: Dict[int, str],
-                   timeout: float = 3.0, threads: int = 5) -> List[Dict]:
-    """使用多线程扫描多个IP和端口，返回扫描结果用于导出"""
-    total_tasks = len(ips) * len(ports)
-    if total_tasks == 0:
-        print(f"{Fore.YELLOW}没有需要扫描的任务")
-        return []
+# 前一个连接尝试未完成时，启动下一个地址族连接前的等待时间（RFC 8305建议250毫秒）
+CONNECTION_ATTEMPT_DELAY = 0.25
 
-    # 创建任务队列
-    task_queue = Queue()
-    for ip in ips:
-        for port in ports:
-            task_queue.put((ip, port))
 
-    # 用于存储开放端口的字典 {ip: [ports]}
-    open_ports = {ip: [] for ip in ips}
+def check_port_racing(host: str, port: int, timeout: float = 3.0,
+                      linger0: bool = False) -> Tuple[bool, str, Optional[str]]:
+    """Happy Eyeballs方式检查域名端口：IPv6与IPv4地址交替发起连接，以最先成功的为准
 
-    # 用于存储导出结果的数据列表
-    export_results = []
+    返回 (是否开放, 状态, 成功连接的地址)
+    """
+    try:
+        addresses = resolve_host(host)
+    except ExcludedAddressError:
+        return (False, STATUS_EXCLUDED, None)
+    except socket.gaierror:
+        return (False, "无效IP地址", None)
+    if len(addresses) <= 1:
+        # IP字面量或只有一个地址的域名无需竞速
+        is_open, status = check_port(host, port, timeout, linger0)
+        connected = addresses[0][1][0] if is_open and addresses else None
+        return (is_open, status, connected if connected != host.strip("[]") else None)
 
-    progress_counter = 0
-    progress_lock = threading.Lock()
+    # 按地址族交替排列，IPv6优先
+    ipv6 = [entry for entry in addresses if entry[0] == socket.AF_INET6]
+    ipv4 = [entry for entry in addresses if entry[0] == socket.AF_INET]
+    ordered = []
+    for index in range(max(len(ipv6), len(ipv4))):
+        ordered.extend(group[index] for group in (ipv6, ipv4) if index < len(group))
 
-    # 打印扫描开始信息
-    print(f"{Fore.YELLOW}{'-' * 80}")
-    print(f"{Fore.WHITE}开始扫描: {len(ips)} 个IP, {len(ports)} 个端口")
-    print(f"{Fore.WHITE}超时时间: {timeout} 秒, 线程数量: {threads}")
-    print(f"{Fore.GREEN}{'-' * 80}\n")
-    start_time = time.time()
+    deadline = time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    pending = 0
+    refused = 0
+    unreachable = 0
+    next_attempt = 0.0
+    try:
+        while True:
+            now = time.monotonic()
+            if ordered and (pending == 0 or now >= next_attempt):
+                family, address = ordered.pop(0)
+                try:
+                    sock = socket.socket(family, socket.SOCK_STREAM)
+                except OSError as e:
+                    if e.errno in RESOURCE_ERRNOS:
+                        return (False, STATUS_RESOURCE, None)
+                    raise
+                if linger0:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_ZERO)
+                sock.setblocking(False)
+                result = sock.connect_ex((address[0], port) + address[1:])
+                if result in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, 10035):
+                    selector.register(sock, selectors.EVENT_WRITE, address[0])
+                    pending += 1
+                else:
+                    refused += result in REFUSED_ERRNOS
+                    unreachable += unreachable_status(result) is not None
+                    sock.close()
+                next_attempt = now + CONNECTION_ATTEMPT_DELAY
+                continue
 
-    # 定义线程工作函数
-    def scan_worker():
-        nonlocal progress_counter
-        while not task_queue.empty():
-            try:
-                # 非阻塞方式获取队列元素
-                ip, port = task_queue.get_nowait()
-            except:
+            if pending == 0:
                 break
+            wait = deadline - now
+            if ordered:
+                wait = min(wait, next_attempt - now)
+            if deadline - now <= 0:
+                break
+            for key, _ in selector.select(max(0.0, wait)):
+                sock = key.fileobj
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                selector.unregister(sock)
+                sock.close()
+                pending -= 1
+                if error == 0:
+                    return (True, "开放", key.data)
+                refused += error in REFUSED_ERRNOS
+                unreachable += unreachable_status(error) is not None
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+    if refused and refused == len(addresses):
+        return (False, "关闭", None)
+    if unreachable and unreachable == len(addresses):
+        return (False, STATUS_HOST_UNREACHABLE, None)
+    return (False, f"超时({timeout}秒)", None)
 
+
+class SocketResourceManager:
+    """套接字资源管理：提升文件描述符软限制，按fd上限和本地临时端口范围约束并发，
+    扫描中遇到资源耗尽时暂停重试并统计限流次数
+    """
+
+    # 为输出文件、数据库、日志等预留的文件描述符
+    FD_RESERVE = 64
+    # 本地临时端口只使用一部分，给本机其它程序留余量
+    PORT_RANGE_SHARE = 0.8
+    # 资源耗尽时单次暂停时间(秒)和单个目标的最大重试次数
+    THROTTLE_PAUSE = 0.05
+    MAX_THROTTLE_ATTEMPTS = 20
+    # Linux下TIME_WAIT持续时间(秒)
+    TIME_WAIT_SECONDS = 60
+
+    def __init__(self, linger0: bool = False):
+        self.linger0 = linger0
+        self.fd_soft, self.fd_hard = self.raise_fd_limit()
+        self.port_low, self.port_high = self.ephemeral_port_range()
+        self.throttle_count = 0
+        self.lock = threading.Lock()
+        self.notes = []
+
+    @staticmethod
+    def raise_fd_limit() -> Tuple[Optional[int], Optional[int]]:
+        """尽可能将RLIMIT_NOFILE软限制提升到硬限制，返回 (软限制, 硬限制)"""
+        if resource is None:
+            return None, None
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        if soft != resource.RLIM_INFINITY and soft < target:
             try:
-                is_open, status = check_port(ip, port, timeout)
+                resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+                soft = target
+            except (ValueError, OSError):
+                pass
+        if soft == resource.RLIM_INFINITY:
+            soft = None
+        return soft, hard if hard != resource.RLIM_INFINITY else None
 
-                # 更新进度
-                with progress_lock:
-                    progress_counter += 1
-                    current = progress_counter
-                    progress = (current / total_tasks) * 100
+    @staticmethod
+    def ephemeral_port_range() -> Tuple[int, int]:
+        """读取本地临时端口范围，无法读取时使用IANA建议的 49152-65535"""
+        try:
+            with open("/proc/sys/net/ipv4/ip_local_port_range", "r") as f:
+                low, high = (int(value) for value in f.read().split())
+                return low, high
+        except (OSError, ValueError):
+            return 49152, 65535
 
-                # 输出结果
-                with print_lock:
-                    # 显示进度
-                    sys.stdout.write(f"\r{Fore.RED}扫描进度: {Fore.YELLOW}{progress:.1f}% ({current}/{total_tasks})")
-                    sys.stdout.flush()
+    def max_concurrency(self, sockets_per_probe: int = 1, extra_sockets: int = 0) -> int:
+        """根据fd软限制和临时端口数量计算允许的最大并发探测数"""
+        limits = [int((self.port_high - self.port_low + 1) * self.PORT_RANGE_SHARE) // sockets_per_probe]
+        if self.fd_soft:
+            limits.append((self.fd_soft - self.FD_RESERVE - extra_sockets) // sockets_per_probe)
+        return max(1, min(limits))
 
-                    # 只显示开放的端口
-                    if is_open:
-                        # 获取端口描述，如果没有则为"Unknown"
-                        port_desc = port_descriptions.get(port, "Unknown")
-                        # 为Unknown描述设置灰色，其他使用青色
-                        desc_color = Fore.CYAN if port_desc != "Unknown" else Fore.LIGHTBLACK_EX
+    def plan(self, threads: int, sockets_per_probe: int = 1, extra_sockets: int = 0,
+             rate: float = 0) -> int:
+        """按资源上限调整线程数，需要限流时记录原因"""
+        allowed = self.max_concurrency(sockets_per_probe, extra_sockets)
+        if threads > allowed:
+            self.notes.append(f"资源限制: 线程数由 {threads} 调整为 {allowed} "
+                              f"(fd软限制 {self.fd_soft}, 本地端口 {self.port_low}-{self.port_high})")
+            threads = allowed
+        if not self.linger0:
+            # 开放端口的连接由本机主动关闭，会在TIME_WAIT中占用本地端口
+            sustainable = (self.port_high - self.port_low + 1) * self.PORT_RANGE_SHARE / self.TIME_WAIT_SECONDS
+            if threads >= 100 and (rate <= 0 or rate > sustainable):
+                self.notes.append(f"提示: 同一目标大量开放端口时，TIME_WAIT最多支撑约 {sustainable:.0f} 次/秒的连接，"
+                                  f"可使用 --linger0 避免占用本地端口")
+        return threads
 
-                        # 格式化输出，三列严格对齐
-                        print(f"\n{Fore.WHITE}{ip}:{port:<30} {desc_color}{port_desc:<40} {Fore.GREEN}{status:>20}")
-                        open_ports[ip].append(port)
-
-                        # 添加到导出结果列表（线程安全）
-                        with data_lock:
-                            export_results.append({
-                                "target": f"{ip}:{port}",
-                                "ip": ip,
-                                "port": port,
-                                "PortIntroduction": port_desc,
-                                "status": status
-                            })
+    def throttle(self) -> None:
+        """探测遇到本机资源耗尽时调用：短暂暂停后由调用方重试"""
+        with self.lock:
+            self.throttle_count += 1
+        time.sleep(self.THROTTLE_PAUSE)
 
-            except Exception as e:
-                with print_lock:
-                    print(f"\n{Fore.RED}扫描 {ip}:{port} 时出错: {str(e)}")
-            finally:
-                task_queue.task_done()
 
-    # 创建并启动线程
-    thread_list = []
-    for _ in range(threads):
-        thread = threading.Thread(target=scan_worker)
-        thread.daemon = True  # 守护线程
-        thread_list.append(thread)
-        thread.start()
+class HttpProber:
+    """HTTP探测阶段：扫描进行中对开放端口抓取状态码、Server头和<title>
 
-    # 等待所有任务完成
-    task_queue.join()
+    每个 host:port 只建立一条keep-alive连接，后续路径请求复用该连接
+    """
 
-    # 确保所有线程都已结束
-    for thread in thread_list:
-        thread.join()
+    # 读取响应体的上限，超过后放弃复用该连接
+    MAX_BODY = 64 * 1024
+    TITLE_RE = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+    CHARSET_RE = re.compile(r"charset=([\w-]+)", re.IGNORECASE)
+    # XML（xlsx）中不允许出现的控制字符，与 openpyxl 的 ILLEGAL_CHARACTERS_RE 相同
+    CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
 
-    end_time = time.time()
-    elapsed = end_time - start_time
+    def __init__(self, paths: List[str] = None, timeout: float = 3.0, threads: int = 10):
+        self.paths = paths or ["/"]
+        self.timeout = timeout
+        self.threads = threads
+        self.task_queue = Queue()
+        self.results = {}  # {结果行号: [{"path", "status", "server", "title"}]}
+        self.thread_list = []
+        # 输出探测结果的回调，终端被实时面板占用时由扫描设置，为None时直接打印
+        self.reporter = None
+        # HTTPS探测不校验证书，扫描场景下自签名证书很常见
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
 
-    # 统计总开放端口数并排序
-    total_open = 0
-    for ip in open_ports:
-        total_open += len(open_ports[ip])
-        open_ports[ip].sort()
+    def start(self) -> None:
+        """启动探测线程；分布式工作节点每个租约都会重新启动，结果按行号保存，需清空上一轮的结果"""
+        self.results = {}
+        self.thread_list = []
+        for _ in range(self.threads):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            self.thread_list.append(thread)
+            thread.start()
 
-    # 输出最终统计结果
-    print(f"\n\n{Fore.GREEN}{'-' * 80}")
-    print(f"{Fore.YELLOW}扫描完成! 耗时: {elapsed:.2f} 秒")
-    print(f"{Fore.YELLOW}总开放端口数: {total_open}")
+    def submit(self, ip: str, port: int, row: int) -> None:
+        """提交一个开放端口及其结果行号，由探测线程异步处理"""
+        self.task_queue.put((ip, port, row))
 
-    # 输出每个IP的开放端口列表
-    for ip in open_ports:
-        if open_ports[ip]:
+    def close(self) -> Dict[int, List[Dict]]:
+        """等待所有探测完成并返回结果"""
+        for _ in self.thread_list:
+            self.task_queue.put(None)
+        for thread in self.thread_list:
+            thread.join()
+        return self.results
+
+    def _worker(self) -> None:
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            ip, port, row = task
+            try:
+                responses = self.probe(ip, port)
+            except Exception:
+                responses = []
+            if responses:
+                with data_lock:
+                    self.results[row] = responses
+                first = responses[0]
+                reporter = self.reporter
+                if reporter:
+                    reporter(f"{format_target(ip, port)} [{first['status']}] "
+                             f"{first['server'] or '-'} {first['title']}")
+                    continue
+                with print_lock:
+                    print(f"\n{Fore.WHITE}{ip}:{port:<30} {Fore.MAGENTA}[{first['status']}] "
+                          f"{first['server'] or '-'} {Fore.CYAN}{first['title']}")
+
+    def probe(self, ip: str, port: int) -> List[Dict]:
+        """依次请求路径列表，先尝试HTTP，失败后尝试HTTPS"""
+        for scheme in ("http", "https"):
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(ip, port, timeout=self.timeout,
+                                                   context=self.ssl_context)
+            else:
+                conn = http.client.HTTPConnection(ip, port, timeout=self.timeout)
+            try:
+                responses = []
+                for path in self.paths:
+                    responses.append(self._request(conn, ip, port, path))
+                return responses
+            except (http.client.HTTPException, ssl.SSLError, OSError):
+                # 包括超时：TLS服务在收到明文HTTP请求时常常不作响应，需继续尝试HTTPS
+                continue
+            finally:
+                conn.close()
+        return []
+
+    def _request(self, conn: http.client.HTTPConnection, ip: str, port: int, path: str) -> Dict:
+        """在已有连接上发送一次GET请求，连接被对端关闭时由http.client自动重连"""
+        conn.request("GET", path, headers={
+            "Host": format_target(ip, port),
+            "User-Agent": "Mozilla/5.0 PortScanner",
+            "Connection": "keep-alive",
+        })
+        response = conn.getresponse()
+        body = response.read(self.MAX_BODY)
+        if not response.isclosed():
+            # 响应体过大，无法在同一连接上继续请求，关闭后下次自动重连
+            conn.close()
+
+        title = ""
+        match = self.TITLE_RE.search(body)
+        if match:
+            charset_match = self.CHARSET_RE.search(response.getheader("Content-Type", ""))
+            charset = charset_match.group(1) if charset_match else "utf-8"
+            try:
+                title = match.group(1).decode(charset, errors="replace")
+            except LookupError:
+                title = match.group(1).decode("utf-8", errors="replace")
+            title = " ".join(self.CONTROL_RE.sub("", html.unescape(title)).split())
+
+        return {
+            "path": path,
+            "status": response.status,
+            "server": self.CONTROL_RE.sub("", response.getheader("Server", "")),
+            "title": title,
+        }
+
+
+class TokenBucket:
+    """令牌桶限速器：按预约方式发放令牌，多线程共享时仍能保持低抖动的恒定速率"""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = float(rate)
+        # 默认只允许约10毫秒的突发量，避免瞬时峰值超过上限
+        self.capacity = burst if burst else max(1.0, self.rate / 100)
+        self.tokens = self.capacity
+        self.last = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """获取一个令牌，令牌不足时预约下一个时间片并等待"""
+        with self.lock:
+            now = time.perf_counter()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            # 令牌为负表示已预约未来的时间片
+            deadline = now + (-self.tokens / self.rate if self.tokens < 0 else 0.0)
+        precise_sleep_until(deadline)
+
+
+def precise_sleep_until(deadline: float) -> None:
+    """睡眠到指定的perf_counter时间点，最后约1毫秒让出CPU轮询以减少抖动"""
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        time.sleep(remaining - 0.001 if remaining > 0.002 else 0)
+
+
+class RateLimiter:
+    """探测速率控制：全局令牌桶 + 可选的每个/24网段子限速，并统计实际速率"""
+
+    def __init__(self, rate: float = 0, subnet_rate: float = 0):
+        self.global_bucket = TokenBucket(rate) if rate > 0 else None
+        self.subnet_rate = subnet_rate
+        self.subnet_buckets = {}  # {网段前缀: TokenBucket}
+        self.lock = threading.Lock()
+        self.count = 0
+        self.start_time = None
+
+    @staticmethod
+    def subnet_key(ip: str) -> str:
+        """IPv4地址取/24前缀，IPv6地址取/64前缀，其它目标（如域名）单独成组"""
+        parts = ip.split('.')
+        if len(parts) == 4 and all(part.isdigit() for part in parts):
+            return '.'.join(parts[:3])
+        packed = ipv6_to_bytes(ip)
+        if packed is not None:
+            return packed[:8].hex()
+        return ip
+
+    def acquire(self, ip: str) -> None:
+        """发送一次探测前调用，先等待网段令牌再等待全局令牌"""
+        if self.subnet_rate > 0:
+            key = self.subnet_key(ip)
+            with self.lock:
+                bucket = self.subnet_buckets.get(key)
+                if bucket is None:
+                    bucket = self.subnet_buckets[key] = TokenBucket(self.subnet_rate)
+            bucket.acquire()
+        if self.global_bucket:
+            self.global_bucket.acquire()
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = time.perf_counter()
+            self.count += 1
+
+    def observed_rate(self) -> float:
+        """返回从第一次探测开始的实际平均速率（次/秒）"""
+        if not self.start_time or self.count == 0:
+            return 0.0
+        elapsed = time.perf_counter() - self.start_time
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+
+class IndexPermutation:
+    """[0, n) 上的伪随机排列：平衡Feistel网络 + cycle-walking
+
+    只保存轮密钥，内存占用为O(1)；相同的种子总是得到相同的访问顺序
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, n: int, seed: int):
+        self.n = n
+        # Feistel要求定义域为 2^(2k)，取不小于n的最小偶数位宽
+        bits = max(2, (n - 1).bit_length())
+        bits += bits % 2
+        self.half_bits = bits // 2
+        self.mask = (1 << self.half_bits) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(32) for _ in range(self.ROUNDS)]
+
+    @staticmethod
+    def _mix(value: int, key: int) -> int:
+        """轮函数：简单的整数哈希混合"""
+        value = ((value ^ key) * 0x9E3779B1) & 0xFFFFFFFF
+        value ^= value >> 15
+        value = (value * 0x85EBCA6B) & 0xFFFFFFFF
+        return value ^ (value >> 13)
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (self._mix(right, key) & self.mask)
+        return (left << self.half_bits) | right
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < self.n:
+            raise IndexError(index)
+        # 定义域不超过4n，平均少于4次即可落回[0, n)
+        value = self._encrypt(index)
+        while value >= self.n:
+            value = self._encrypt(value)
+        return value
+
+    def __iter__(self) -> Iterator[int]:
+        for index in range(self.n):
+            yield self[index]
+
+
+def iter_tasks(ips: List[str], ports: List[int], randomize: bool = False,
+               seed: int = None, task_range: Tuple[int, int] = None,
+               port_major: bool = False) -> Iterator[Tuple[str, int]]:
+    """惰性生成 (ip, port) 扫描任务，随机模式下按伪随机排列遍历整个任务空间
+
+    task_range 为 [start, end) 时只生成该段序号对应的任务（分布式租约使用）；
+    port_major 为True时按端口顺序逐个端口扫完所有主机（端口已按开放概率排序时使用），
+    随机模式下只打乱每个端口内的主机顺序，保持端口的先后次序
+    """
+    total = len(ips) * len(ports)
+    start, end = task_range if task_range else (0, total)
+    if port_major:
+        ip_count = len(ips)
+        permutation = IndexPermutation(ip_count, seed) if randomize else None
+        for position in range(start, end):
+            port_index, ip_index = divmod(position, ip_count)
+            if permutation:
+                ip_index = permutation[ip_index]
+            yield ips[ip_index], ports[port_index]
+        return
+    permutation = IndexPermutation(total, seed) if randomize else None
+    port_count = len(ports)
+    for position in range(start, end):
+        index = permutation[position] if permutation else position
+        yield ips[index // port_count], ports[index % port_count]
+
+
+class HostScheduler:
+    """扫描调度器：限制每台主机同时进行的探测数
+
+    某台主机达到上限时，其任务暂存到该主机的等待队列，继续向线程分发其它主机的任务，
+    保证全局线程不会因为单台主机饱和而空闲
+    """
+
+    # 暂存任务数上限，超过后不再向后预取，等待已暂存的任务被消化
+    MAX_DEFERRED = 1 << 20
+    # 每分发多少个主任务穿插一个到期的重试任务
+    RETRY_INTERLEAVE = 8
+
+    def __init__(self, tasks: Iterator[Tuple[str, int]], host_limit: int = 0,
+                 retries: int = 0, retry_backoff: float = 1.0, route_cache: "RouteCache" = None):
+        self.tasks = tasks
+        self.route_cache = route_cache  # 负向路由缓存，所在网段不可达的任务直接跳过
+        self.host_limit = host_limit
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_heap = []  # [(到期时间, 序号, ip, port)] 超时待重试的任务
+        self.retry_seq = 0
+        self.attempts = {}  # {(ip, port): 已重试次数}
+        self.since_retry = 0
+        self.retried = 0  # 进入重试队列的目标数
+        self.recovered = 0  # 重试后得到明确结果的目标数
+        self.active = 0  # 全部正在探测的数量
+        self.in_flight = {}  # {ip: 正在探测的数量}
+        self.deferred = {}  # {ip: deque([port, ...])} 因主机饱和而暂存的任务
+        self.deferred_count = 0
+        self.ready_hosts = deque()  # 有暂存任务且已不再饱和的主机
+        self.cancelled = {}  # {ip: 跳过的任务数} 已取消剩余探测的主机
+        self.cancelled_tasks = 0  # 因主机被取消而跳过的任务总数
+        self.route_skipped = 0  # 因网段不可达而跳过的任务数
+        self.exhausted = False
+        self.condition = threading.Condition()
+
+    def _available(self, ip: str) -> bool:
+        return self.host_limit <= 0 or self.in_flight.get(ip, 0) < self.host_limit
+
+    def _start(self, ip: str) -> None:
+        self.in_flight[ip] = self.in_flight.get(ip, 0) + 1
+        self.active += 1
+
+    def _take_retry(self) -> Optional[Tuple[str, int]]:
+        """取出一个已到期的重试任务，主机饱和时转入该主机的暂存队列"""
+        now = time.monotonic()
+        while self.retry_heap and self.retry_heap[0][0] <= now:
+            _, _, ip, port = heapq.heappop(self.retry_heap)
+            if ip in self.cancelled:
+                self._skip(ip)
+                continue
+            if self._available(ip):
+                self._start(ip)
+                return ip, port
+            self.deferred.setdefault(ip, deque()).append(port)
+            self.deferred_count += 1
+        return None
+
+    def _finished(self) -> bool:
+        """所有任务都已分发；启用重试时还需等待正在进行的探测结束（它们可能产生重试任务）"""
+        if not self.exhausted or self.deferred or self.retry_heap:
+            return False
+        return self.retries <= 0 or self.active == 0
+
+    def _take_deferred(self) -> Optional[Tuple[str, int]]:
+        """从已不再饱和的主机的暂存队列中取出一个任务"""
+        while self.ready_hosts:
+            ip = self.ready_hosts.popleft()
+            pending = self.deferred.get(ip)
+            if not pending or not self._available(ip):
+                continue
+            port = pending.popleft()
+            self.deferred_count -= 1
+            if not pending:
+                del self.deferred[ip]
+                if self._finished():
+                    # 最后一个暂存任务已分发，唤醒等待的线程退出
+                    self.condition.notify_all()
+            elif self._available(ip):
+                self.ready_hosts.append(ip)
+            self._start(ip)
+            return ip, port
+        return None
+
+    def next_task(self) -> Optional[Tuple[str, int]]:
+        """获取下一个可执行的任务，全部任务分发完毕时返回None"""
+        with self.condition:
+            while True:
+                task = self._take_deferred()
+                if task:
+                    return task
+
+                # 重试任务优先级较低，只在主任务间隔穿插或主任务已取完时分发
+                if self.retry_heap and (self.exhausted or self.since_retry >= self.RETRY_INTERLEAVE):
+                    task = self._take_retry()
+                    if task:
+                        self.since_retry = 0
+                        return task
+
+                if not self.exhausted and self.deferred_count < self.MAX_DEFERRED:
+                    task = next(self.tasks, None)
+                    if task is None:
+                        self.exhausted = True
+                        continue
+                    ip, port = task
+                    if ip in self.cancelled:
+                        self._skip(ip)
+                        continue
+                    if self.route_cache and self.route_cache.skip(ip):
+                        self.route_skipped += 1
+                        continue
+                    if self._available(ip):
+                        self._start(ip)
+                        self.since_retry += 1
+                        return task
+                    # 主机已饱和，暂存任务后继续取下一个
+                    self.deferred.setdefault(ip, deque()).append(port)
+                    self.deferred_count += 1
+                    continue
+
+                task = self._take_retry()
+                if task:
+                    return task
+                if self._finished():
+                    return None
+                # 剩余任务都属于饱和主机或尚未到期的重试，等待有探测完成或重试到期
+                wait_time = None
+                if self.retry_heap:
+                    wait_time = max(0.0, self.retry_heap[0][0] - time.monotonic())
+                self.condition.wait(wait_time)
+
+    def done(self, ip: str) -> None:
+        """一个探测结束后调用，释放该主机的并发名额"""
+        with self.condition:
+            count = self.in_flight.get(ip, 0) - 1
+            if count > 0:
+                self.in_flight[ip] = count
+            else:
+                self.in_flight.pop(ip, None)
+            self.active -= 1
+            if ip in self.deferred:
+                self.ready_hosts.append(ip)
+                self.condition.notify()
+            if self._finished() or (self.retry_heap and self.active == 0):
+                self.condition.notify_all()
+
+    @property
+    def skipped_tasks(self) -> int:
+        """未经探测直接跳过的任务数"""
+        return self.cancelled_tasks + self.route_skipped
+
+    def _skip(self, ip: str, count: int = 1) -> None:
+        self.cancelled[ip] += count
+        self.cancelled_tasks += count
+
+    def skip_task(self, ip: str) -> None:
+        """已取出但因主机被取消而丢弃结果的任务，与被取消的任务一样计入跳过数"""
+        with self.condition:
+            self.cancelled.setdefault(ip, 0)
+            self._skip(ip)
+
+    def inject(self, ip: str, port: int) -> None:
+        """追加一个扫描列表之外的探测（如tarpit检测的随机高端口），同样受单主机并发上限约束"""
+        with self.condition:
+            if ip in self.cancelled:
+                return
+            self.deferred.setdefault(ip, deque()).append(port)
+            self.deferred_count += 1
+            if self._available(ip):
+                self.ready_hosts.append(ip)
+            self.condition.notify()
+
+    def cancel_host(self, ip: str) -> None:
+        """取消某台主机剩余的全部探测（已暂存、待重试和尚未生成的任务）"""
+        with self.condition:
+            self.cancelled.setdefault(ip, 0)
+            pending = self.deferred.pop(ip, None)
+            if pending:
+                self.deferred_count -= len(pending)
+                self._skip(ip, len(pending))
+            self.condition.notify_all()
+
+    def retry(self, ip: str, port: int, timed_out: bool) -> bool:
+        """记录一次探测结果；超时且未达到重试次数时放入重试队列并返回True"""
+        if self.retries <= 0:
+            return False
+        with self.condition:
+            attempt = self.attempts.get((ip, port), 0)
+            if not timed_out:
+                if attempt:
+                    del self.attempts[(ip, port)]
+                    self.recovered += 1
+                return False
+            if attempt >= self.retries:
+                self.attempts.pop((ip, port), None)
+                return False
+            if attempt == 0:
+                self.retried += 1
+            self.attempts[(ip, port)] = attempt + 1
+            # 指数退避，给丢包或拥塞留出恢复时间
+            ready_at = time.monotonic() + self.retry_backoff * (2 ** attempt)
+            self.retry_seq += 1
+            heapq.heappush(self.retry_heap, (ready_at, self.retry_seq, ip, port))
+            # 等待中的线程可能没有超时时间，唤醒它按新的重试到期时间重新等待
+            self.condition.notify()
+            return True
+
+
+class BudgetPlanner:
+    """限时扫描的任务源：逐个端口（按开放概率排好序）扫描所有主机
+
+    连续多次超时、从未响应的主机被推迟到所有存活主机之后再扫描；
+    根据实时吞吐量和正在进行的探测数估计现在开始的探测何时结束（Little定律：耗时 = 并发数 / 吞吐量），
+    估计值以连接超时为上限，剩余时间不足时停止分发；截止时未扫描的 (ip, port) 全部记录下来供下次继续扫描
+    """
+
+    # 连续超时多少次且从未响应的主机视为不存活
+    DEAD_AFTER = 3
+    # 计算实时吞吐量的最近完成探测数
+    THROUGHPUT_WINDOW = 256
+
+    def __init__(self, ips: TargetList, ports: List[int], budget: float, timeout: float,
+                 randomize: bool = False, seed: int = None):
+        self.ips = ips
+        self.ports = ports
+        self.budget = budget
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.deadline = self.started + budget
+        self.permutation = IndexPermutation(len(ips), seed) if randomize else None
+        self.port_index = 0
+        self.ip_position = 0
+        self.postponed = {}  # {ip: 推迟时所在的端口序号}，按推迟先后排列
+        self.postponed_iter = None
+        self.postponed_current = None  # 正在补扫的推迟主机 (ip, 下一个端口序号)
+        self.timeouts = {}  # {ip: 连续超时次数}
+        self.responsive = set()
+        self.probed = 0
+        self.in_flight = 0  # 已开始、尚未完成的探测数
+        self.completions = deque(maxlen=self.THROUGHPUT_WINDOW)  # 最近完成探测的时间
+        self.skipped = []  # 已分发但因截止而未探测的任务
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def _alive(self, ip: str) -> bool:
+        return ip in self.responsive or self.timeouts.get(ip, 0) < self.DEAD_AFTER
+
+    def expected_latency(self) -> float:
+        """现在开始的一次探测预计多久后完成；样本不足时按连接超时计算"""
+        with self.lock:
+            if len(self.completions) < 2:
+                return self.timeout
+            span = self.completions[-1] - self.completions[0]
+            if span <= 0:
+                return self.timeout
+            throughput = (len(self.completions) - 1) / span
+            return min(self.timeout, (self.in_flight + 1) / throughput)
+
+    def expired(self) -> bool:
+        """剩余时间已不足以让现在开始的探测在截止前结束"""
+        return time.monotonic() + self.expected_latency() >= self.deadline
+
+    def begin(self) -> None:
+        """一次探测开始"""
+        with self.lock:
+            self.in_flight += 1
+
+    def __iter__(self) -> "BudgetPlanner":
+        return self
+
+    def __next__(self) -> Tuple[str, int]:
+        if self.stopped or self.expired():
+            self.stopped = True
+            raise StopIteration
+        ip_count = len(self.ips)
+        while self.port_index < len(self.ports):
+            position = self.ip_position
+            ip_index = self.permutation[position] if self.permutation else position
+            ip = self.ips[ip_index]
+            port_index = self.port_index
+            self.ip_position += 1
+            if self.ip_position >= ip_count:
+                self.ip_position = 0
+                self.port_index += 1
+            if ip in self.postponed:
+                continue
+            with self.lock:
+                alive = self._alive(ip)
+            if alive:
+                return ip, self.ports[port_index]
+            self.postponed[ip] = port_index
+
+        # 存活主机已扫完，再补扫被推迟的主机
+        if self.postponed_iter is None:
+            self.postponed_iter = iter(list(self.postponed.items()))
+        while True:
+            if self.postponed_current is None:
+                self.postponed_current = next(self.postponed_iter)
+            ip, port_index = self.postponed_current
+            if port_index < len(self.ports):
+                self.postponed_current = (ip, port_index + 1)
+                return ip, self.ports[port_index]
+            self.postponed_current = None
+
+    def observe(self, ip: str, timed_out: bool) -> None:
+        """记录一次探测结果，更新主机存活状态和实时吞吐量"""
+        with self.lock:
+            self.probed += 1
+            self.in_flight = max(0, self.in_flight - 1)
+            self.completions.append(time.monotonic())
+            if timed_out:
+                self.timeouts[ip] = self.timeouts.get(ip, 0) + 1
+            else:
+                self.responsive.add(ip)
+                self.timeouts.pop(ip, None)
+
+    def skip(self, ip: str, port: int) -> None:
+        """已分发的任务因截止而未探测"""
+        with self.lock:
+            self.skipped.append((ip, port))
+
+    def unscanned(self) -> Iterator[Tuple[str, int]]:
+        """截止时所有未扫描的任务（扫描结束后调用）"""
+        yield from self.skipped
+        if not self.stopped:
+            return
+        ip_count = len(self.ips)
+        if self.postponed_iter is None:
+            # 仍在扫描存活主机：当前端口剩余的主机和之后所有端口
+            for port_index in range(self.port_index, len(self.ports)):
+                start = self.ip_position if port_index == self.port_index else 0
+                for position in range(start, ip_count):
+                    ip_index = self.permutation[position] if self.permutation else position
+                    ip = self.ips[ip_index]
+                    if ip not in self.postponed:
+                        yield ip, self.ports[port_index]
+            remaining = self.postponed.items()
+        else:
+            remaining = ([self.postponed_current] if self.postponed_current else []) + \
+                        list(self.postponed_iter)
+        for ip, port_index in remaining:
+            for port in self.ports[port_index:]:
+                yield ip, port
+
+    def write_unscanned(self, exclude: set = None) -> Tuple[int, Optional[str]]:
+        """将未扫描的任务写入JSONL文件（每行 {"ip", "port"}），返回数量和文件名
+
+        exclude 为不需要再扫描的主机（如已被取消探测的主机）
+        """
+        filename = None
+        count = 0
+        f = None
+        try:
+            for ip, port in self.unscanned():
+                if exclude and ip in exclude:
+                    continue
+                if f is None:
+                    filename = get_unique_filename("unscanned", "jsonl")
+                    f = open(filename, "w", encoding="utf-8")
+                f.write(json.dumps({"ip": ip, "port": port}) + "\n")
+                count += 1
+        finally:
+            if f:
+                f.close()
+        return count, filename
+
+
+class TarpitDetector:
+    """识别接受任意端口连接的主机（SYN代理、tarpit、蜜罐）
+
+    两种判定方式：主机前 sample 次探测中开放比例不低于 ratio；
+    或主机出现若干开放端口后，额外探测的随机高端口（不在扫描列表中）也都开放。
+    随机高端口由 take_canaries 取出后作为普通任务交给调度器，同样受速率和单主机并发限制
+    """
+
+    # 主机出现多少个开放端口后探测随机高端口
+    CANARY_AFTER = 3
+    CANARY_COUNT = 2
+    CANARY_RANGE = (30000, 65535)
+
+    def __init__(self, ports: List[int], ratio: float = 0.8, sample: int = 20):
+        self.ratio = ratio
+        self.sample = sample
+        self.port_set = set(ports)
+        self.counts = {}  # {ip: [探测数, 开放数, [开放行号...]]} 尚未判定的主机
+        self.cleared = set()  # 已判定正常的主机
+        self.canaried = set()  # 已安排探测随机高端口的主机
+        self.canaries = {}  # {ip: {随机高端口: 是否开放，未完成为None}}
+        self.requested = {}  # {ip: [待交给调度器的随机高端口]}
+        self.flagged = {}  # {ip: 判定原因}
+        self.lock = threading.Lock()
+
+    def is_flagged(self, ip: str) -> bool:
+        return ip in self.flagged
+
+    def _canary_ports(self) -> List[int]:
+        low, high = self.CANARY_RANGE
+        ports = []
+        while len(ports) < self.CANARY_COUNT:
+            port = random.randint(low, high)
+            if port not in self.port_set and port not in ports:
+                ports.append(port)
+        return ports
+
+    def observe(self, ip: str, is_open: bool, row: int = None) -> Optional[Tuple[str, List[int]]]:
+        """记录一次探测结果；主机在本次被判定异常时返回 (原因, 已保存的开放行号)"""
+        with self.lock:
+            if ip in self.flagged or ip in self.cleared:
+                return None
+            counts = self.counts.setdefault(ip, [0, 0, []])
+            counts[0] += 1
+            if is_open:
+                counts[1] += 1
+                if row is not None:
+                    counts[2].append(row)
+            probed, opened, rows = counts
+            reason = None
+            if probed >= self.sample and self.ratio > 0:
+                if opened >= probed * self.ratio:
+                    reason = f"前 {probed} 次探测中 {opened} 个端口开放"
+                else:
+                    del self.counts[ip]
+                    self.cleared.add(ip)
+                    return None
+            if reason:
+                return self._flag(ip, reason)
+            if opened >= self.CANARY_AFTER and ip not in self.canaried:
+                # 正常主机上随机高端口几乎不可能开放
+                self.canaried.add(ip)
+                ports = self._canary_ports()
+                self.canaries[ip] = dict.fromkeys(ports)
+                self.requested[ip] = ports
+            return None
+
+    def take_canaries(self, ip: str) -> List[int]:
+        """取出需要为该主机追加探测的随机高端口"""
+        with self.lock:
+            return self.requested.pop(ip, [])
+
+    def is_canary(self, ip: str, port: int) -> bool:
+        with self.lock:
+            return port in self.canaries.get(ip, ())
+
+    def canary_result(self, ip: str, port: int, is_open: bool) -> Optional[Tuple[str, List[int]]]:
+        """记录一次随机高端口的探测结果；全部完成且都开放时判定异常，返回值同 observe"""
+        with self.lock:
+            results = self.canaries.get(ip)
+            if results is None or port not in results:
+                return None
+            results[port] = is_open
+            if None in results.values():
+                return None
+            del self.canaries[ip]
+            if ip in self.flagged or not all(results.values()):
+                return None
+            return self._flag(ip, f"随机高端口 {', '.join(map(str, results))} 也开放")
+
+    def _flag(self, ip: str, reason: str) -> Tuple[str, List[int]]:
+        self.flagged[ip] = reason
+        counts = self.counts.pop(ip, None)
+        return reason, counts[2] if counts else []
+
+
+class HostCircuitBreaker:
+    """单主机熔断器：同一主机累计出现 threshold 次主机/网络不可达错误后熔断
+
+    熔断后由调度器取消该主机剩余的探测，汇总中每台主机只报告一行；
+    期间收到开放或关闭等明确响应时计数清零
+    """
+
+    def __init__(self, threshold: int = 3):
+        self.threshold = threshold
+        self.failures = {}  # {ip: 连续不可达次数}
+        self.tripped = {}  # {ip: 不可达状态}
+        self.lock = threading.Lock()
+
+    def record(self, ip: str, status: str) -> bool:
+        """记录一次探测结果，主机在本次熔断时返回True"""
+        unreachable = status in (STATUS_HOST_UNREACHABLE, STATUS_NET_UNREACHABLE)
+        with self.lock:
+            if ip in self.tripped:
+                return False
+            if not unreachable:
+                if not is_timeout_status(status):
+                    self.failures.pop(ip, None)
+                return False
+            count = self.failures.get(ip, 0) + 1
+            if count < self.threshold:
+                self.failures[ip] = count
+                return False
+            self.failures.pop(ip, None)
+            self.tripped[ip] = status
+            return True
+
+
+# 路由表中的拒绝路由标志（unreachable/prohibit/blackhole）
+RTF_REJECT = 0x0200
+
+
+def read_kernel_routes(path: str = "/proc/net/route") -> Optional[List[Tuple[int, int, bool]]]:
+    """读取Linux内核的IPv4路由表，返回 [(网络地址, 前缀长度, 是否为拒绝路由)]，无法读取时返回None"""
+    try:
+        with open(path, "r") as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        return None
+    routes = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        # 地址和掩码以本机字节序的十六进制输出，还原为网络字节序的整数
+        network = int.from_bytes(struct.pack("=I", int(fields[1], 16)), "big")
+        mask = int.from_bytes(struct.pack("=I", int(fields[7], 16)), "big")
+        routes.append((network, bin(mask).count("1"), bool(int(fields[3], 16) & RTF_REJECT)))
+    return routes
+
+
+class RouteCache:
+    """子网级负向路由缓存：整段跳过没有路由的网段
+
+    同一 /24（IPv6为/64）内有 learn_after 台不同主机返回网络不可达后跳过整个网段；
+    给出内核路由表时，扫描前按 /24 检查是否只有拒绝路由或根本没有路由，
+    并且只有路由表确认整个 /16 都不可路由时，才在已有 ESCALATE_AFTER 个 /24 被跳过后升级为跳过整个 /16
+    """
+
+    ESCALATE_AFTER = 4
+
+    def __init__(self, learn_after: int = 0, routes: List[Tuple[int, int, bool]] = None):
+        self.learn_after = learn_after
+        self.routes = sorted(routes, key=lambda route: -route[1]) if routes is not None else None
+        self.blocked = {}  # {(版本, 前缀长度, 网络号): 原因}
+        self.skipped = {}  # {(版本, 前缀长度, 网络号): 跳过的任务数}
+        self.failures = {}  # {(版本, 前缀长度, 网络号): {返回网络不可达的主机}}
+        self.route_checked = {}  # {/24网络号: 是否可路由}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _prefixes(ip: str) -> List[Tuple[int, int, int]]:
+        """目标所在的各级前缀，从大到小；域名等目标返回空列表"""
+        value = ipv4_to_int(ip)
+        if value is not None:
+            return [(4, 16, value >> 16), (4, 24, value >> 8)]
+        packed = ipv6_to_bytes(ip)
+        if packed is not None:
+            return [(6, 64, int.from_bytes(packed[:8], "big"))]
+        return []
+
+    def _route_reason(self, network: int, prefix: int = 24) -> Optional[str]:
+        """按内核路由表判断一个 IPv4 网段（默认 /24）是否不可路由，返回原因"""
+        start = network << (32 - prefix)
+        end = start | ((1 << (32 - prefix)) - 1)
+        for route_network, length, reject in self.routes:
+            mask = (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+            if length > prefix:
+                # 更细的路由只要有一条可用，就不整段跳过
+                if start <= route_network <= end and not reject:
+                    return None
+                continue
+            if start & mask == route_network & mask:
+                if reject:
+                    return f"路由表: 拒绝路由 {int_to_ipv4(route_network)}/{length}"
+                return None
+        return "路由表: 无路由"
+
+    def skip(self, ip: str) -> bool:
+        """目标所在网段已判定不可达时返回True，并计入该网段的跳过数"""
+        prefixes = self._prefixes(ip)
+        if not prefixes:
+            return False
+        with self.lock:
+            for key in prefixes:
+                if key in self.blocked:
+                    self.skipped[key] = self.skipped.get(key, 0) + 1
+                    return True
+            if self.routes is None or prefixes[0][0] != 4:
+                return False
+            key = prefixes[-1]
+            routable = self.route_checked.get(key[2])
+            if routable is None:
+                reason = self._route_reason(key[2])
+                routable = self.route_checked[key[2]] = reason is None
+                if reason:
+                    self.blocked[key] = reason
+                    self.skipped[key] = 1
+                    return True
+            return False
+
+    def is_blocked(self, ip: str) -> bool:
+        """目标所在网段是否已判定不可达（不计入跳过数）"""
+        with self.lock:
+            return any(key in self.blocked for key in self._prefixes(ip))
+
+    def learn(self, ip: str, status: str) -> Optional[str]:
+        """记录一次网络不可达结果，网段在本次被判定不可达时返回其CIDR"""
+        if status != STATUS_NET_UNREACHABLE or self.learn_after <= 0:
+            return None
+        prefixes = self._prefixes(ip)
+        if not prefixes:
+            return None
+        key = prefixes[-1]
+        with self.lock:
+            if any(prefix in self.blocked for prefix in prefixes):
+                return None
+            hosts = self.failures.setdefault(key, set())
+            hosts.add(ip)
+            if len(hosts) < self.learn_after:
+                return None
+            del self.failures[key]
+            self.blocked[key] = "网络不可达"
+            self.skipped.setdefault(key, 0)
+            if key[0] == 4 and self.routes is not None:
+                # 不同 /24 可能走不同的下一跳，只有路由表确认整个 /16 都不可路由时才升级
+                parent = prefixes[0]
+                siblings = sum(1 for version, length, network in self.blocked
+                               if version == 4 and length == 24 and network >> 8 == parent[2])
+                if siblings >= self.ESCALATE_AFTER:
+                    reason = self._route_reason(parent[2], 16)
+                    if reason:
+                        self.blocked[parent] = f"网络不可达，{reason}"
+                        self.skipped.setdefault(parent, 0)
+                        return self.format_prefix(parent)
+            return self.format_prefix(key)
+
+    @staticmethod
+    def format_prefix(key: Tuple[int, int, int]) -> str:
+        version, length, network = key
+        if version == 4:
+            return f"{int_to_ipv4(network << (32 - length))}/{length}"
+        return f"{ipaddress.IPv6Address(network << (128 - length))}/{length}"
+
+    def report(self) -> List[Tuple[str, str, int]]:
+        """跳过的网段列表 [(CIDR, 原因, 跳过的任务数)]，相邻且原因相同的网段合并"""
+        ranges = []
+        for key in sorted(self.blocked, key=lambda k: (k[0], k[2] << ((32 if k[0] == 4 else 128) - k[1]))):
+            version, length, network = key
+            bits = 32 if version == 4 else 128
+            start = network << (bits - length)
+            end = start + (1 << (bits - length)) - 1
+            reason, count = self.blocked[key], self.skipped.get(key, 0)
+            if ranges and ranges[-1][0] == version and ranges[-1][3] == reason \
+                    and start <= ranges[-1][2] + 1:
+                last = ranges[-1]
+                ranges[-1] = (version, last[1], max(last[2], end), reason, last[4] + count)
+            else:
+                ranges.append((version, start, end, reason, count))
+        report = []
+        for version, start, end, reason, count in ranges:
+            address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+            networks = ipaddress.summarize_address_range(address(start), address(end))
+            report.append((", ".join(str(network) for network in networks), reason, count))
+        return report
+
+
+class ScanDashboard:
+    """实时扫描面板：以固定频率采样计数器并刷新终端，不在探测路径上做额外计算
+
+    扫描线程只在各自的槽位记录正在探测的目标，并在已有的进度锁内累加结果计数；
+    速率、预计剩余时间和最慢主机都由刷新线程根据采样计算。
+    curses 不可用或输出不是终端时，退化为定期输出一行统计
+    """
+
+    REFRESH = 0.5
+    # 不支持curses时每隔多少秒输出一次统计行
+    PLAIN_INTERVAL = 5.0
+    SLOW_HOSTS = 8
+    RECENT_OPEN = 10
+
+    def __init__(self, total: int, threads: int, scheduler: HostScheduler,
+                 port_descriptions: Dict[int, str]):
+        self.total = total
+        self.scheduler = scheduler
+        self.port_descriptions = port_descriptions
+        self.slots = [None] * threads  # 每个线程正在探测的 (ip, port, 开始时间)
+        self.outcomes = [0] * len(ResultStore.STATE_NAMES)
+        self.skipped = 0  # 已取出但因时间预算到期未探测的任务
+        self.recent_open = deque(maxlen=self.RECENT_OPEN)
+        self.events = deque(maxlen=5)  # 最近的事件（熔断、tarpit等）
+        self.slow_hosts = {}  # {ip: 采样到的最长探测耗时}
+        self.samples = deque(maxlen=int(10 / self.REFRESH))  # 最近10秒的 (时间, 已完成数)
+        self.start_time = time.perf_counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.use_curses = curses is not None and sys.stdout.isatty()
+
+    def completed(self) -> int:
+        return sum(self.outcomes) + self.skipped + self.scheduler.skipped_tasks
+
+    def _sample(self) -> Dict:
+        """采样一次计数器，计算速率、预计剩余时间和最慢主机"""
+        now = time.perf_counter()
+        completed = self.completed()
+        self.samples.append((now, completed))
+        first_time, first_done = self.samples[0]
+        rate = (completed - first_done) / (now - first_time) if now > first_time else 0.0
+        for slot in self.slots:
+            if slot:
+                ip, _, started = slot
+                running = now - started
+                if running > self.slow_hosts.get(ip, 0.0):
+                    self.slow_hosts[ip] = running
+        if len(self.slow_hosts) > self.SLOW_HOSTS * 8:
+            slowest = sorted(self.slow_hosts.items(), key=lambda item: -item[1])[:self.SLOW_HOSTS]
+            self.slow_hosts = dict(slowest)
+        remaining = self.total - completed
+        return {
+            "completed": completed,
+            "rate": rate,
+            "in_flight": sum(1 for slot in self.slots if slot),
+            "elapsed": now - self.start_time,
+            "eta": remaining / rate if rate > 0 else None,
+        }
+
+    def _lines(self) -> List[str]:
+        stats = self._sample()
+        percent = stats["completed"] / self.total * 100 if self.total else 100.0
+        bar = "#" * int(percent / 100 * 40)
+        eta = format_duration(stats["eta"]) if stats["eta"] is not None else "--:--:--"
+        outcomes = "  ".join(f"{name} {count}" for name, count in
+                             zip(ResultStore.STATE_NAMES, self.outcomes))
+        lines = [
+            "PortScanner 扫描面板（Ctrl+C 中断）",
+            f"进度: {stats['completed']}/{self.total} ({percent:.1f}%)  [{bar:<40}]",
+            f"速率: {stats['rate']:.1f} 次/秒   正在探测: {stats['in_flight']}   "
+            f"已用: {format_duration(stats['elapsed'])}   预计剩余: {eta}",
+            f"结果: {outcomes}  跳过 {self.skipped + self.scheduler.skipped_tasks}",
+            "",
+            "最慢主机（采样到的最长探测耗时）:",
+        ]
+        slowest = sorted(self.slow_hosts.items(), key=lambda item: -item[1])[:self.SLOW_HOSTS]
+        lines.extend(f"  {ip:<40} {running:.2f} 秒" for ip, running in slowest)
+        lines.append("")
+        lines.append("最近发现的开放端口:")
+        lines.extend(f"  {format_target(ip, port):<46} {self.port_descriptions.get(port, 'Unknown')}"
+                     for ip, port in reversed(self.recent_open))
+        if self.events:
+            lines.append("")
+            lines.append("最近事件:")
+            lines.extend(f"  {event}" for event in reversed(self.events))
+        return lines
+
+    def _run_curses(self) -> None:
+        screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        try:
+            while not self.stop_event.wait(self.REFRESH):
+                screen.erase()
+                height, width = screen.getmaxyx()
+                for row, line in enumerate(self._lines()[:height - 1]):
+                    try:
+                        screen.addstr(row, 0, line[:width - 1])
+                    except curses.error:
+                        pass
+                screen.refresh()
+        finally:
+            curses.nocbreak()
+            curses.echo()
+            curses.endwin()
+
+    def _run_plain(self) -> None:
+        while not self.stop_event.wait(self.PLAIN_INTERVAL):
+            lines = self._lines()
+            with print_lock:
+                print(f"{Fore.CYAN}{lines[1]} | {lines[2]} | {lines[3]}")
+
+    def start(self) -> None:
+        target = self._run_curses if self.use_curses else self._run_plain
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+
+class ScanCoverage:
+    """扫描结束后判断某个目标是否实际探测过，与上次结果比对时未探测的目标不能判定为关闭
+
+    未探测的目标包括：被取消其余探测的主机（tarpit、熔断）、被跳过的不可达网段、
+    时间预算截止时未分发的任务；时间预算的未扫描任务在第一次查询时才展开
+    """
+
+    def __init__(self, cancelled_hosts=(), route_cache: RouteCache = None,
+                 planner: BudgetPlanner = None):
+        self.cancelled_hosts = set(cancelled_hosts)
+        self.route_cache = route_cache
+        self.planner = planner
+        self.unscanned = None
+
+    def scanned(self, ip: str, port: int) -> bool:
+        if ip in self.cancelled_hosts:
+            return False
+        if self.route_cache and self.route_cache.is_blocked(ip):
+            return False
+        if self.planner:
+            if self.unscanned is None:
+                self.unscanned = set(self.planner.unscanned())
+            return (ip, port) not in self.unscanned
+        return True
+
+
+def scan_ips_ports(ips: TargetList, ports: List[int], port_descriptions: Dict[int, str],
+                   timeout: float = 3.0, threads: int = 5,
+                   http_prober: HttpProber = None,
+                   rate_limiter: RateLimiter = None,
+                   randomize: bool = False, seed: int = None,
+                   host_limit: int = 0, task_range: Tuple[int, int] = None,
+                   verbose: bool = True, retries: int = 0,
+                   retry_backoff: float = 1.0, keep_all: bool = False,
+                   sinks: List = None, happy_eyeballs: bool = False,
+                   resources: SocketResourceManager = None,
+                   port_major: bool = False, time_budget: float = 0,
+                   tarpit_ratio: float = 0, tarpit_sample: int = 20,
+                   unreachable_limit: int = 0, route_learn: int = 0,
+                   check_routes: bool = False, dashboard: bool = False,
+                   top_hosts: int = 0, summary_format: str = "full",
+                   targets: ResultTargets = None) -> ResultStore:
+    """使用多线程扫描多个IP和端口，返回扫描结果用于导出
+
+    task_range 限定只扫描任务空间中的一段；verbose 为False时不输出开始信息和汇总（工作节点使用）；
+    keep_all 为True时关闭、超时等结果也保存到结果存储中；
+    sinks 为结果流的接收者（如扫描历史数据库），每条保存的结果都会调用其 write 方法；
+    happy_eyeballs 为True时域名目标同时尝试IPv6和IPv4，记录最先连通的地址；
+    resources 为套接字资源管理器，本机资源耗尽时暂停重试，并决定是否以SO_LINGER 0关闭；
+    port_major 为True时按 ports 的顺序逐个端口扫描所有主机；
+    time_budget 为限时扫描的秒数，到期停止并将未扫描的任务写入文件；
+    tarpit_ratio 大于0时检测接受任意端口的主机（前 tarpit_sample 次探测的开放比例或随机高端口），
+    判定后取消该主机剩余的探测；
+    unreachable_limit 大于0时，主机累计出现该次数的不可达错误后熔断，取消其剩余探测；
+    route_learn 大于0时，同一网段有该数量的主机返回网络不可达后跳过整个网段，
+    check_routes 为True时扫描前按内核路由表跳过没有路由的网段；
+    dashboard 为True时以实时面板代替逐行输出的进度；
+    top_hosts、summary_format 控制汇总中主机列表的输出（见 print_scan_summary）；
+    targets 为复查扫描的 (IP, 端口) 对，给定时代替 ips × ports 作为任务
+    """
+    if targets is not None:
+        total_tasks = len(targets)
+    elif task_range:
+        total_tasks = task_range[1] - task_range[0]
+    else:
+        total_tasks = len(ips) * len(ports)
+    if total_tasks <= 0:
+        print(f"{Fore.YELLOW}没有需要扫描的任务")
+        return ResultStore(keep_all)
+
+    # 惰性任务生成器，经调度器分发给各线程，不再预先展开全部任务
+    planner = None
+    if targets is not None:
+        tasks = iter(targets)
+    elif time_budget > 0:
+        planner = BudgetPlanner(ips, ports, time_budget, timeout, randomize, seed)
+        tasks = planner
+    else:
+        tasks = iter_tasks(ips, ports, randomize, seed, task_range, port_major)
+    route_cache = None
+    if route_learn > 0 or check_routes:
+        routes = read_kernel_routes() if check_routes else None
+        if check_routes and routes is None and verbose:
+            print(f"{Fore.YELLOW}无法读取内核路由表，只根据扫描结果学习不可达网段")
+        route_cache = RouteCache(route_learn, routes)
+    scheduler = HostScheduler(tasks, host_limit, retries, retry_backoff, route_cache)
+
+    # 列式结果存储
+    results = ResultStore(keep_all)
+
+    # 主机不可达熔断
+    breaker = HostCircuitBreaker(unreachable_limit) if unreachable_limit > 0 else None
+
+    # SYN代理/tarpit检测
+    tarpit = None
+    if tarpit_ratio > 0:
+        tarpit = TarpitDetector(ports, tarpit_ratio, tarpit_sample)
+
+    progress_counter = 0
+    progress_lock = threading.Lock()
+
+    # 打印扫描开始信息
+    if verbose:
+        print(f"{Fore.YELLOW}{'-' * 80}")
+        if targets is not None:
+            print(f"{Fore.WHITE}复查扫描: {targets.spec} 中的 {len(targets)} 个端口")
+        else:
+            print(f"{Fore.WHITE}开始扫描: {len(ips)} 个IP, {len(ports)} 个端口")
+        print(f"{Fore.WHITE}超时时间: {timeout} 秒, 线程数量: {threads}")
+        if randomize:
+            print(f"{Fore.WHITE}随机扫描顺序, 种子: {seed}")
+        if host_limit > 0:
+            print(f"{Fore.WHITE}单主机并发上限: {host_limit}")
+        if retries > 0:
+            print(f"{Fore.WHITE}超时重试: 最多 {retries} 次, 退避 {retry_backoff:g} 秒起")
+        if rate_limiter and rate_limiter.global_bucket:
+            print(f"{Fore.WHITE}速率上限: {rate_limiter.global_bucket.rate:g} 次/秒")
+        if rate_limiter and rate_limiter.subnet_rate > 0:
+            print(f"{Fore.WHITE}每个/24网段速率上限: {rate_limiter.subnet_rate:g} 次/秒")
+        if planner:
+            deadline = time.strftime("%H:%M:%S", time.localtime(time.time() + time_budget))
+            print(f"{Fore.WHITE}时间预算: {time_budget / 60:g} 分钟, 截止于 {deadline}")
+        print(f"{Fore.GREEN}{'-' * 80}\n")
+    start_time = time.time()
+
+    # HTTP探测与端口扫描并行进行
+    if http_prober:
+        http_prober.start()
+
+    # 实时面板
+    panel = ScanDashboard(total_tasks, threads, scheduler, port_descriptions) if dashboard else None
+
+    def notify(message: str, color: str = Fore.MAGENTA) -> None:
+        """输出扫描过程中的事件，启用面板时显示在面板中"""
+        if panel:
+            panel.events.append(message)
+        else:
+            with print_lock:
+                print(f"\n{color}{message}")
+
+    def count_skipped() -> None:
+        """已取出但因时间预算到期未探测的任务计入面板的跳过数"""
+        if panel:
+            with progress_lock:
+                panel.skipped += 1
+
+    if http_prober and panel:
+        http_prober.reporter = notify
+
+    def report_tarpit(ip: str, verdict: Optional[Tuple[str, List[int]]]) -> None:
+        """主机被判定为SYN代理/tarpit时取消其余探测并标记已保存的结果"""
+        if not verdict:
+            return
+        reason, flagged_rows = verdict
+        scheduler.cancel_host(ip)
+        for flagged_row in flagged_rows:
+            results.set_extra(flagged_row, {"Anomaly": f"疑似SYN代理/tarpit: {reason}"})
+        notify(f"{ip} 疑似SYN代理/tarpit（{reason}），已取消其余探测")
+
+    # 定义线程工作函数
+    def scan_worker(slot: int):
+        nonlocal progress_counter
+        while True:
+            task = scheduler.next_task()
+            if task is None:
+                break
+            ip, port = task
+            # tarpit检测追加的随机高端口，不属于扫描任务
+            canary = tarpit is not None and tarpit.is_canary(ip, port)
+
+            try:
+                # 按令牌桶限速
+                if rate_limiter:
+                    rate_limiter.acquire(ip)
+
+                # 时间预算已用完，不再探测（限速等待之后再判断，按实际开始探测的时刻计算）
+                if planner and planner.expired():
+                    if canary:
+                        tarpit.canary_result(ip, port, False)
+                    else:
+                        planner.skip(ip, port)
+                        count_skipped()
+                    continue
+                if planner and not canary:
+                    planner.begin()
+
+                linger0 = resources.linger0 if resources else False
+                if panel:
+                    panel.slots[slot] = (ip, port, time.perf_counter())
+                for attempt in range(SocketResourceManager.MAX_THROTTLE_ATTEMPTS):
+                    probe_start = time.perf_counter()
+                    connected = None
+                    if happy_eyeballs:
+                        is_open, status, connected = check_port_racing(ip, port, timeout, linger0)
+                    else:
+                        is_open, status = check_port(ip, port, timeout, linger0)
+                    rtt = time.perf_counter() - probe_start
+                    # 本机资源耗尽与目标无关，暂停后重新探测
+                    if status != STATUS_RESOURCE or not resources:
+                        break
+                    resources.throttle()
+                if panel:
+                    panel.slots[slot] = None
+                if canary:
+                    report_tarpit(ip, tarpit.canary_result(ip, port, is_open))
+                    continue
+                if planner:
+                    planner.observe(ip, is_timeout_status(status))
+
+                # 超时结果先进入重试队列，重试结束后才计入进度
+                if scheduler.retry(ip, port, is_timeout_status(status)):
+                    continue
+
+                # 已判定为SYN代理/tarpit的主机，其余结果不再保存
+                if tarpit and tarpit.is_flagged(ip):
+                    scheduler.skip_task(ip)
+                    continue
+
+                # 网段不可达时整段跳过
+                if route_cache:
+                    network = route_cache.learn(ip, status)
+                    if network:
+                        notify(f"网段 {network} 网络不可达，跳过该网段其余目标")
+
+                # 主机不可达时熔断，取消其剩余的探测
+                if breaker and breaker.record(ip, status):
+                    scheduler.cancel_host(ip)
+                    notify(f"{ip} {status}，已取消其余探测")
+
+                # 保存结果（默认只保存开放端口）
+                port_desc = port_descriptions.get(port, "Unknown")
+                state = ResultStore.state_of(is_open, status)
+                row = results.add(ip, port, state, port_desc, status)
+                if row is not None and connected:
+                    results.set_extra(row, {
+                        "Address": connected,
+                        "AddressFamily": "IPv6" if ":" in connected else "IPv4",
+                    })
+                if row is not None:
+                    for sink in sinks or []:
+                        sink.write(ip, port, state, port_desc, rtt)
+
+                if tarpit:
+                    report_tarpit(ip, tarpit.observe(ip, is_open, row))
+                    for canary_port in tarpit.take_canaries(ip):
+                        scheduler.inject(ip, canary_port)
+
+                # 更新进度（被取消的任务也计入已完成）
+                with progress_lock:
+                    progress_counter += 1
+                    results.probed[port] = results.probed.get(port, 0) + 1
+                    current = min(progress_counter + scheduler.skipped_tasks, total_tasks)
+                    progress = (current / total_tasks) * 100
+                    if panel:
+                        panel.outcomes[state] += 1
+
+                if is_open and http_prober:
+                    http_prober.submit(ip, port, row)
+
+                # 启用面板时由面板采样显示
+                if panel:
+                    if is_open:
+                        panel.recent_open.append((ip, port))
+                    continue
+
+                # 输出结果
+                with print_lock:
+                    # 显示进度
+                    sys.stdout.write(f"\r{Fore.RED}扫描进度: {Fore.YELLOW}{progress:.1f}% ({current}/{total_tasks})")
+                    sys.stdout.flush()
+
+                    # 只显示开放的端口
+                    if is_open:
+                        # 为Unknown描述设置灰色，其他使用青色
+                        desc_color = Fore.CYAN if port_desc != "Unknown" else Fore.LIGHTBLACK_EX
+
+                        # 格式化输出，三列严格对齐
+                        print(f"\n{Fore.WHITE}{ip}:{port:<30} {desc_color}{port_desc:<40} {Fore.GREEN}{status:>20}")
+
+            except Exception as e:
+                notify(f"扫描 {ip}:{port} 时出错: {str(e)}", Fore.RED)
+            finally:
+                if panel:
+                    panel.slots[slot] = None
+                scheduler.done(ip)
+
+    # 创建并启动线程
+    if panel:
+        panel.start()
+    thread_list = []
+    for slot in range(threads):
+        thread = threading.Thread(target=scan_worker, args=(slot,))
+        thread.daemon = True  # 守护线程
+        thread_list.append(thread)
+        thread.start()
+
+    # 等待所有线程完成任务
+    try:
+        for thread in thread_list:
+            thread.join()
+    finally:
+        if panel:
+            panel.stop()
+            if http_prober:
+                # 面板已退出，剩余的HTTP探测结果直接输出
+                http_prober.reporter = None
+
+    # 被跳过的任务可能在最后一次进度输出之后才被取出，补充输出最终进度
+    if scheduler.skipped_tasks and not panel:
+        current = min(progress_counter + scheduler.skipped_tasks, total_tasks)
+        sys.stdout.write(f"\r{Fore.RED}扫描进度: {Fore.YELLOW}"
+                         f"{current / total_tasks * 100:.1f}% ({current}/{total_tasks})")
+        sys.stdout.flush()
+
+    # 等待HTTP探测完成，并将结果附加到对应行
+    if http_prober:
+        http_results = http_prober.close()
+        for row, responses in http_results.items():
+            first = responses[0]
+            results.set_extra(row, {
+                "HttpStatus": first["status"],
+                "Server": first["server"],
+                "Title": first["title"],
+                "HttpPaths": ", ".join(f"{r['path']}:{r['status']}" for r in responses[1:]),
+            })
+
+    for sink in sinks or []:
+        sink.flush()
+
+    if scheduler.cancelled or planner or (route_cache and route_cache.blocked):
+        results.coverage = ScanCoverage(scheduler.cancelled, route_cache, planner)
+
+    end_time = time.time()
+    elapsed = end_time - start_time
+
+    if verbose:
+        if rate_limiter:
+            observed_rate = rate_limiter.observed_rate()
+        else:
+            probed = planner.probed if planner else total_tasks
+            observed_rate = probed / elapsed if elapsed > 0 else 0.0
+        notes = []
+        if resources and resources.throttle_count:
+            notes.append(f"资源限流: 因本机fd或本地端口耗尽暂停重试 {resources.throttle_count} 次")
+        if retries > 0:
+            recovery = scheduler.recovered / scheduler.retried * 100 if scheduler.retried else 0.0
+            notes.append(f"超时重试: {scheduler.retried} 个目标进入重试, "
+                         f"恢复 {scheduler.recovered} 个 ({recovery:.1f}%)")
+        if tarpit and tarpit.flagged:
+            skipped = sum(scheduler.cancelled.get(flagged_ip, 0) for flagged_ip in tarpit.flagged)
+            notes.append(f"疑似SYN代理/tarpit主机: {len(tarpit.flagged)} 个, 取消探测 {skipped} 次")
+            for flagged_ip, reason in tarpit.flagged.items():
+                notes.append(f"  {flagged_ip}: {reason}")
+        if breaker and breaker.tripped:
+            notes.append(f"不可达主机: {len(breaker.tripped)} 个")
+            for tripped_ip, status in breaker.tripped.items():
+                notes.append(f"  {tripped_ip}: {status}，取消 {scheduler.cancelled.get(tripped_ip, 0)} 个端口")
+        if route_cache and route_cache.blocked:
+            notes.append(f"跳过不可达网段: {len(route_cache.blocked)} 个, 共 {scheduler.route_skipped} 个任务")
+            for network, reason, count in route_cache.report():
+                notes.append(f"  {network}: {reason}，跳过 {count} 个任务")
+        if planner:
+            unscanned, filename = planner.write_unscanned(scheduler.cancelled)
+            if unscanned:
+                notes.append(f"时间预算已用完: 完成 {planner.probed} 次探测, "
+                             f"未扫描 {unscanned} 个目标已写入 {filename}")
+            else:
+                notes.append(f"时间预算内完成全部 {planner.probed} 次探测")
+        print_scan_summary(results, port_descriptions, elapsed, observed_rate, notes,
+                           top_hosts, summary_format)
+
+    return results
+
+
+def dns_query(name: str, qtype: int, query_id: int = 0x5053) -> bytes:
+    """构造一个DNS查询报文（递归查询，IN类）"""
+    labels = b"".join(bytes([len(label)]) + label.encode("ascii")
+                      for label in name.split(".") if label)
+    return struct.pack(">HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + labels + b"\x00" + struct.pack(">HH", qtype, 1)
+
+
+# UDP协议载荷：开放的服务大多只回应格式正确的请求，其它端口发送空报文
+UDP_PAYLOADS = {
+    53: dns_query("", 2),  # 根域NS查询，任何DNS服务都会回应（包括REFUSED）
+    111: struct.pack(">10I", 0x50530001, 0, 2, 100000, 2, 0, 0, 0, 0, 0),  # portmapper NULL调用
+    123: b"\x1b" + b"\x00" * 47,  # NTPv3 客户端请求
+    137: (b"\x80\xf0\x00\x10\x00\x01\x00\x00\x00\x00\x00\x00\x20" + b"CK" + b"A" * 30
+          + b"\x00\x00\x21\x00\x01"),  # NetBIOS NBSTAT
+    161: bytes.fromhex("302902010004067075626c6963a01c02044e534e31020100020100"
+                       "300e300c06082b060102010101000500"),  # SNMPv1 GET sysDescr.0, community public
+    1900: (b"M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\n"
+           b"MAN: \"ssdp:discover\"\r\nMX: 1\r\nST: ssdp:all\r\n\r\n"),  # SSDP
+    5353: dns_query("_services._dns-sd._udp.local", 12),  # mDNS 服务枚举
+    11211: b"\x00\x01\x00\x00\x00\x01\x00\x00version\r\n",  # memcached
+}
+
+# Linux下未连接的UDP套接字只有开启 IP_RECVERR 才能收到ICMP错误（端口不可达等）
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+IPV6_RECVERR = getattr(socket, "IPV6_RECVERR", 25)
+SO_EE_ORIGIN_ICMP, SO_EE_ORIGIN_ICMP6 = 2, 3
+# ICMP管理禁止（网络/主机/通信被禁止），说明端口被过滤
+ICMP_PROHIBITED_CODES = {(3, 9), (3, 10), (3, 13), (1, 1)}
+
+
+class UdpScanner:
+    """UDP扫描引擎：少量非阻塞套接字发送协议载荷，在selector循环中批量读取响应和ICMP错误
+
+    收到数据为开放，ICMP端口不可达为关闭，重传后仍无响应为开放|过滤。
+    多数系统对ICMP错误限速（Linux默认每台主机约每秒1个，允许少量突发），
+    因此每台主机单独控制发送间隔：曾回应过ICMP的主机出现无响应时，判定为ICMP被限速，
+    将该主机的发送间隔加倍后重传，避免把关闭的端口误判为开放|过滤。
+    ICMP错误依赖Linux的 IP_RECVERR，其它系统上关闭的端口会显示为开放|过滤
+    """
+
+    SOCKETS = 4  # 每个地址族的套接字数量
+    WINDOW = 1024  # 同时等待响应的探测上限
+    HOST_RATE = 100.0  # 每台主机的初始发送速率（次/秒）
+    MIN_HOST_RATE = 1.0  # ICMP限速时每台主机降到的最低速率
+    RECV_BUFFER = 1 << 20
+    DEFAULT_RETRIES = 1
+
+    def __init__(self, timeout: float = 3.0, retries: int = DEFAULT_RETRIES,
+                 rate_limiter: RateLimiter = None):
+        self.timeout = timeout
+        self.retries = retries
+        self.rate_limiter = rate_limiter
+        self.selector = selectors.DefaultSelector()
+        self.sockets = {}  # {地址族: [套接字...]}
+        self.sent = 0
+        self.recverr = sys.platform.startswith("linux")
+        self.icmp_limited = set()  # 因ICMP限速降低过发送速率的主机
+
+    def _socket(self, family: int) -> socket.socket:
+        """按轮转取得该地址族的套接字，首次使用时创建"""
+        pool = self.sockets.get(family)
+        if pool is None:
+            pool = self.sockets[family] = []
+            for _ in range(self.SOCKETS):
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECV_BUFFER)
+                    if self.recverr:
+                        if family == socket.AF_INET6:
+                            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+                        else:
+                            sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+                except OSError:
+                    pass
+                self.selector.register(sock, selectors.EVENT_READ)
+                pool.append(sock)
+        pool.append(pool.pop(0))
+        return pool[-1]
+
+    def close(self) -> None:
+        for pool in self.sockets.values():
+            for sock in pool:
+                self.selector.unregister(sock)
+                sock.close()
+        self.sockets = {}
+        self.selector.close()
+
+    @staticmethod
+    def _key(address: str, port: int) -> Tuple[str, int]:
+        """响应的源地址与探测目标的匹配键，IPv6地址统一为压缩格式"""
+        if ":" in address:
+            address = socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, address.partition("%")[0]))
+        return address, port
+
+    def _read_errors(self, sock: socket.socket) -> Iterator[Tuple[Tuple[str, int], str]]:
+        """读取套接字错误队列中的ICMP错误，生成 (匹配键, 状态)"""
+        while True:
+            try:
+                _, ancdata, _, address = sock.recvmsg(0, 512, socket.MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            for level, kind, data in ancdata:
+                if (level, kind) not in ((socket.IPPROTO_IP, IP_RECVERR),
+                                         (socket.IPPROTO_IPV6, IPV6_RECVERR)) or len(data) < 16:
+                    continue
+                code, origin, icmp_type, icmp_code = struct.unpack_from("=IBBB", data)
+                if origin in (SO_EE_ORIGIN_ICMP, SO_EE_ORIGIN_ICMP6) and \
+                        (icmp_type, icmp_code) in ICMP_PROHIBITED_CODES:
+                    status = "被过滤"
+                elif code in REFUSED_ERRNOS:
+                    status = "关闭"
+                else:
+                    status = unreachable_status(code) or f"错误: {os.strerror(code)}"
+                yield self._key(address[0], address[1]), status
+
+    def _read(self, sock: socket.socket) -> Iterator[Tuple[Tuple[str, int], str, bytes]]:
+        """批量读取一个套接字上所有已到达的响应和ICMP错误"""
+        while True:
+            try:
+                data, address = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # 错误队列中有ICMP错误（Windows上直接以连接重置报告，无法得知来源）
+                if not self.recverr:
+                    continue
+                for key, status in self._read_errors(sock):
+                    yield key, status, b""
+                continue
+            yield self._key(address[0], address[1]), "开放", data
+        if self.recverr:
+            for key, status in self._read_errors(sock):
+                yield key, status, b""
+
+    def scan(self, tasks: Iterator[Tuple[str, int]], on_result, cancelled=None) -> None:
+        """探测全部任务，每个目标得出结论时调用 on_result(ip, 端口, 状态, 响应数据, 往返时间)
+
+        cancelled(ip, 端口) 在发送前调用，返回True时放弃该探测（如主机已熔断）
+        """
+        hosts = {}  # {目标: [下次可发送时间, 发送间隔, 待发送的 (端口, 第几次) 队列, 等待响应数, 是否回应过ICMP]}
+        ready = []  # 有待发送探测的主机，按下次可发送时间排序的堆
+        pending = {}  # {匹配键: [目标, 端口, 第几次, 发送时间]}
+        expiry = deque()  # (截止时间, 匹配键, 第几次)；超时时间固定，按发送顺序即按截止时间排序
+        queued = 0
+        sequence = 0
+        exhausted = False
+        tasks = iter(tasks)
+
+        def enqueue(ip: str, port: int, attempt: int, now: float) -> None:
+            nonlocal queued, sequence
+            host = hosts.get(ip)
+            if host is None:
+                host = hosts[ip] = [now, 1.0 / self.HOST_RATE, deque(), 0, False]
+            if not host[2]:
+                sequence += 1
+                heapq.heappush(ready, (host[0], sequence, ip))
+            host[2].append((port, attempt))
+            queued += 1
+
+        def release(ip: str) -> None:
+            # 主机没有待发送和等待中的探测时释放，只保留降过速的主机
+            host = hosts.get(ip)
+            if host and not host[2] and not host[3] and host[1] <= 1.0 / self.HOST_RATE:
+                del hosts[ip]
+
+        def finish(key: Tuple[str, int], status: str, data: bytes, now: float) -> None:
+            probe = pending.pop(key, None)
+            if probe is None:
+                return
+            ip, port, _, sent_at = probe
+            host = hosts.get(ip)
+            if host:
+                host[3] -= 1
+                if status == "关闭":
+                    host[4] = True
+            on_result(ip, port, status, data, now - sent_at)
+            release(ip)
+
+        while True:
+            now = time.perf_counter()
+
+            # 补充任务，待发送与等待响应的探测不超过窗口
+            while not exhausted and len(pending) + queued < self.WINDOW:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                enqueue(task[0], task[1], 0, now)
+
+            # 发送到达发送时间的主机的下一个探测
+            while ready and ready[0][0] <= now and len(pending) < self.WINDOW:
+                _, _, ip = heapq.heappop(ready)
+                host = hosts[ip]
+                port, attempt = host[2].popleft()
+                queued -= 1
+                if cancelled and cancelled(ip, port):
+                    if host[2]:
+                        sequence += 1
+                        heapq.heappush(ready, (host[0], sequence, ip))
+                    else:
+                        release(ip)
+                    continue
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(ip)
+                status = None
+                requeue = False
+                try:
+                    family, address = resolve_host(ip)[0]
+                    key = self._key(address[0], port)
+                    if key in pending:
+                        # 与等待中的探测地址相同（如域名与其IP同时作为目标），等其结束后再发送
+                        requeue = True
+                    else:
+                        payload = UDP_PAYLOADS.get(port, b"")
+                        self._socket(family).sendto(payload, (address[0], port) + address[1:])
+                        self.sent += 1
+                except ExcludedAddressError:
+                    status = STATUS_EXCLUDED
+                except (socket.gaierror, IndexError):
+                    status = "无效IP地址"
+                except (BlockingIOError, InterruptedError):
+                    # 发送缓冲区已满，稍后重发
+                    requeue = True
+                except OSError as e:
+                    status = unreachable_status(e.errno) or f"错误: {e.strerror}"
+                now = time.perf_counter()
+                if requeue:
+                    host[2].append((port, attempt))
+                    queued += 1
+                host[0] = now + host[1]
+                if host[2]:
+                    sequence += 1
+                    heapq.heappush(ready, (host[0], sequence, ip))
+                if status:
+                    on_result(ip, port, status, b"", 0.0)
+                    release(ip)
+                elif not requeue:
+                    pending[key] = [ip, port, attempt, now]
+                    host[3] += 1
+                    expiry.append((now + self.timeout, key, attempt))
+
+            # 处理超时：重传，或判定为开放|过滤
+            while expiry and expiry[0][0] <= now:
+                _, key, attempt = expiry.popleft()
+                probe = pending.get(key)
+                if probe is None or probe[2] != attempt:
+                    continue
+                ip, port = probe[0], probe[1]
+                host = hosts[ip]
+                if attempt < self.retries:
+                    del pending[key]
+                    host[3] -= 1
+                    if host[4]:
+                        # 该主机回应过ICMP，无响应多半是ICMP被限速：降低发送速率后重传
+                        host[1] = min(host[1] * 2, 1.0 / self.MIN_HOST_RATE)
+                        self.icmp_limited.add(ip)
+                    enqueue(ip, port, attempt + 1, now)
+                else:
+                    finish(key, STATUS_OPEN_FILTERED, b"", now)
+
+            if exhausted and not pending and not queued:
+                break
+
+            # 等待到下一个发送时间或截止时间，期间批量读取响应
+            wake = []
+            if ready and len(pending) < self.WINDOW:
+                wake.append(ready[0][0])
+            if expiry:
+                wake.append(expiry[0][0])
+            wait = max(0.0, min(wake) - time.perf_counter()) if wake else None
+            if not self.sockets:
+                time.sleep(wait or 0)
+                continue
+            for selected, _ in self.selector.select(wait):
+                now = time.perf_counter()
+                for key, status, data in self._read(selected.fileobj):
+                    finish(key, status, data, now)
+
+
+def response_preview(data: bytes, limit: int = 48) -> str:
+    """UDP响应的前若干字节，不可打印字符显示为点"""
+    return "".join(chr(byte) if 32 <= byte < 127 else "." for byte in data[:limit])
+
+
+def scan_udp_ports(ips: TargetList, ports: List[int], port_descriptions: Dict[int, str],
+                   timeout: float = 3.0, retries: int = UdpScanner.DEFAULT_RETRIES,
+                   rate_limiter: RateLimiter = None, randomize: bool = False, seed: int = None,
+                   keep_all: bool = False, sinks: List = None, unreachable_limit: int = 0,
+                   top_hosts: int = 0, summary_format: str = "full") -> ResultStore:
+    """UDP扫描多个IP和端口，返回扫描结果用于导出，参数含义同 scan_ips_ports
+
+    按端口优先的顺序生成任务，同一主机的探测自然分散开，减少触发ICMP限速；
+    开放|过滤的结果只在 keep_all 时保存，汇总中给出其数量
+    """
+    total_tasks = len(ips) * len(ports)
+    results = ResultStore(keep_all)
+    breaker = HostCircuitBreaker(unreachable_limit) if unreachable_limit > 0 else None
+    scanner = UdpScanner(timeout, retries, rate_limiter)
+    outcomes = {"completed": 0, "skipped": 0, "open_filtered": 0}
+
+    print(f"{Fore.YELLOW}{'-' * 80}")
+    print(f"{Fore.WHITE}开始UDP扫描: {len(ips)} 个IP, {len(ports)} 个端口")
+    print(f"{Fore.WHITE}超时时间: {timeout} 秒, 重传: {retries} 次, "
+          f"协议载荷: {len([port for port in ports if port in UDP_PAYLOADS])} 个端口")
+    if randomize:
+        print(f"{Fore.WHITE}随机扫描顺序, 种子: {seed}")
+    if rate_limiter and rate_limiter.global_bucket:
+        print(f"{Fore.WHITE}速率上限: {rate_limiter.global_bucket.rate:g} 次/秒")
+    print(f"{Fore.GREEN}{'-' * 80}\n")
+    start_time = time.time()
+
+    def cancelled(ip: str, port: int) -> bool:
+        # 已熔断的主机不再发送，计入进度
+        if breaker and ip in breaker.tripped:
+            outcomes["skipped"] += 1
+            return True
+        return False
+
+    def on_result(ip: str, port: int, status: str, data: bytes, rtt: float) -> None:
+        is_open = status == "开放"
+        if status == STATUS_OPEN_FILTERED:
+            outcomes["open_filtered"] += 1
+        if breaker and breaker.record(ip, status):
+            print(f"\n{Fore.MAGENTA}{ip} {status}，已取消其余探测")
+
+        port_desc = port_descriptions.get(port, "Unknown")
+        state = ResultStore.state_of(is_open, status)
+        row = results.add(ip, port, state, port_desc, status)
+        if row is not None and data:
+            results.set_extra(row, {"Response": response_preview(data)})
+        if row is not None:
+            for sink in sinks or []:
+                sink.write(ip, port, state, port_desc, rtt)
+
+        outcomes["completed"] += 1
+        current = min(outcomes["completed"] + outcomes["skipped"], total_tasks)
+        sys.stdout.write(f"\r{Fore.RED}扫描进度: {Fore.YELLOW}"
+                         f"{current / total_tasks * 100:.1f}% ({current}/{total_tasks})")
+        sys.stdout.flush()
+        if is_open:
+            desc_color = Fore.CYAN if port_desc != "Unknown" else Fore.LIGHTBLACK_EX
+            print(f"\n{Fore.WHITE}{ip}:{port:<30} {desc_color}{port_desc:<40} {Fore.GREEN}{status:>20}")
+
+    try:
+        scanner.scan(iter_tasks(ips, ports, randomize, seed, port_major=True), on_result, cancelled)
+    finally:
+        scanner.close()
+    if outcomes["skipped"]:
+        current = min(outcomes["completed"] + outcomes["skipped"], total_tasks)
+        sys.stdout.write(f"\r{Fore.RED}扫描进度: {Fore.YELLOW}"
+                         f"{current / total_tasks * 100:.1f}% ({current}/{total_tasks})")
+        sys.stdout.flush()
+
+    for sink in sinks or []:
+        sink.flush()
+
+    elapsed = time.time() - start_time
+    if rate_limiter:
+        observed_rate = rate_limiter.observed_rate()
+    else:
+        observed_rate = scanner.sent / elapsed if elapsed > 0 else 0.0
+    notes = [f"开放|过滤（无响应）: {outcomes['open_filtered']}"
+             f"{'' if keep_all else '（使用 --keep-all 保存）'}"]
+    if scanner.icmp_limited:
+        notes.append(f"疑似ICMP限速: {len(scanner.icmp_limited)} 台主机已降低发送速率后重传")
+    if breaker and breaker.tripped:
+        notes.append(f"不可达主机: {len(breaker.tripped)} 个, 共跳过 {outcomes['skipped']} 个任务")
+        for tripped_ip, status in breaker.tripped.items():
+            notes.append(f"  {tripped_ip}: {status}")
+    print_scan_summary(results, port_descriptions, elapsed, observed_rate, notes,
+                       top_hosts, summary_format)
+    if breaker and breaker.tripped:
+        results.coverage = ScanCoverage(breaker.tripped)
+    return results
+
+
+def print_scan_summary(results: ResultStore, port_descriptions: Dict[int, str],
+                       elapsed: float, observed_rate: float, notes: List[str] = None,
+                       top_hosts: int = 0, summary_format: str = "full") -> None:
+    """输出最终统计结果和每个IP的开放端口列表，notes 为附加的统计信息行
+
+    主机列表直接按结果存储的分组视图逐台输出，不预先拼接整个汇总；
+    top_hosts 大于0时只输出开放端口最多的前N台主机；
+    summary_format 为 compact 时输出便于程序处理的无颜色格式（统计行以#开头，每台主机一行：
+    IP<TAB>开放端口数<TAB>端口列表），为 none 时不输出主机列表
+    """
+    total_open = results.count(ResultStore.STATE_OPEN)
+    compact = summary_format == "compact"
+
+    # 输出最终统计结果
+    stats = [f"扫描完成! 耗时: {elapsed:.2f} 秒",
+             f"总开放端口数: {total_open}",
+             f"实际探测速率: {observed_rate:.1f} 次/秒"]
+    stats.extend(notes or [])
+    if results.keep_all:
+        stats.append(f"关闭: {results.count(ResultStore.STATE_CLOSED)}, "
+                     f"超时: {results.count(ResultStore.STATE_TIMEOUT)}, "
+                     f"错误: {results.count(ResultStore.STATE_ERROR)}")
+    if compact:
+        # 先结束进度行
+        print()
+        for line in stats:
+            print(f"# {line}")
+    else:
+        print(f"\n\n{Fore.GREEN}{'-' * 80}")
+        for line in stats:
+            print(f"{Fore.YELLOW}{line}")
+
+    # 逐台输出每个IP的开放端口列表
+    counts = results.host_counts(ResultStore.STATE_OPEN) if top_hosts > 0 else None
+    if summary_format != "none":
+        for ip, rows in iter_summary_hosts(results, top_hosts, counts):
+            if compact:
+                ports = ",".join(str(results.ports[row]) for row in rows)
+                sys.stdout.write(f"{ip}\t{len(rows)}\t{ports}\n")
+                continue
             print(f"\n{Fore.BLUE}IP: {ip} 开放的端口:")
             port_info = []
-            for port in open_ports[ip]:
+            for row in rows:
+                port = results.ports[row]
                 desc = port_descriptions.get(port, "Unknown")
                 # 为Unknown描述设置灰色
                 desc_color = Fore.GREEN if desc != "Unknown" else Fore.LIGHTBLACK_EX
@@ -456,9 +3683,894 @@ def scan_ips_ports(ips: List[str], ports: List[int], port_descriptions: Dict[int
             # 用逗号拼接成整齐的列表
             print(f"{Fore.GREEN}  " + ", ".join(port_info))
 
-    print(f"\n{Fore.YELLOW}{'-' * 80}")
+    if counts and len(counts) > top_hosts and not compact:
+        print(f"\n{Fore.YELLOW}共 {len(counts)} 台主机有开放端口，只列出开放端口最多的 {top_hosts} 台")
+    if not compact:
+        print(f"\n{Fore.YELLOW}{'-' * 80}")
+
 
-    return export_results
+def iter_summary_hosts(results: ResultStore, top_hosts: int = 0,
+                       counts: Dict[Tuple[int, int], int] = None) -> Iterator[Tuple[str, List[int]]]:
+    """汇总要输出的主机及其开放端口行号；指定 top_hosts 时按开放端口数从多到少只取前N台
+
+    counts 为已统计好的 host_counts 结果，未提供时重新统计
+    """
+    if top_hosts <= 0:
+        yield from results.group_by_host(ResultStore.STATE_OPEN)
+        return
+    if counts is None:
+        counts = results.host_counts(ResultStore.STATE_OPEN)
+    top = heapq.nlargest(top_hosts, counts.items(), key=lambda item: item[1])
+    groups = dict((key, (ip, rows)) for key, ip, rows in
+                  results.group_by_host(ResultStore.STATE_OPEN, {key for key, _ in top}, with_key=True))
+    for key, _ in top:
+        yield groups[key]
+
+
+def parse_address(address: str) -> Tuple[int, object]:
+    """解析分布式模式的监听/连接地址：host:port 或 unix:/path/to/socket，省略host时为127.0.0.1"""
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("当前系统不支持Unix套接字")
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"无效的地址格式: {address}，应为 host:port 或 unix:/path")
+    host = host.strip("[]") or "127.0.0.1"
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    return family, (host, int(port))
+
+
+def send_message(stream, message: Dict) -> None:
+    """按行发送一条JSON消息"""
+    stream.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+    stream.flush()
+
+
+def recv_message(stream) -> Optional[Dict]:
+    """读取一行JSON消息，连接关闭时返回None"""
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+class ScanCoordinator:
+    """分布式扫描协调端：把 目标 × 端口 任务空间切分为租约，分发给各工作节点并合并结果
+
+    工作节点断开或租约超时后，未完成的租约会重新分发。
+    每条消息都需携带共享令牌，令牌不符的连接直接断开，不下发配置也不接收结果。
+    速率上限是所有工作节点合计的上限，每个租约按当前已连接的工作节点数分配各自的份额
+    """
+
+    def __init__(self, address: str, config: Dict, total_tasks: int,
+                 lease_size: int = 1000, lease_timeout: float = 600.0, keep_all: bool = False,
+                 token: str = ""):
+        self.family, self.address = parse_address(address)
+        self.config = config
+        self.token = token
+        self.total_tasks = total_tasks
+        self.lease_timeout = lease_timeout
+        # 待分发的租约 [(lease_id, start, end)]
+        self.pending = deque(
+            (lease_id, start, min(start + lease_size, total_tasks))
+            for lease_id, start in enumerate(range(0, total_tasks, lease_size))
+        )
+        self.lease_count = len(self.pending)
+        self.active = {}  # {lease_id: (start, end, 工作节点标识, 分发时间)}
+        self.completed = set()
+        self.workers = set()  # 已连接的工作节点标识
+        self.results = ResultStore(keep_all)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.pending:
+            self.finished.set()
+
+    def _reclaim_expired(self) -> None:
+        """回收超时未完成的租约"""
+        now = time.time()
+        for lease_id, (start, end, owner, issued) in list(self.active.items()):
+            if now - issued > self.lease_timeout:
+                del self.active[lease_id]
+                self.pending.append((lease_id, start, end))
+
+    def next_lease(self, owner: str) -> Dict:
+        """为工作节点分配下一个租约"""
+        with self.lock:
+            self._reclaim_expired()
+            while self.pending:
+                lease_id, start, end = self.pending.popleft()
+                if lease_id in self.completed:
+                    # 重新分发前已被其它节点完成
+                    continue
+                self.active[lease_id] = (start, end, owner, time.time())
+                share = max(1, len(self.workers))
+                return {"type": "lease", "id": lease_id, "start": start, "end": end,
+                        "rate": self.config.get("rate", 0) / share,
+                        "subnet_rate": self.config.get("subnet_rate", 0) / share}
+            if self.finished.is_set():
+                return {"type": "done"}
+            # 所有租约都已分发但尚未全部完成，让工作节点稍后再来
+            return {"type": "wait"}
+
+    def complete_lease(self, lease_id: int, results: List[Dict],
+                       probed: Dict[str, int] = None) -> None:
+        """记录租约结果和各端口的探测数，重复提交的租约只保留第一次的结果"""
+        with self.lock:
+            if lease_id in self.completed:
+                return
+            self.completed.add(lease_id)
+            self.active.pop(lease_id, None)
+            for record in results:
+                self.results.add_record(record)
+            for port, count in (probed or {}).items():
+                # JSON的键是字符串
+                self.results.probed[int(port)] = self.results.probed.get(int(port), 0) + count
+            done = len(self.completed)
+        with print_lock:
+            sys.stdout.write(f"\r{Fore.RED}租约进度: {Fore.YELLOW}{done}/{self.lease_count}")
+            sys.stdout.flush()
+        if done == self.lease_count:
+            self.finished.set()
+
+    def register(self, owner: str) -> None:
+        """工作节点完成握手，之后分发的租约按新的节点数分配速率份额"""
+        with self.lock:
+            self.workers.add(owner)
+
+    def release_owner(self, owner: str) -> None:
+        """工作节点断开，将其未完成的租约放回待分发队列"""
+        with self.lock:
+            self.workers.discard(owner)
+            for lease_id, (start, end, lease_owner, _) in list(self.active.items()):
+                if lease_owner == owner:
+                    del self.active[lease_id]
+                    self.pending.appendleft((lease_id, start, end))
+
+    def _make_handler(self):
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                owner = f"{self.client_address}-{id(self)}"
+                with print_lock:
+                    print(f"\n{Fore.GREEN}工作节点已连接: {self.client_address or 'unix'}")
+                try:
+                    while True:
+                        message = recv_message(self.rfile)
+                        if message is None:
+                            break
+                        if not hmac.compare_digest(str(message.get("token", "")).encode("utf-8"),
+                                                   coordinator.token.encode("utf-8")):
+                            send_message(self.wfile, {"type": "error", "message": "令牌无效"})
+                            with print_lock:
+                                print(f"\n{Fore.RED}拒绝令牌无效的工作节点: {self.client_address or 'unix'}")
+                            break
+                        kind = message.get("type")
+                        if kind == "hello":
+                            coordinator.register(owner)
+                            send_message(self.wfile, {"type": "config", **coordinator.config})
+                        elif kind == "lease":
+                            send_message(self.wfile, coordinator.next_lease(owner))
+                        elif kind == "result":
+                            coordinator.complete_lease(message["id"], message["results"],
+                                                       message.get("probed"))
+                            send_message(self.wfile, {"type": "ok"})
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    coordinator.release_owner(owner)
+
+        return Handler
+
+    def serve(self) -> ResultStore:
+        """启动服务并阻塞直到所有租约完成，返回合并后的结果"""
+        if self.family == getattr(socket, "AF_UNIX", None):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            base_class = socketserver.ThreadingUnixStreamServer
+        else:
+            base_class = socketserver.ThreadingTCPServer
+        server_class = type("CoordinatorServer", (base_class,), {
+            "address_family": self.family,
+            "daemon_threads": True,
+            "allow_reuse_address": True,
+        })
+
+        with server_class(self.address, self._make_handler()) as server:
+            server_thread = threading.Thread(target=server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            print(f"{Fore.WHITE}协调端已启动: {self.address}, 共 {self.lease_count} 个租约")
+            self.finished.wait()
+            # 给等待中的工作节点留出取得 done 消息的时间
+            time.sleep(1.0)
+            server.shutdown()
+        return self.results
+
+
+def run_worker(address: str, port_descriptions: Dict[int, str], threads: int = 5,
+               http_prober: HttpProber = None, rate_limiter: RateLimiter = None,
+               resources: SocketResourceManager = None, token: str = "") -> None:
+    """分布式扫描工作节点：向协调端领取租约，扫描后回传结果，每条消息都携带共享令牌"""
+    family, target = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(target)
+        stream = sock.makefile("rwb")
+        send_message(stream, {"type": "hello", "token": token})
+        config = recv_message(stream)
+        if config and config.get("type") == "error":
+            raise ValueError(f"协调端拒绝连接: {config.get('message')}")
+        if not config or config.get("type") != "config":
+            raise ValueError("协调端返回了无效的配置")
+        # 协调端只下发目标描述，由工作节点按相同规则重建目标列表，保证任务序号一致
+        # （域名已由协调端按排除列表过滤，不再重复解析）
+        exclude = ExclusionIndex(config["exclude"]) if config.get("exclude") else None
+        set_exclusions(exclude)
+        ips = TargetList(config["targets"], exclude, resolve_names=False)
+        print(f"{Fore.WHITE}已连接协调端: {address}, {len(ips)} 个IP, "
+              f"{len(config['ports'])} 个端口")
+        # HTTP探测和SO_LINGER 0以协调端的设置为准
+        if config.get("http_paths"):
+            http_prober = HttpProber(config["http_paths"], config["timeout"], config["http_threads"])
+        if config.get("linger0") and resources:
+            resources.linger0 = True
+
+        while True:
+            send_message(stream, {"type": "lease", "token": token})
+            lease = recv_message(stream)
+            if lease is None or lease["type"] == "done":
+                break
+            if lease["type"] == "wait":
+                time.sleep(1.0)
+                continue
+
+            # 协调端限速时，按本租约分到的份额限速，否则使用本机的设置
+            lease_limiter = rate_limiter
+            if lease.get("rate", 0) > 0 or lease.get("subnet_rate", 0) > 0:
+                lease_limiter = RateLimiter(lease["rate"], lease["subnet_rate"])
+            results = scan_ips_ports(ips, config["ports"], port_descriptions,
+                                     timeout=config["timeout"], threads=threads,
+                                     http_prober=http_prober, rate_limiter=lease_limiter,
+                                     randomize=config["randomize"], seed=config["seed"],
+                                     host_limit=config["host_limit"],
+                                     task_range=(lease["start"], lease["end"]), verbose=False,
+                                     retries=config["retries"],
+                                     retry_backoff=config["retry_backoff"],
+                                     keep_all=config["keep_all"],
+                                     happy_eyeballs=config["happy_eyeballs"],
+                                     resources=resources,
+                                     port_major=config["port_major"],
+                                     tarpit_ratio=config["tarpit_ratio"],
+                                     tarpit_sample=config["tarpit_sample"],
+                                     unreachable_limit=config["unreachable_limit"],
+                                     route_learn=config["route_learn"],
+                                     check_routes=config["check_routes"])
+            send_message(stream, {"type": "result", "id": lease["id"], "token": token,
+                                  "results": list(results.iter_records()),
+                                  "probed": results.probed})
+            if recv_message(stream) is None:
+                break
+    print(f"\n{Fore.GREEN}所有租约已完成，工作节点退出")
+
+
+class JsonlSink:
+    """结果流接收者：将每条结果追加为一行JSON（持续监控模式用于输出变化事件）"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = open(filename, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, ip: str, port: int, state: int, description: str, rtt: float = None) -> None:
+        record = {
+            "time": format_timestamp(time.time()),
+            "ip": ip,
+            "port": port,
+            "PortIntroduction": description,
+            "status": ResultStore.STATE_NAMES[state],
+            "rtt": round(rtt, 4) if rtt is not None else None,
+        }
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self) -> None:
+        with self.lock:
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+def parse_interval(text: str) -> float:
+    """解析时间间隔，支持 30s / 5m / 2h / 1d 或纯数字秒数"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = text.strip().lower()
+    try:
+        if text and text[-1] in units:
+            value = float(text[:-1]) * units[text[-1]]
+        else:
+            value = float(text)
+    except ValueError:
+        raise ValueError(f"无效的时间间隔: {text}")
+    if value <= 0:
+        raise ValueError(f"时间间隔必须大于0: {text}")
+    return value
+
+
+class WatchTier:
+    """持续监控的一个优先级：一组端口按固定周期重扫
+
+    每轮的探测均匀分布在整个周期内（第 i 个任务在周期开始后 i × 周期 / 任务数 时发出），
+    按端口顺序逐个端口扫描所有主机，避免集中探测同一主机
+    """
+
+    def __init__(self, ips: TargetList, ports: List[int], interval: float):
+        self.ips = ips
+        self.ports = ports
+        self.interval = interval
+        self.total = len(ips) * len(ports)
+        self.position = 0
+        self.cycle = 0
+        self.cycle_start = time.perf_counter()
+        self.lagging = False  # 上一轮是否未能在周期内完成
+
+    @classmethod
+    def parse(cls, spec: str, ips: TargetList, all_ports: List[int]) -> "WatchTier":
+        """解析 端口=间隔 格式的优先级，端口写作 all 时表示 -p 指定的全部端口"""
+        ports_part, _, interval_part = spec.rpartition("=")
+        if not ports_part:
+            raise ValueError(f"无效的监控优先级: {spec}，应为 端口=间隔，如 22,3389=5m")
+        ports = all_ports if ports_part.strip().lower() == "all" else parse_ports(ports_part)
+        return cls(ips, ports, parse_interval(interval_part))
+
+    def due(self) -> float:
+        return self.cycle_start + self.position * self.interval / self.total
+
+    def take(self) -> Tuple[str, int, bool]:
+        """取出下一个任务，返回 (ip, port, 本轮是否已结束)"""
+        port_index, ip_index = divmod(self.position, len(self.ips))
+        task = self.ips[ip_index], self.ports[port_index]
+        self.position += 1
+        if self.position < self.total:
+            return task + (False,)
+        # 本轮结束，下一轮从原定的周期起点开始；跟不上时从当前时间重新开始，不累积欠账
+        self.position = 0
+        self.cycle += 1
+        now = time.perf_counter()
+        self.lagging = self.cycle_start + self.interval < now
+        self.cycle_start = max(self.cycle_start + self.interval, now)
+        return task + (True,)
+
+    def describe(self) -> str:
+        ports = ",".join(map(str, self.ports[:5])) + ("..." if len(self.ports) > 5 else "")
+        return f"{len(self.ports)} 个端口 ({ports}) 每 {format_duration(self.interval)}"
+
+
+def run_watch(ips: TargetList, tiers: List[WatchTier], port_descriptions: Dict[int, str],
+              timeout: float = 3.0, threads: int = 5, rate_limiter: RateLimiter = None,
+              resources: SocketResourceManager = None, sinks: List = None) -> None:
+    """持续监控模式：常驻进程，按各优先级的周期均匀地重扫目标，端口状态变化时输出事件
+
+    第一轮的开放端口作为基线写入结果流；之后开放/关闭状态变化时立即复测确认，
+    确认后写入结果流（历史库、事件文件）。周期最长的优先级每轮结束时清空DNS缓存
+    """
+    linger0 = resources.linger0 if resources else False
+    tasks = Queue(maxsize=threads * 2)
+    known = {}  # {(ip, port): 上次是否开放}
+    known_lock = threading.Lock()
+    changes = 0
+
+    def probe(ip: str, port: int) -> Tuple[bool, str, float]:
+        if rate_limiter:
+            rate_limiter.acquire(ip)
+        for _ in range(SocketResourceManager.MAX_THROTTLE_ATTEMPTS):
+            start = time.perf_counter()
+            is_open, status = check_port(ip, port, timeout, linger0)
+            if status != STATUS_RESOURCE or not resources:
+                break
+            resources.throttle()
+        return is_open, status, time.perf_counter() - start
+
+    def emit(ip: str, port: int, is_open: bool, status: str, rtt: float, event: str) -> None:
+        port_desc = port_descriptions.get(port, "Unknown")
+        for sink in sinks or []:
+            sink.write(ip, port, ResultStore.state_of(is_open, status), port_desc, rtt)
+            sink.flush()
+        color = Fore.GREEN if is_open else Fore.RED
+        with print_lock:
+            print(f"{Fore.WHITE}[{format_timestamp(time.time())}] {color}{event:<6} "
+                  f"{Fore.WHITE}{format_target(ip, port):<46} {port_desc:<30} {status}")
+
+    def watch_worker():
+        nonlocal changes
+        while True:
+            ip, port = tasks.get()
+            try:
+                is_open, status, rtt = probe(ip, port)
+                if status == STATUS_RESOURCE:
+                    continue
+                with known_lock:
+                    previous = known.get((ip, port))
+                    known[(ip, port)] = is_open
+                if previous is None:
+                    if is_open:
+                        emit(ip, port, is_open, status, rtt, "开放")
+                    continue
+                if previous == is_open:
+                    continue
+                # 状态变化时立即复测，排除偶发丢包造成的误报
+                confirmed, status, rtt = probe(ip, port)
+                with known_lock:
+                    known[(ip, port)] = confirmed
+                    changed = confirmed != previous
+                    if changed:
+                        changes += 1
+                if changed:
+                    emit(ip, port, confirmed, status, rtt, "新开放" if confirmed else "已关闭")
+            except Exception as e:
+                with print_lock:
+                    print(f"{Fore.RED}探测 {ip}:{port} 时出错: {str(e)}")
+            finally:
+                tasks.task_done()
+
+    for _ in range(threads):
+        threading.Thread(target=watch_worker, daemon=True).start()
+
+    print(f"{Fore.YELLOW}{'-' * 80}")
+    print(f"{Fore.WHITE}持续监控: {len(ips)} 个IP, 线程数量: {threads}（Ctrl+C 退出）")
+    for tier in tiers:
+        print(f"{Fore.WHITE}  {tier.describe()}, 每秒约 {tier.total / tier.interval:.2f} 次探测")
+    print(f"{Fore.GREEN}{'-' * 80}")
+
+    longest = max(tiers, key=lambda tier: tier.interval)
+    schedule = [(tier.due(), index) for index, tier in enumerate(tiers)]
+    heapq.heapify(schedule)
+    try:
+        while True:
+            due, index = heapq.heappop(schedule)
+            precise_sleep_until(due)
+            tier = tiers[index]
+            ip, port, finished = tier.take()
+            tasks.put((ip, port))
+            if finished:
+                with print_lock:
+                    print(f"{Fore.CYAN}[{format_timestamp(time.time())}] 第 {tier.cycle} 轮完成: "
+                          f"{tier.describe()}，累计变化 {changes} 个"
+                          f"{'（探测跟不上周期，已从当前时间重新开始）' if tier.lagging else ''}")
+                if tier is longest:
+                    # 长期运行时定期刷新DNS解析结果
+                    _resolve_host_cached.cache_clear()
+            heapq.heappush(schedule, (tier.due(), index))
+    except KeyboardInterrupt:
+        print(f"\n{Fore.YELLOW}持续监控已停止，累计变化 {changes} 个")
+    finally:
+        for sink in sinks or []:
+            sink.flush()
+
+
+PROFILE_PATH = "portscanner_profile.json"
+
+
+def load_profile(filename: str = PROFILE_PATH) -> Dict:
+    """读取校准生成的性能配置，不存在或无法解析时返回空配置"""
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"{Fore.YELLOW}警告: 读取性能配置 {filename} 失败: {str(e)}，使用默认参数")
+        return {}
+
+
+def measure_connect_rate(targets: List[Tuple[str, int]], threads: int, timeout: float,
+                         linger0: bool, duration: float) -> float:
+    """在指定线程数下持续探测目标列表，返回每秒得到明确结果（开放或关闭）的探测数"""
+    stop_at = time.perf_counter() + duration
+    counts = [0] * threads
+
+    def bench_worker(slot: int):
+        index = slot
+        while time.perf_counter() < stop_at:
+            ip, port = targets[index % len(targets)]
+            is_open, status = check_port(ip, port, timeout, linger0)
+            # 超时、出错和本机资源耗尽的探测不计入吞吐量
+            if is_open or status == "关闭":
+                counts[slot] += 1
+            index += threads
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=bench_worker, args=(slot,), daemon=True) for slot in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return sum(counts) / elapsed if elapsed > 0 else 0.0
+
+
+def start_loopback_listener() -> Tuple[socket.socket, int, int]:
+    """启动回环测试监听端口（接受后立即关闭），并找一个未监听的端口用于测量关闭端口，
+    返回 (监听socket, 开放端口, 关闭端口)"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(4096)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            conn.close()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        closed_port = probe.getsockname()[1]
+    return listener, listener.getsockname()[1], closed_port
+
+
+def run_calibration(resources: SocketResourceManager, sample: List[Tuple[str, int]] = None,
+                    timeout: float = 1.0, duration: float = 1.0,
+                    profile_path: str = PROFILE_PATH) -> Dict:
+    """校准本机的最佳扫描参数并写入性能配置
+
+    先在回环地址上测量各探测方式（普通关闭 / SO_LINGER 0）在不同线程数下的最大连接速率，
+    提供真实目标样本时再用样本测量一次，取速率接近最大值时最少的线程数
+    """
+    listener, open_port, closed_port = start_loopback_listener()
+    # 真实扫描中绝大多数端口是关闭的，按 1:9 混合开放和关闭端口
+    loopback = [("127.0.0.1", open_port)] + [("127.0.0.1", closed_port)] * 9
+    max_threads = min(1000, resources.max_concurrency())
+    thread_counts = [count for count in (5, 10, 20, 50, 100, 200, 400, 800) if count <= max_threads]
+
+    print(f"{Fore.YELLOW}{'-' * 80}")
+    print(f"{Fore.WHITE}开始校准: 每组测量 {duration:g} 秒, 线程数 {thread_counts}")
+    print(f"{Fore.GREEN}{'-' * 80}")
+
+    measurements = []  # [(数据来源, 探测方式, 线程数, 速率)]
+    try:
+        for linger0 in (False, True):
+            engine = "linger0" if linger0 else "connect"
+            for threads in thread_counts:
+                rate = measure_connect_rate(loopback, threads, timeout, linger0, duration)
+                measurements.append(("loopback", engine, threads, rate))
+                print(f"{Fore.WHITE}回环  {engine:<8} 线程 {threads:>4}: {Fore.GREEN}{rate:>10.0f} 次/秒")
+    finally:
+        listener.close()
+
+    if sample:
+        for threads in thread_counts:
+            rate = measure_connect_rate(sample, threads, timeout, resources.linger0, duration)
+            measurements.append(("targets", "linger0" if resources.linger0 else "connect", threads, rate))
+            print(f"{Fore.WHITE}目标样本 线程 {threads:>4}: {Fore.GREEN}{rate:>10.0f} 次/秒")
+
+    # 有真实目标样本时以样本为准，否则以回环结果为准
+    source = "targets" if sample else "loopback"
+    candidates = [m for m in measurements if m[0] == source]
+    best_rate = max(m[3] for m in candidates)
+    # 速率达到最大值95%以上的配置中取线程数最少的，减少资源占用
+    best = min((m for m in candidates if m[3] >= best_rate * 0.95), key=lambda m: m[2])
+    if source == "loopback":
+        linger0 = best[1] == "linger0"
+    else:
+        linger0 = resources.linger0
+
+    profile = {
+        "threads": best[2],
+        "linger0": linger0,
+        "max_rate": round(best_rate, 1),
+        "source": source,
+        "host": socket.gethostname(),
+        "created": format_timestamp(time.time()),
+        "measurements": [
+            {"source": m[0], "engine": m[1], "threads": m[2], "rate": round(m[3], 1)}
+            for m in measurements
+        ],
+    }
+    with open(profile_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+    print(f"{Fore.GREEN}{'-' * 80}")
+    print(f"{Fore.YELLOW}校准完成: 推荐线程数 {best[2]}, "
+          f"{'使用' if linger0 else '不使用'} SO_LINGER 0, 最大速率约 {best_rate:.0f} 次/秒")
+    print(f"{Fore.GREEN}性能配置已写入: {profile_path}（之后的扫描未指定 -threads 时自动加载）")
+    return profile
+
+
+# 预估时使用的默认值：没有历史数据时假设的往返时间，每个线程的内存占用
+DEFAULT_RTT = 0.05
+THREAD_MEMORY = 256 * 1024
+# 预估输出大小和导出内存时实际生成的样本行数
+ESTIMATE_SAMPLE_ROWS = 1000
+
+
+def format_size(size: float) -> str:
+    """将字节数格式化为便于阅读的大小"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds: float) -> str:
+    """将秒数格式化为 时:分:秒"""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def syn_retransmits(timeout: float) -> int:
+    """超时前内核重传SYN的次数（Linux首次重传1秒，之后指数退避）"""
+    return sum(1 for elapsed in (1, 3, 7, 15, 31, 63) if elapsed < timeout)
+
+
+def max_subnet_tasks(ips: TargetList, port_count: int) -> int:
+    """任意一个限速网段（IPv4为/24，IPv6为/64）内的最大任务数，只按区间计算，不展开地址"""
+    per_subnet = {}
+    largest = 1 if ips.names else 0
+    for version, start, end in ips.segments:
+        shift = 8 if version == 4 else 64
+        first, last = start >> shift, end >> shift
+        if last - first >= 2:
+            # 中间的网段都是完整的
+            largest = max(largest, 1 << shift)
+        for subnet in {first, last}:
+            low = max(start, subnet << shift)
+            high = min(end, ((subnet + 1) << shift) - 1)
+            per_subnet[(version, subnet)] = per_subnet.get((version, subnet), 0) + high - low + 1
+    return max([largest] + list(per_subnet.values())) * port_count
+
+
+def measure_output_sizes(ips: TargetList, ports: List[int], port_descriptions: Dict[int, str],
+                         keep_all: bool, excel_exporter=None) -> Dict[str, float]:
+    """生成样本结果并实际导出，测量每行在各输出格式中的字节数和Excel导出时的内存"""
+    rng = random.Random(0)
+    total = len(ips) * len(ports)
+    store = ResultStore(keep_all)
+    for _ in range(ESTIMATE_SAMPLE_ROWS):
+        index = rng.randrange(total)
+        ip, port = ips[index // len(ports)], ports[index % len(ports)]
+        store.add(ip, port, ResultStore.STATE_OPEN, port_descriptions.get(port, "Unknown"))
+
+    sizes = {}
+    sizes["store"] = (len(store.kinds) + store.addrs.itemsize * len(store.addrs)
+                      + store.ports.itemsize * len(store.ports) + len(store.states)
+                      + store.desc_ids.itemsize * len(store.desc_ids)
+                      + store.detail_ids.itemsize * len(store.detail_ids) + len(store.ipv6)) / len(store)
+    sizes["jsonl"] = sum(len(json.dumps(record, ensure_ascii=False).encode("utf-8")) + 1
+                         for record in store.iter_records()) / len(store)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "sample.xlsx")
+        tracemalloc.start()
+        try:
+            (excel_exporter or export_to_excel_stream)(store, filename, verbose=False)
+            sizes["xlsx_memory"] = tracemalloc.get_traced_memory()[1] / len(store)
+        finally:
+            tracemalloc.stop()
+        sizes["xlsx"] = os.path.getsize(filename) / len(store)
+
+        history = ScanHistory(os.path.join(directory, "sample.db"))
+        history.begin_scan(len(ips), len(ports))
+        baseline = os.path.getsize(history.path)
+        for row in store.iter_rows():
+            history.write(store.ip_of(row), store.ports[row], ResultStore.STATE_OPEN,
+                          store.descriptions[store.desc_ids[row]], DEFAULT_RTT)
+        history.finish_scan()
+        history.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        history.conn.close()
+        sizes["sqlite"] = max(0, os.path.getsize(history.path) - baseline) / len(store)
+    return sizes
+
+
+def estimate_scan(ips: TargetList, ports: List[int], port_descriptions: Dict[int, str],
+                  timeout: float, threads: int, rate: float = 0, subnet_rate: float = 0,
+                  retries: int = 0, keep_all: bool = False, host_limit: int = 0,
+                  history_path: str = None, excel_exporter=None) -> Dict:
+    """不执行扫描，估算任务数、耗时、数据包数、峰值内存和各格式的输出大小
+
+    任务数按目标区间直接计算；往返时间、开放概率和超时比例优先使用历史库中的统计
+    """
+    tasks = len(ips) * len(ports)
+    ranking = PortRanking.from_history(history_path)
+    open_ratio = sum(ranking.probability(port) for port in ports) / len(ports)
+
+    # 历史库中的往返时间和超时比例（需要 --keep-all 的历史扫描才有超时记录）
+    avg_rtt, states = None, {}
+    if history_path and os.path.exists(history_path):
+        history = ScanHistory(history_path)
+        try:
+            avg_rtt, states = history.probe_stats()
+        finally:
+            history.conn.close()
+    rtt = min(avg_rtt or DEFAULT_RTT, timeout)
+    answered_states = sum(states.get(state, 0) for state in
+                          (ResultStore.STATE_CLOSED, ResultStore.STATE_TIMEOUT))
+    timeout_ratio = (states.get(ResultStore.STATE_TIMEOUT, 0) / answered_states
+                     if answered_states else None)
+
+    # 耗时：受线程并发、全局速率和单网段速率三者中最慢的约束
+    def duration(share: float) -> float:
+        probes = tasks * (1 + share * retries)
+        cost = (1 - share) * rtt + share * timeout
+        bounds = [probes * cost / threads]
+        if rate > 0:
+            bounds.append(probes / rate)
+        if subnet_rate > 0:
+            bounds.append(max_subnet_tasks(ips, len(ports)) * (1 + share * retries) / subnet_rate)
+        return max(bounds)
+
+    # 发出的数据包：开放端口完成握手并关闭约3个，关闭端口1个SYN，超时端口含SYN重传
+    def packets(share: float) -> float:
+        opened = tasks * open_ratio
+        timed_out = (tasks - opened) * share * (1 + retries)
+        closed = tasks - opened - (tasks - opened) * share
+        return opened * 3 + closed + timed_out * (1 + syn_retransmits(timeout))
+
+    rows = tasks if keep_all else tasks * open_ratio
+    sizes = measure_output_sizes(ips, ports, port_descriptions, keep_all, excel_exporter)
+    baseline = 0
+    if resource:
+        # Linux下ru_maxrss单位为KB
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    deferred = min(tasks, HostScheduler.MAX_DEFERRED) * 80 if host_limit > 0 else 0
+    scan_memory = baseline + threads * THREAD_MEMORY + rows * sizes["store"] + deferred
+    export_memory = baseline + rows * (sizes["store"] + sizes["xlsx_memory"])
+
+    return {
+        "targets": len(ips),
+        "ports": len(ports),
+        "tasks": tasks,
+        "threads": threads,
+        "rtt": rtt,
+        "rtt_source": "历史库" if avg_rtt else "默认值",
+        "open_ratio": open_ratio,
+        "timeout_ratio": timeout_ratio,
+        "duration_min": duration(0.0),
+        "duration_max": duration(1.0),
+        "duration_expected": duration(timeout_ratio) if timeout_ratio is not None else None,
+        "packets_min": packets(0.0),
+        "packets_max": packets(1.0),
+        "rows": rows,
+        "peak_memory": max(scan_memory, export_memory),
+        "outputs": {
+            "xlsx": rows * sizes["xlsx"],
+            "jsonl": rows * sizes["jsonl"],
+            "sqlite (--db)": rows * sizes["sqlite"],
+        },
+    }
+
+
+def print_scan_plan(plan: Dict) -> None:
+    """输出 --dry-run 的预估结果"""
+    print(f"{Fore.YELLOW}{'-' * 80}")
+    print(f"{Fore.WHITE}扫描计划（未执行扫描）")
+    print(f"{Fore.GREEN}{'-' * 80}")
+    print(f"{Fore.WHITE}目标: {plan['targets']} 个, 端口: {plan['ports']} 个, "
+          f"任务: {plan['tasks']} 个, 线程: {plan['threads']}")
+    print(f"{Fore.WHITE}往返时间: {plan['rtt'] * 1000:.1f} 毫秒（{plan['rtt_source']}）, "
+          f"预计开放比例: {plan['open_ratio'] * 100:.2f}%")
+    print(f"{Fore.WHITE}预计耗时: {format_duration(plan['duration_min'])}（全部响应）"
+          f" ~ {format_duration(plan['duration_max'])}（全部超时）")
+    if plan["duration_expected"] is not None:
+        print(f"{Fore.WHITE}按历史超时比例 {plan['timeout_ratio'] * 100:.1f}% 估算: "
+              f"{Fore.GREEN}{format_duration(plan['duration_expected'])}")
+    print(f"{Fore.WHITE}发送数据包: 约 {plan['packets_min']:.0f} ~ {plan['packets_max']:.0f} 个")
+    print(f"{Fore.WHITE}结果行数: 约 {plan['rows']:.0f} 行, 峰值内存: 约 {format_size(plan['peak_memory'])}")
+    for name, size in plan["outputs"].items():
+        print(f"{Fore.WHITE}  {name:<14} 约 {format_size(size)}")
+    print(f"{Fore.GREEN}{'-' * 80}")
+
+
+def query_history(args) -> None:
+    """执行历史库查询并输出结果"""
+    path = args.db or ScanHistory.DEFAULT_PATH
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"历史库不存在: {path}")
+    history = ScanHistory(path)
+    # 指定 --udp 时查询UDP扫描的历史，否则只查询TCP
+    protocol = "udp" if args.udp else "tcp"
+    try:
+        if args.history_first_open:
+            ip, _, port = args.history_first_open.rpartition(":")
+            if not ip or not port.isdigit():
+                raise ValueError(f"无效的格式: {args.history_first_open}，应为 IP:端口")
+            row = history.first_open(ip.strip("[]"), int(port), protocol)
+            if row:
+                print(f"{Fore.GREEN}{ip}:{port} 第一次开放于 {format_timestamp(row[1])} (扫描编号 {row[0]})")
+            else:
+                print(f"{Fore.YELLOW}历史库中没有 {ip}:{port} 开放的记录")
+
+        if args.history_open:
+            since = time.time() - args.since * 86400
+            rows = history.hosts_with_open(args.history_open, since, protocol)
+            print(f"{Fore.WHITE}最近 {args.since:g} 天内端口 {args.history_open} 开放过的主机: {len(rows)} 个")
+            for ip, last_seen in rows:
+                print(f"{Fore.GREEN}  {ip:<40} {Fore.WHITE}最近开放: {format_timestamp(last_seen)}")
+    finally:
+        history.conn.close()
+
+
+def load_exclusions(args) -> Optional[ExclusionIndex]:
+    """读取 --exclude-file 指定的排除列表"""
+    if not args.exclude_file:
+        return None
+    exclude = ExclusionIndex(read_ips_from_file(args.exclude_file))
+    set_exclusions(exclude)
+    print(f"{Fore.WHITE}已加载排除列表 {args.exclude_file}: {len(exclude)} 个区间/域名")
+    return exclude
+
+
+def load_scan_targets(args) -> Tuple[TargetList, List[int]]:
+    """根据命令行参数读取扫描目标和端口"""
+    # 处理IP（支持IPv4/IPv6、CIDR网段、地址范围和域名），并扣除排除列表
+    target_specs = []
+    if args.ip:
+        target_specs.append(args.ip)
+    elif args.ip_list:
+        target_specs = read_ips_from_file(args.ip_list)
+    ips = TargetList(target_specs, load_exclusions(args))
+    if ips.excluded:
+        print(f"{Fore.YELLOW}排除列表命中: 已从目标中去掉 {ips.excluded} 个地址/域名")
+
+    # 处理端口
+    ports = []
+    if args.p:
+        ports = parse_ports(args.p)
+    elif args.p_list:
+        ports = read_ports_from_file(args.p_list)
+    return ips, ports
+
+
+def rescan_from_results(args, targets: ResultTargets, port_descriptions: Dict[int, str],
+                        threads: int, http_prober: HttpProber = None,
+                        rate_limiter: RateLimiter = None, resources: SocketResourceManager = None,
+                        excel_exporter=None) -> None:
+    """复查模式：只重新探测上次结果中开放的端口，输出自上次以来已关闭的端口
+
+    所有目标上次都是开放的，因此不做tarpit检测（否则端口多的主机会被误判）
+    """
+    history = None
+    sinks = []
+    if args.db:
+        history = ScanHistory(args.db)
+        history.begin_scan(len(targets), len(targets.ports), " ".join(sys.argv[1:]))
+        sinks.append(history)
+    try:
+        scan_results = scan_ips_ports([], targets.ports, port_descriptions, args.timeout, threads,
+                                      http_prober=http_prober, rate_limiter=rate_limiter,
+                                      host_limit=args.host_limit, retries=args.retries,
+                                      retry_backoff=args.retry_backoff, keep_all=args.keep_all,
+                                      sinks=sinks, happy_eyeballs=args.happy_eyeballs,
+                                      resources=resources,
+                                      unreachable_limit=args.unreachable_limit,
+                                      route_learn=args.route_learn,
+                                      check_routes=args.check_routes,
+                                      dashboard=args.dashboard,
+                                      top_hosts=args.top_hosts, summary_format=args.summary,
+                                      targets=targets)
+    finally:
+        if history:
+            history.close()
+    if history:
+        print(f"{Fore.GREEN}扫描结果已写入历史库: {args.db} (扫描编号 {history.scan_id})")
+
+    (excel_exporter or export_to_excel_stream)(scan_results)
+    if args.jsonl is not None:
+        export_to_jsonl(scan_results, args.jsonl or None)
+
+    # 上次的记录都在本次复查范围内，归并后即为自上次以来的变化
+    counts = report_diff(merge_diff(sorted_records(targets.records),
+                                    scan_results.iter_records(sort=True)),
+                         title=f"与 {targets.spec} 相比的变化")
+    opened = scan_results.count(ResultStore.STATE_OPEN)
+    print(f"\n{Fore.WHITE}复查 {len(targets)} 个端口: {Fore.GREEN}开放 {opened} 个, "
+          f"{Fore.RED}已关闭 {counts['newly-closed']} 个")
 
 
 def main():
@@ -473,12 +4585,19 @@ def main():
                                      formatter_class=argparse.RawTextHelpFormatter)
 
     # IP参数组（互斥）
-    ip_group = parser.add_mutually_exclusive_group(required=True)
-    ip_group.add_argument('-ip', help='指定单个IP地址')
-    ip_group.add_argument('-ip-list', help='从文件中读取IP地址列表（支持#注释）')
+    ip_group = parser.add_mutually_exclusive_group()
+    ip_group.add_argument('-ip', help='指定目标，可以是：\n'
+                                      '  - IPv4/IPv6地址: -ip 192.168.1.1 / -ip 2001:db8::1\n'
+                                      '  - CIDR网段: -ip 192.168.1.0/24\n'
+                                      '  - 地址范围: -ip 192.168.1.1-100\n'
+                                      '  - 域名: -ip example.com')
+    ip_group.add_argument('-ip-list', help='从文件中读取目标列表，每行格式同 -ip（支持#注释）')
+    parser.add_argument('--exclude-file', metavar='FILE',
+                        help='排除列表文件，每行为地址、CIDR网段、地址范围或域名（支持#注释），\n'
+                             '其中的目标无论如何都不会被探测')
 
     # 端口参数组（互斥）
-    port_group = parser.add_mutually_exclusive_group(required=True)
+    port_group = parser.add_mutually_exclusive_group()
     port_group.add_argument('-p', help='指定端口，可以是：\n'
                                        '  - 单个端口: -p 80\n'
                                        '  - 端口范围: -p 1-80\n'
@@ -488,43 +4607,378 @@ def main():
     # 其他参数
     parser.add_argument('-t', '--timeout', type=float, default=3.0,
                         help='超时时间(秒)，默认3秒')
-    parser.add_argument('-threads', type=int, default=5,
-                        help='并行线程数量，默认5个')
+    parser.add_argument('-threads', type=int, default=None,
+                        help='并行线程数量（1-1000，会按fd上限和本地端口范围自动约束），\n'
+                             '默认5个；存在校准生成的性能配置时使用校准结果')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='全局探测速率上限（次/秒），所有线程共享令牌桶，默认不限速')
+    parser.add_argument('--subnet-rate', type=float, default=0,
+                        help='每个/24网段的探测速率上限（次/秒），默认不限速')
+    parser.add_argument('--randomize', action='store_true',
+                        help='以伪随机顺序遍历 (IP, 端口) 任务空间，避免连续集中探测同一主机')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='随机扫描顺序的种子，相同种子可复现扫描顺序，默认随机生成')
+    parser.add_argument('--port-order', choices=['numeric', 'likelihood'], default='numeric',
+                        help='端口扫描顺序：numeric 按端口号（默认）；likelihood 按开放概率从高到低，\n'
+                             '逐个端口扫完所有主机，概率由内置频率表和历史库（--db）学习得到')
+    parser.add_argument('--top-ports', type=int, metavar='N',
+                        help='按开放概率生成前N个端口的列表文件 port-N.txt（可配合 --db 学习历史结果）')
+    parser.add_argument('--time-budget', type=float, default=0, metavar='MINUTES',
+                        help='限时扫描（分钟）：按开放概率和主机存活情况优先扫描价值最高的目标，\n'
+                             '到期停止，未扫描的目标写入 unscanned.jsonl')
+    parser.add_argument('--host-limit', type=int, default=0,
+                        help='单台主机同时进行的最大探测数，默认不限制')
+    parser.add_argument('--tarpit-ratio', type=float, default=0,
+                        help='SYN代理/tarpit检测：主机前若干次探测的开放比例达到该值，\n'
+                             '或追加探测的随机高端口也开放时，判定异常并取消其余探测；默认0（关闭），建议0.8')
+    parser.add_argument('--tarpit-sample', type=int, default=20,
+                        help='SYN代理/tarpit检测的样本探测数，默认20')
+    parser.add_argument('--unreachable-limit', type=int, default=0,
+                        help='主机累计出现多少次主机/网络不可达错误后熔断并取消其余探测，默认0（关闭），建议3')
+    parser.add_argument('--route-learn', type=int, default=0,
+                        help='同一/24（IPv6为/64）网段内多少台主机返回网络不可达后跳过整个网段，\n'
+                             '配合--check-routes且路由表确认时，同一/16内多个/24不可达才跳过整个/16；\n'
+                             '默认0（关闭），建议2')
+    parser.add_argument('--check-routes', action='store_true',
+                        help='扫描前检查内核路由表（Linux），跳过只有拒绝路由或没有路由的网段')
+    parser.add_argument('--happy-eyeballs', action='store_true',
+                        help='域名目标同时尝试IPv6和IPv4连接，以最先连通的为准并记录所用地址')
+    parser.add_argument('--linger0', action='store_true', default=None,
+                        help='探测连接以SO_LINGER 0关闭（发送RST），避免TIME_WAIT耗尽本地端口；\n'
+                             '未指定时使用性能配置中的设置')
+    parser.add_argument('--no-linger0', dest='linger0', action='store_false',
+                        help='不使用SO_LINGER 0关闭探测连接，覆盖性能配置中的设置')
+    parser.add_argument('--retries', type=int, default=None,
+                        help='超时目标的重试次数，重试以较低优先级穿插在主扫描中，默认不重试（UDP扫描默认重传1次）')
+    parser.add_argument('--retry-backoff', type=float, default=1.0,
+                        help='第一次重试前的等待时间(秒)，之后按指数退避，默认1秒')
+    parser.add_argument('--keep-all', action='store_true',
+                        help='保留并导出全部探测结果（含关闭、超时），默认只保留开放端口')
+    parser.add_argument('--db', nargs='?', const=ScanHistory.DEFAULT_PATH, default=None,
+                        help=f'将扫描结果写入本地SQLite历史库，默认 {ScanHistory.DEFAULT_PATH}')
+    parser.add_argument('--history-first-open', metavar='IP:PORT',
+                        help='查询历史库中某个 IP:端口 第一次开放的时间')
+    parser.add_argument('--history-open', type=int, metavar='PORT',
+                        help='查询历史库中该端口开放过的主机（配合 --since）')
+    parser.add_argument('--since', type=float, default=7,
+                        help='--history-open 查询的时间范围(天)，默认7天')
+    parser.add_argument('--jsonl', nargs='?', const='', default=None,
+                        help='同时将结果按 (IP, 端口) 排序导出为JSONL文件，默认文件名 result.jsonl')
+    parser.add_argument('--udp', action='store_true',
+                        help='UDP扫描：按端口发送协议载荷（DNS、NTP、SNMP等），结果分为开放/开放|过滤/关闭；\n'
+                             '未指定 -retries 时重传1次')
+    parser.add_argument('--from-results', metavar='RESULT',
+                        help='复查模式：只重新探测上次结果（.jsonl / .xlsx / 历史库.db[#扫描编号]，\n'
+                             '或限时扫描的 unscanned.jsonl）中开放的端口，输出已关闭的端口；\n'
+                             '不需要 -ip/-p，未指定 -threads 时使用资源允许的最大并发')
+    parser.add_argument('--excel-engine', choices=['stream', 'openpyxl'], default='stream',
+                        help='Excel导出方式：stream 直接流式写入XML（默认，速度快、内存小）；\n'
+                             'openpyxl 逐单元格构建工作簿')
+    parser.add_argument('--diff-against', metavar='RESULT',
+                        help='与上一次的结果比对（.jsonl / .xlsx / 历史库.db[#扫描编号]），\n'
+                             '输出新开放、新关闭和服务变化的端口')
+    parser.add_argument('--watch', action='store_true',
+                        help='持续监控模式：常驻进程按周期均匀重扫，端口开放/关闭变化时输出事件\n'
+                             '（写入 --db 历史库和 --watch-events 事件文件）')
+    parser.add_argument('--watch-tier', action='append', metavar='PORTS=INTERVAL',
+                        help='监控优先级，可重复指定，如 --watch-tier 22,3389=5m --watch-tier all=24h；\n'
+                             'all 表示 -p 指定的全部端口，间隔单位 s/m/h/d，默认 all=24h')
+    parser.add_argument('--watch-events', metavar='FILE',
+                        help='持续监控的变化事件追加写入该JSONL文件')
+    parser.add_argument('--coordinator', metavar='ADDR',
+                        help='分布式协调端模式，在 host:port 或 unix:/path 上分发扫描租约并合并结果，\n'
+                             '省略host时只监听127.0.0.1')
+    parser.add_argument('--worker', metavar='ADDR',
+                        help='分布式工作节点模式，连接协调端领取租约（无需指定IP和端口参数）')
+    parser.add_argument('--token',
+                        help='分布式模式的共享令牌，协调端和工作节点必须一致；协调端未指定时随机生成并输出')
+    parser.add_argument('--lease-size', type=int, default=1000,
+                        help='每个租约包含的任务数，默认1000')
+    parser.add_argument('--lease-timeout', type=float, default=600,
+                        help='租约超时时间(秒)，超时未完成的租约会重新分发，默认600秒')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='不执行扫描，只预估任务数、耗时、数据包数、峰值内存和各格式的输出大小\n'
+                             '（参考超时、线程数、速率上限和历史库中的往返时间）')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='在回环地址（及指定的目标样本）上测量最佳线程数和探测方式，写入性能配置')
+    parser.add_argument('--calibrate-sample', type=int, default=200,
+                        help='校准时从 -ip/-p 目标中随机抽取的样本数，默认200')
+    parser.add_argument('--profile', default=PROFILE_PATH,
+                        help=f'性能配置文件路径，默认 {PROFILE_PATH}')
+    parser.add_argument('--summary', choices=['full', 'compact', 'none'], default='full',
+                        help='扫描结束后主机列表的输出格式：full 彩色列表（默认）；\n'
+                             'compact 无颜色、每台主机一行 IP<TAB>开放端口数<TAB>端口列表；none 不输出')
+    parser.add_argument('--top-hosts', type=int, default=0, metavar='N',
+                        help='汇总中只列出开放端口最多的前N台主机，默认全部列出')
+    parser.add_argument('--dashboard', action='store_true',
+                        help='以实时面板显示速率、正在探测数、预计剩余时间、结果分布、最慢主机和最近的开放端口\n'
+                             '（需要curses，Windows下安装 windows-curses；不可用时定期输出统计行）')
+    parser.add_argument('--http', action='store_true',
+                        help='对开放端口进行HTTP探测，获取状态码、Server头和标题')
+    parser.add_argument('--http-paths', default='/',
+                        help='HTTP探测的路径列表（逗号分隔），复用同一连接依次请求，默认 /')
+    parser.add_argument('--http-threads', type=int, default=10,
+                        help='HTTP探测线程数量，默认10个')
 
     args = parser.parse_args()
 
     try:
+        # 未指定的参数使用校准生成的性能配置
+        profile = {} if args.calibrate else load_profile(args.profile)
+        threads_given = args.threads is not None
+        linger0_from_profile = args.linger0 is None and bool(profile.get("linger0"))
+        if args.threads is None:
+            args.threads = profile.get("threads", 5)
+            if profile:
+                print(f"{Fore.GREEN}已加载性能配置 {args.profile}: 线程数 {args.threads}"
+                      f"{', SO_LINGER 0' if linger0_from_profile else ''}")
+        if args.linger0 is None:
+            args.linger0 = linger0_from_profile
+
         # 验证线程数量
-        if args.threads < 1 or args.threads > 100:
-            raise ValueError("线程数量必须在1到100之间")
+        if args.threads < 1 or args.threads > 1000:
+            raise ValueError("线程数量必须在1到1000之间")
+        if args.host_limit < 0:
+            raise ValueError("单主机并发上限不能为负数")
+        if args.rate < 0 or args.subnet_rate < 0:
+            raise ValueError("速率上限不能为负数")
+        if args.retries is None:
+            args.retries = UdpScanner.DEFAULT_RETRIES if args.udp else 0
+        if args.retries < 0 or args.retry_backoff < 0:
+            raise ValueError("重试次数和退避时间不能为负数")
+        if args.lease_size < 1:
+            raise ValueError("租约大小必须大于0")
+        if not 0 <= args.tarpit_ratio <= 1 or args.tarpit_sample < 1:
+            raise ValueError("tarpit检测比例必须在0到1之间，样本数必须大于0")
+        if args.unreachable_limit < 0 or args.route_learn < 0:
+            raise ValueError("不可达熔断次数和网段学习次数不能为负数")
+        if args.time_budget < 0:
+            raise ValueError("时间预算不能为负数")
+        if args.watch and (args.coordinator or args.worker or args.time_budget):
+            raise ValueError("--watch 不能与分布式模式或 --time-budget 同时使用")
+        if args.time_budget and (args.coordinator or args.worker):
+            raise ValueError("--time-budget 不支持分布式模式")
+        if args.from_results and (args.watch or args.coordinator or args.worker or args.time_budget):
+            raise ValueError("--from-results 不能与 --watch、分布式模式或 --time-budget 同时使用")
+        if args.udp and (args.watch or args.coordinator or args.worker or args.time_budget
+                         or args.from_results or args.http or args.dashboard):
+            raise ValueError("--udp 不能与 --watch、--from-results、--time-budget、--http、--dashboard "
+                             "或分布式模式同时使用")
 
-        # 处理IP
-        ips = []
-        if args.ip:
-            ips.append(args.ip)
-        elif args.ip_list:
-            ips = read_ips_from_file(args.ip_list)
+        # HTTP探测阶段
+        http_prober = None
+        if args.http:
+            paths = [path.strip() for path in args.http_paths.split(',') if path.strip()]
+            http_prober = HttpProber(paths, args.timeout, args.http_threads)
 
-        if not ips:
-            print(f"{Fore.RED}错误: 没有有效的IP地址")
+        # 速率控制
+        rate_limiter = None
+        if args.rate > 0 or args.subnet_rate > 0:
+            rate_limiter = RateLimiter(args.rate, args.subnet_rate)
+
+        # 历史库查询模式
+        if args.history_first_open or args.history_open:
+            query_history(args)
             return
 
-        # 处理端口
-        ports = []
-        if args.p:
-            ports = parse_ports(args.p)
-        elif args.p_list:
-            ports = read_ports_from_file(args.p_list)
+        # 套接字资源管理：提升fd上限并按资源约束线程数
+        resources = SocketResourceManager(args.linger0)
+        threads = resources.plan(args.threads, 2 if args.happy_eyeballs else 1,
+                                 args.http_threads if args.http else 0, args.rate)
+        for note in resources.notes:
+            print(f"{Fore.YELLOW}{note}")
+
+        # 校准模式：指定了目标时额外抽样测量真实目标
+        if args.calibrate:
+            sample = []
+            if (args.ip or args.ip_list) and (args.p or args.p_list):
+                ips, ports = load_scan_targets(args)
+                total = len(ips) * len(ports)
+                rng = random.Random()
+                for _ in range(min(args.calibrate_sample, total)):
+                    index = rng.randrange(total)
+                    sample.append((ips[index // len(ports)], ports[index % len(ports)]))
+            run_calibration(resources, sample, min(args.timeout, 1.0), profile_path=args.profile)
+            return
+
+        # 生成按开放概率排列的端口列表文件
+        if args.top_ports:
+            if not 1 <= args.top_ports <= 65535:
+                raise ValueError("端口数量必须在1到65535之间")
+            filename = write_top_ports(PortRanking.from_history(args.db), args.top_ports)
+            print(f"{Fore.GREEN}已生成前 {args.top_ports} 个常见端口列表: {filename}")
+            return
 
+        # 工作节点模式：目标和端口由协调端下发
+        if args.worker:
+            if not args.token:
+                raise ValueError("工作节点模式必须通过 --token 指定协调端的共享令牌")
+            run_worker(args.worker, port_descriptions, threads, http_prober, rate_limiter, resources,
+                       args.token)
+            return
+
+        excel_exporter = export_to_excel_stream if args.excel_engine == 'stream' else export_to_excel
+
+        # 复查模式：目标直接来自上次的结果，不再展开 IP × 端口
+        if args.from_results:
+            targets = ResultTargets(args.from_results, load_exclusions(args))
+            if not len(targets):
+                print(f"{Fore.YELLOW}{args.from_results} 中没有开放的端口，无需复查")
+                return
+            if not threads_given:
+                noted = len(resources.notes)
+                threads = resources.plan(min(len(targets), 1000), 2 if args.happy_eyeballs else 1,
+                                         args.http_threads if args.http else 0, args.rate)
+                for note in resources.notes[noted:]:
+                    print(f"{Fore.YELLOW}{note}")
+            rescan_from_results(args, targets, port_descriptions, threads, http_prober,
+                                rate_limiter, resources, excel_exporter)
+            return
+
+        if not (args.ip or args.ip_list):
+            parser.error("必须指定 -ip 或 -ip-list")
+        if not (args.p or args.p_list):
+            parser.error("必须指定 -p 或 -p-list")
+
+        # 处理IP和端口
+        ips, ports = load_scan_targets(args)
+        if not ips:
+            print(f"{Fore.RED}错误: 没有有效的IP地址")
+            return
         if not ports:
             print(f"{Fore.RED}错误: 没有有效的端口")
             return
 
-        # 执行扫描，获取结果
-        scan_results = scan_ips_ports(ips, ports, port_descriptions, args.timeout, args.threads)
+        # 按开放概率排列端口，使高概率端口的结果尽早出现（限时扫描总是如此）
+        port_major = args.port_order == 'likelihood' or args.time_budget > 0
+        if port_major:
+            ranking = PortRanking.from_history(args.db or ScanHistory.DEFAULT_PATH)
+            ports = ranking.order(ports)
+            print(f"{Fore.WHITE}按开放概率排列端口（历史统计 {len(ranking.stats)} 个端口）, "
+                  f"前10个: {', '.join(map(str, ports[:10]))}")
+
+        # 只预估，不扫描
+        if args.dry_run:
+            print_scan_plan(estimate_scan(
+                ips, ports, port_descriptions, args.timeout, threads, args.rate, args.subnet_rate,
+                args.retries, args.keep_all, args.host_limit, args.db or ScanHistory.DEFAULT_PATH,
+                excel_exporter))
+            return
+
+        # 随机扫描顺序的种子（未指定时随机生成并输出，便于复现）
+        seed = args.seed
+        if args.randomize and seed is None:
+            seed = random.getrandbits(32)
+
+        # 扫描历史库
+        history = None
+        sinks = []
+        if args.db:
+            history = ScanHistory(args.db)
+            history.begin_scan(len(ips), len(ports), " ".join(sys.argv[1:]),
+                               "udp" if args.udp else "tcp")
+            sinks.append(history)
+
+        # 持续监控模式：常驻进程，按各优先级周期重扫，输出变化事件
+        if args.watch:
+            tiers = [WatchTier.parse(spec, ips, ports) for spec in args.watch_tier or ["all=24h"]]
+            events = JsonlSink(args.watch_events) if args.watch_events else None
+            if events:
+                sinks.append(events)
+            try:
+                run_watch(ips, tiers, port_descriptions, args.timeout, threads,
+                          rate_limiter, resources, sinks)
+            finally:
+                if events:
+                    events.close()
+                if history:
+                    history.close()
+            return
+
+        # 协调端模式：只分发租约，由工作节点完成扫描
+        if args.coordinator:
+            token = args.token
+            if not token:
+                token = secrets.token_hex(16)
+                print(f"{Fore.YELLOW}未指定 --token，已生成共享令牌（工作节点需使用 --token {token}）")
+            coordinator = ScanCoordinator(args.coordinator, {
+                "targets": ips.specs,
+                "exclude": ips.exclude.specs if ips.exclude else [],
+                "ports": ports,
+                "timeout": args.timeout,
+                "randomize": args.randomize,
+                "seed": seed,
+                "host_limit": args.host_limit,
+                "retries": args.retries,
+                "retry_backoff": args.retry_backoff,
+                "keep_all": args.keep_all,
+                "happy_eyeballs": args.happy_eyeballs,
+                "port_major": port_major,
+                "tarpit_ratio": args.tarpit_ratio,
+                "tarpit_sample": args.tarpit_sample,
+                "unreachable_limit": args.unreachable_limit,
+                "route_learn": args.route_learn,
+                "check_routes": args.check_routes,
+                "rate": args.rate,
+                "subnet_rate": args.subnet_rate,
+                "http_paths": http_prober.paths if http_prober else None,
+                "http_threads": args.http_threads,
+                "linger0": args.linger0,
+            }, len(ips) * len(ports), args.lease_size, args.lease_timeout, args.keep_all, token)
+            start_time = time.time()
+            scan_results = coordinator.serve()
+            elapsed = time.time() - start_time
+            observed_rate = len(ips) * len(ports) / elapsed if elapsed > 0 else 0.0
+            print_scan_summary(scan_results, port_descriptions, elapsed, observed_rate,
+                               top_hosts=args.top_hosts, summary_format=args.summary)
+            if history:
+                for record in scan_results.iter_records():
+                    history.write(record["ip"], record["port"],
+                                  ResultStore.STATE_NAMES.index(record["status"]),
+                                  record["PortIntroduction"])
+        elif args.udp:
+            scan_results = scan_udp_ports(ips, ports, port_descriptions, args.timeout,
+                                          args.retries, rate_limiter,
+                                          args.randomize, seed, args.keep_all, sinks,
+                                          args.unreachable_limit, args.top_hosts, args.summary)
+        else:
+            # 执行扫描，获取结果
+            scan_results = scan_ips_ports(ips, ports, port_descriptions, args.timeout, threads,
+                                          http_prober=http_prober, rate_limiter=rate_limiter,
+                                          randomize=args.randomize, seed=seed,
+                                          host_limit=args.host_limit, retries=args.retries,
+                                          retry_backoff=args.retry_backoff, keep_all=args.keep_all,
+                                          sinks=sinks, happy_eyeballs=args.happy_eyeballs,
+                                          resources=resources, port_major=port_major,
+                                          time_budget=args.time_budget * 60,
+                                          tarpit_ratio=args.tarpit_ratio,
+                                          tarpit_sample=args.tarpit_sample,
+                                          unreachable_limit=args.unreachable_limit,
+                                          route_learn=args.route_learn,
+                                          check_routes=args.check_routes,
+                                          dashboard=args.dashboard,
+                                          top_hosts=args.top_hosts, summary_format=args.summary)
+        if history:
+            # 按实际完成的探测记录各端口的探测数；UDP的开放统计不计入按开放概率排序端口的历史
+            history.finish_scan(None if args.udp else scan_results.probed)
+            history.close()
+            print(f"{Fore.GREEN}扫描结果已写入历史库: {args.db} (扫描编号 {history.scan_id})")
 
         # 导出结果到Excel
-        export_to_excel(scan_results)
+        excel_exporter(scan_results)
+        if args.jsonl is not None:
+            export_to_jsonl(scan_results, args.jsonl or None)
+
+        # 与上一次结果比对
+        if args.diff_against:
+            port_set = set(ports)
+            previous = sorted_records(lambda: iter_result_file(
+                args.diff_against, history.scan_id if history else None,
+                "udp" if args.udp else "tcp"))
+            coverage = scan_results.coverage
+            report_diff(merge_diff(previous, scan_results.iter_records(sort=True),
+                                   lambda ip, port: ip in ips and port in port_set
+                                   and (coverage is None or coverage.scanned(ip, port))))
 
     except Exception as e:
         print(f"{Fore.RED}错误: {str(e)}")